@@ -0,0 +1,107 @@
+"""
+Agrupamento (debounce) de mensagens consecutivas de um mesmo lead
+
+Usuários do WhatsApp costumam enviar várias mensagens curtas em sequência.
+Em vez de gerar uma resposta para cada uma, as mensagens que chegam dentro
+da janela configurada são unidas em um único turno para a IA.
+
+Os grupos ficam na memória do processo, assim como as faixas de
+fila_whatsapp. Por isso a aplicação roda em um único processo (o Procfile usa
+um worker do gunicorn com várias threads): com dois processos, mensagens do
+mesmo lead poderiam cair em grupos diferentes e ser respondidas duas vezes.
+"""
+import time
+import logging
+import threading
+from config_sistema import obter_config_float
+
+logger = logging.getLogger(__name__)
+
+class AgrupadorMensagens:
+    """Acumula mensagens por lead até que a conversa fique em silêncio pela janela"""
+
+    def __init__(self):
+        self._buffers = {}  # lead_id -> {'textos': [...], 'novo_lead': bool, 'inicio': t, 'ultima': t}
+        self._lock = threading.Lock()
+
+    def adicionar(self, lead_id, texto, novo_lead=False):
+        """
+        Adiciona uma mensagem ao grupo pendente do lead
+
+        Args:
+            lead_id (int): ID do lead
+            texto (str): Conteúdo da mensagem
+            novo_lead (bool): Se o lead acabou de ser criado
+
+        Returns:
+            bool: True se esta mensagem abriu o grupo (o chamador deve responder por ele)
+        """
+        agora = time.monotonic()
+        with self._lock:
+            buffer = self._buffers.get(lead_id)
+            if buffer is None:
+                self._buffers[lead_id] = {
+                    'textos': [texto],
+                    'novo_lead': novo_lead,
+                    'inicio': agora,
+                    'ultima': agora,
+                }
+                return True
+
+            buffer['textos'].append(texto)
+            buffer['novo_lead'] = buffer['novo_lead'] or novo_lead
+            buffer['ultima'] = agora
+            return False
+
+    def tempo_restante(self, lead_id, janela, espera_maxima):
+        """
+        Calcula quanto tempo ainda falta para o grupo do lead ser fechado
+
+        Args:
+            lead_id (int): ID do lead
+            janela (float): Segundos de silêncio necessários para fechar o grupo
+            espera_maxima (float): Tempo máximo (desde a primeira mensagem) antes de responder
+
+        Returns:
+            float: Segundos restantes (0 se o grupo já pode ser respondido)
+        """
+        agora = time.monotonic()
+        with self._lock:
+            buffer = self._buffers.get(lead_id)
+            if buffer is None:
+                return 0.0
+            restante_janela = buffer['ultima'] + janela - agora
+            restante_maximo = buffer['inicio'] + espera_maxima - agora
+            return max(0.0, min(restante_janela, restante_maximo))
+
+    def coletar(self, lead_id):
+        """
+        Fecha o grupo pendente do lead
+
+        Returns:
+            tuple: (textos, novo_lead) com as mensagens agrupadas em ordem de chegada
+        """
+        with self._lock:
+            buffer = self._buffers.pop(lead_id, None)
+        if buffer is None:
+            return [], False
+        return buffer['textos'], buffer['novo_lead']
+
+agrupador = AgrupadorMensagens()
+
+def obter_janela_agrupamento():
+    """
+    Retorna a janela de agrupamento configurada
+
+    Returns:
+        tuple: (janela, espera_maxima) em segundos; janela 0 desativa o agrupamento
+    """
+    janela = max(0.0, obter_config_float('whatsapp_janela_agrupamento', 0.0))
+    espera_maxima = max(janela, obter_config_float('whatsapp_espera_maxima_agrupamento', 10.0))
+    return janela, espera_maxima
+
+def unir_mensagens(textos):
+    """Une as mensagens agrupadas em um único turno do usuário"""
+    if len(textos) > 1:
+        logger.info(f"{len(textos)} mensagens agrupadas em um único turno")
+    return "\n".join(texto for texto in textos if texto)
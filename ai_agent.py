@@ -1,34 +1,164 @@
-import os
 import logging
 import json
-import sys
-from app import db
-from models import Interacao, Lead, BaseConhecimento
+import time
+import asyncio
+import zlib
+import cliente_ia
+from provedores_ia import obter_provedor, MODELO_LEGADO
+from models import Interacao, Lead
+from contexto_async import executar_em_thread
+import cache_respostas
+import cache_semantico
+from conhecimento import (buscar_conhecimento, formatar_trechos, formatar_base_completa, resposta_direta,
+                          recuperador as recuperador_conhecimento)
+import metricas
+from config_sistema import obter_config, obter_config_bool, obter_config_int
+from orcamento_prompt import ajustar_itens, contar_tokens, contar_tokens_mensagens, montar_prompt, obter_orcamentos
+from resumo_conversa import obter_resumo, agendar_resumo
+from sentimento_lote import analise_em_lote_ativa, agendar_analise_em_lote, analisar_por_lexico
+from partes_resposta import DivisorPartes, resposta_em_partes_ativa
+from roteador_modelos import escolher_modelo, registrar_uso as registrar_uso_rota
+from registro_chamadas import (registrar as registrar_chamada, RESULTADO_SUCESSO,
+                               RESULTADO_ERRO, RESULTADO_DISJUNTOR, RESULTADO_LIMITE)
+from limite_taxa import ErroLimiteTaxa, cobranca, cobranca_async, limite_ativo
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
-# Configuração do cliente OpenAI com tratamento de versões diferentes
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-USE_LEGACY_API = False  # Flag para indicar qual versão da API usar
+MODELO_PADRAO = "gpt-4o"
+MODELO_ECONOMICO = "gpt-4o-mini"  # Tarefas de segundo plano (resumos, análises em lote)
 
-try:
-    logger.info("Tentando importar OpenAI SDK novo (v1+)")
-    from openai import OpenAI # type: ignore
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    logger.info("OpenAI client v1+ inicializado com sucesso")
-except (ImportError, TypeError) as e:
-    logger.warning(f"Erro ao inicializar OpenAI novo: {str(e)}")
+MENSAGEM_LEAD_NAO_ENCONTRADO = "Desculpe, houve um problema ao processar sua mensagem."
+MENSAGEM_ERRO_IA = "Desculpe, estamos com um problema técnico no momento. Tente novamente mais tarde."
+
+# Instruções fixas do agente. São o início de todos os prompts de conversa e
+# não podem conter dados do lead: um prefixo idêntico em todas as chamadas é
+# reaproveitado do cache de prompt do provedor (mais barato e mais rápido).
+# Ao alterar o texto, incrementar VERSAO_INSTRUCOES.
+VERSAO_INSTRUCOES = 2
+INSTRUCOES_SISTEMA = """Você é um assistente virtual especializado em nutrição esportiva. Seu nome é NutriAI.
+Seja amigável, profissional e conciso em suas respostas.
+Seu objetivo é dar orientações gerais sobre nutrição esportiva e encaminhar o cliente para nutricionistas humanos para orientações específicas.
+Mantenha suas respostas entre 2 e 4 parágrafos, a menos que seja uma resposta muito simples."""
+
+# Base de conhecimento formatada para o prefixo: (versão da base, texto, tokens)
+_base_prefixo = (None, '', 0)
+
+# Tokens de saída considerados no limite de taxa quando a chamada não define max_tokens
+TOKENS_SAIDA_ESTIMADOS = 500
+
+# Limite de segurança dos turnos posteriores ao resumo buscados no banco (caso os
+# resumos deixem de ser atualizados); o orçamento de tokens decide quantos são enviados
+MAXIMO_TURNOS_APOS_RESUMO = 100
+
+# Valores neutros usados quando a análise de sentimento falha
+ANALISE_NEUTRA = {
+    "sentimento": 0,
+    "prob_conversao": 0.5,
+    "interesse": 0.5,
+    "urgencia": 0
+}
+
+def _registrar_chamada(proposito, provedor, parametros, lead_id, inicio, resposta=None, erro=None,
+                       texto_gerado=None):
+    """
+    Envia ao registro de chamadas (ledger) os dados de uma chamada à IA
+
+    Os tokens vêm do campo usage da resposta; sem ele (streaming), são contados
+    localmente a partir do prompt e do texto gerado.
+    """
+    modelo = MODELO_LEGADO if provedor.legado else parametros.get('model')
+    if erro is not None:
+        if isinstance(erro, cliente_ia.ErroCircuitoAberto):
+            resultado = RESULTADO_DISJUNTOR
+        elif isinstance(erro, ErroLimiteTaxa):
+            resultado = RESULTADO_LIMITE
+        else:
+            resultado = RESULTADO_ERRO
+        registrar_chamada(proposito, modelo, lead_id, segundos=time.perf_counter() - inicio,
+                          resultado=resultado, erro=type(erro).__name__)
+        return
+
+    uso = getattr(resposta, 'usage', None)
+    tokens_entrada = getattr(uso, 'prompt_tokens', None)
+    if tokens_entrada is None:
+        tokens_entrada = contar_tokens_mensagens(parametros.get('messages') or [])
+    tokens_saida = getattr(uso, 'completion_tokens', None)
+    if tokens_saida is None:
+        tokens_saida = contar_tokens(texto_gerado or '')
+
+    # Tokens do prompt reaproveitados do cache do provedor
+    tokens_cacheados = 0
+    if uso is not None:
+        tokens_cacheados = getattr(getattr(uso, 'prompt_tokens_details', None), 'cached_tokens', None) or 0
+        metricas.incrementar('ia_tokens_prompt_api', tokens_entrada)
+        metricas.incrementar('ia_tokens_prompt_cacheados', tokens_cacheados)
+        metricas.incrementar(f'ia_tokens_prompt_api_{proposito}', tokens_entrada)
+        metricas.incrementar(f'ia_tokens_prompt_cacheados_{proposito}', tokens_cacheados)
+
+    registrar_chamada(proposito, modelo, lead_id, tokens_entrada, tokens_saida,
+                      time.perf_counter() - inicio, RESULTADO_SUCESSO, tokens_cacheados=tokens_cacheados)
+
+def _tokens_estimados(parametros):
+    """Tokens que a chamada consome do limite por minuto (o provedor conta o prompt e o max_tokens)"""
+    return (contar_tokens_mensagens(parametros.get('messages') or [])
+            + parametros.get('max_tokens', TOKENS_SAIDA_ESTIMADOS))
+
+def _chamar_chat(proposito, lead_id=None, **parametros):
+    """
+    Faz uma chamada de chat ao provedor de IA configurado, pelo cliente
+    resiliente (prazo, repetições e disjuntor), e a registra no ledger
+
+    Com o limite de taxa ativo, a chamada antes aguarda fichas do limite de
+    requisições e tokens por minuto compartilhado entre os processos; as
+    requisições extras (repetições e duplicadas) são cobradas pelo cliente.
+
+    Args:
+        proposito (str): Nome da chamada (resposta, sentimento, resumo...), usado nas métricas
+        lead_id (int): Lead da conversa, se a chamada for de um único lead
+        **parametros: Argumentos de chat.completions.create
+
+    Returns:
+        Resposta no formato do SDK da OpenAI
+    """
+    provedor = obter_provedor()
+    inicio = time.perf_counter()
+    cobrar = None
     try:
-        logger.info("Tentando importar SDK antigo do OpenAI")
-        # Fallback para versões antigas
-        import openai as client # type: ignore
-        client.api_key = OPENAI_API_KEY
-        USE_LEGACY_API = True
-        logger.info("OpenAI client (legacy) inicializado com sucesso") 
+        if limite_ativo():
+            cobrar = cobranca(proposito, _tokens_estimados(parametros))
+            cobrar()
+            # A espera pelo limite tem métricas próprias e não entra na latência da chamada
+            inicio = time.perf_counter()
+        resposta = cliente_ia.chamar(provedor.criar_chat, proposito, parametros, legado=provedor.legado,
+                                     cobrar=cobrar)
     except Exception as e:
-        logger.error(f"Erro crítico ao inicializar OpenAI: {str(e)}")
-        sys.stderr.write(f"ERRO FATAL: Não foi possível inicializar OpenAI: {str(e)}")
+        _registrar_chamada(proposito, provedor, parametros, lead_id, inicio, erro=e)
+        raise
+    if not parametros.get('stream'):
+        # Chamadas em streaming são registradas por quem consome o fluxo
+        _registrar_chamada(proposito, provedor, parametros, lead_id, inicio, resposta)
+    return resposta
+
+async def _chamar_chat_async(proposito, lead_id=None, **parametros):
+    """Versão assíncrona de _chamar_chat (em uma thread se o provedor não for assíncrono)"""
+    provedor = obter_provedor()
+    if not provedor.suporta_async:
+        return await asyncio.to_thread(_chamar_chat, proposito, lead_id, **parametros)
+    inicio = time.perf_counter()
+    cobrar = None
+    try:
+        if limite_ativo():
+            cobrar = cobranca_async(proposito, _tokens_estimados(parametros))
+            await cobrar()
+            inicio = time.perf_counter()
+        resposta = await cliente_ia.chamar_async(provedor.criar_chat_async, proposito, parametros, cobrar=cobrar)
+    except Exception as e:
+        _registrar_chamada(proposito, provedor, parametros, lead_id, inicio, erro=e)
+        raise
+    if not parametros.get('stream'):
+        _registrar_chamada(proposito, provedor, parametros, lead_id, inicio, resposta)
+    return resposta
 
 def agente_boas_vindas(nome):
     """
@@ -51,82 +181,739 @@ def agente_boas_vindas(nome):
         # Mensagem de fallback caso ocorra algum erro
         return f"Olá {nome}, bem-vindo(a) à NutriAI! Como podemos ajudar você hoje?"
 
-def processar_mensagem(lead_id, mensagem_texto):
+def preparar_conversa(lead_id, mensagem_texto):
+    """
+    Prepara a geração de uma resposta: busca o lead, tenta os caminhos que não
+    precisam da IA e, se nenhum responder, monta o contexto
+
+    Os caminhos são tentados do mais barato para o mais caro: cache exato,
+    resposta direta da base de conhecimento, cache semântico e, por fim, a IA.
+
+    Args:
+        lead_id (int): ID do lead no banco de dados
+        mensagem_texto (str): Texto da mensagem a ser processada
+
+    Returns:
+        dict: Dados da conversa. Se 'resposta' estiver preenchida, ela já pode ser
+              enviada sem chamar a IA; caso contrário, 'mensagens' contém o contexto
+              a ser enviado. 'caminho' indica quem respondeu
+    """
+    # Buscar o lead para personalização
+    lead = Lead.query.get(lead_id)
+    if not lead:
+        logger.error(f"Lead ID {lead_id} não encontrado")
+        return {'resposta': MENSAGEM_LEAD_NAO_ENCONTRADO, 'mensagens': None, 'caminho': 'erro'}
+
+    preparo = {
+        'lead_id': lead_id,
+        'nome': lead.nome,
+        'mensagem_texto': mensagem_texto,
+        'resposta': None,
+        'mensagens': None,
+        'caminho': 'ia',
+        'inicio': time.perf_counter(),
+    }
+
+    # Perguntas repetidas são respondidas pelo cache, sem chamar a IA
+    preparo['resposta'] = cache_respostas.buscar_resposta(mensagem_texto, lead.nome)
+    if preparo['resposta'] is not None:
+        return _caminho_concluido(preparo, 'cache')
+
+    # Apenas os itens da base de conhecimento relevantes para a mensagem vão no prompt
+    preparo['conhecimento'] = buscar_conhecimento(mensagem_texto)
+
+    # Perguntas de rotina com correspondência clara na base são respondidas diretamente
+    item = resposta_direta(preparo['conhecimento'], lead.nome)
+    if item is not None:
+        preparo['resposta'] = item['resposta']
+        logger.info(f"Resposta direta da base de conhecimento (item {item['id']}, "
+                    f"confiança {item['confianca']:.2f})")
+        return _caminho_concluido(preparo, 'base_conhecimento')
+
+    preparo['resposta'] = cache_semantico.buscar_resposta(mensagem_texto, lead.nome)
+    if preparo['resposta'] is not None:
+        return _caminho_concluido(preparo, 'cache_semantico')
+
+    preparo['mensagens'], preparo['tokens'] = montar_mensagens_conversa(lead, mensagem_texto, preparo['conhecimento'])
+
+    # Turnos simples vão para um modelo menor e mais rápido
+    preparo['rota'], preparo['modelo'] = escolher_modelo(mensagem_texto, preparo['conhecimento'],
+                                                         preparo['tokens']['turnos'], MODELO_PADRAO)
+    preparo['preparado_em'] = time.perf_counter()
+    return preparo
+
+def _caminho_concluido(preparo, caminho):
+    """Registra qual caminho respondeu a mensagem (log e métricas)"""
+    preparo['caminho'] = caminho
+    duracao = time.perf_counter() - preparo['inicio']
+    metricas.incrementar(f'respostas_caminho_{caminho}')
+    metricas.registrar_latencia(f'resposta_caminho_{caminho}', duracao)
+
+    tokens = preparo.get('tokens')
+    detalhes = ''
+    if tokens:
+        for secao in ('sistema', 'conhecimento', 'resumo', 'historico', 'mensagem', 'total'):
+            metricas.incrementar(f'ia_tokens_prompt_{secao}', tokens[secao])
+        detalhes = (f" (prompt: {tokens['total']} tokens; sistema {tokens['sistema']}, "
+                    f"conhecimento {tokens['conhecimento']}, resumo {tokens['resumo']}, histórico {tokens['historico']} "
+                    f"em {tokens['turnos']} turnos, mensagem {tokens['mensagem']})")
+
+    logger.info(f"Mensagem do lead {preparo['lead_id']} respondida pelo caminho '{caminho}' "
+                f"em {duracao * 1000:.1f} ms{detalhes}")
+    return preparo
+
+def concluir_conversa(preparo, resposta, interrompida=False):
+    """
+    Registra nos caches a resposta gerada pela IA e a retorna
+
+    Uma resposta interrompida (streaming cortado depois de alguma parte
+    enviada) não entra nos caches nem agenda o resumo: o texto está incompleto
+    e não deve ser repetido a outros leads.
+    """
+    if interrompida:
+        metricas.incrementar('ia_respostas_interrompidas')
+    else:
+        cache_respostas.armazenar_resposta(preparo['mensagem_texto'], resposta, preparo['nome'])
+        cache_semantico.armazenar_resposta(preparo['mensagem_texto'], resposta, preparo['nome'])
+        agendar_resumo(preparo['lead_id'])
+    registrar_uso_rota(preparo['rota'], preparo['modelo'], preparo['tokens']['total'],
+                       contar_tokens(resposta), time.perf_counter() - preparo['preparado_em'])
+    _caminho_concluido(preparo, 'ia')
+    return resposta
+
+def montar_mensagens_conversa(lead, mensagem_texto, conhecimento=None):
+    """
+    Monta as mensagens enviadas à IA para responder um lead, dentro do orçamento
+    de tokens de cada seção do prompt
+
+    Args:
+        lead (Lead): Lead da conversa
+        mensagem_texto (str): Texto da mensagem a ser processada
+        conhecimento (list): Itens relevantes da base de conhecimento
+
+    Returns:
+        tuple: (mensagens no formato da API de chat, relatório de tokens por seção)
+    """
+    orcamentos = obter_orcamentos()
+
+    # Buscar histórico de conversas para contexto; o orçamento decide quanto dele é enviado.
+    # Com um resumo disponível, todos os turnos posteriores a ele são necessários: o
+    # resumo só é atualizado a cada 'ia_resumo_a_cada' interações
+    resumo = obter_resumo(lead.id)
+    limite_historico = max(0, obter_config_int('ia_historico_maximo', 10))
+    consulta = Interacao.query.filter_by(lead_id=lead.id)
+    if resumo is not None:
+        limite_historico = MAXIMO_TURNOS_APOS_RESUMO
+        consulta = consulta.filter(Interacao.id > resumo.ultima_interacao_id)
+    historico = consulta.order_by(Interacao.data_hora.desc()).limit(limite_historico).all()
+    historico.reverse()  # Ordenar do mais antigo para o mais recente
+
+    # As mensagens do usuário ainda sem resposta da IA já estão no histórico, mas
+    # compõem o turno atual (mensagem_texto) e não devem ser enviadas duas vezes
+    while historico and historico[-1].origem != "ia":
+        historico.pop()
+
+    # Com a base completa no prefixo, os trechos recuperados para a mensagem são dispensáveis
+    base = _base_conhecimento_prefixo(orcamentos)
+    if base:
+        trechos = base
+    else:
+        # Itens menos relevantes da base de conhecimento saem primeiro se não couberem
+        trechos, _ = ajustar_itens(conhecimento, formatar_trechos, orcamentos['conhecimento'])
+
+    turnos = []
+    for interacao in historico:
+        if interacao.origem == "usuario":
+            turnos.append({"role": "user", "content": interacao.mensagem})
+        elif interacao.origem == "ia":
+            turnos.append({"role": "assistant", "content": interacao.mensagem})
+
+    texto_resumo = f"Resumo da conversa até aqui:\n{resumo.resumo}" if resumo is not None else ''
+    mensagens, relatorio = montar_prompt(INSTRUCOES_SISTEMA, trechos, turnos, mensagem_texto, orcamentos,
+                                         texto_resumo, contexto=f"Você está conversando com {lead.nome}.",
+                                         conhecimento_no_prefixo=bool(base))
+
+    # Identifica o prefixo enviado: mudanças inesperadas indicam que o cache do provedor deixou de valer
+    relatorio['versao_prefixo'] = (f"{VERSAO_INSTRUCOES}-"
+                                   f"{zlib.crc32(mensagens[0]['content'].encode('utf-8')):08x}")
+    metricas.definir('ia_prompt_versao_prefixo', relatorio['versao_prefixo'])
+    return mensagens, relatorio
+
+def _base_conhecimento_prefixo(orcamentos):
+    """
+    Base de conhecimento completa para o prefixo fixo do prompt
+
+    Com 'kb_prefixo_base_completa' ativo e a base inteira cabendo em
+    'ia_orcamento_base_completa', ela vai no prefixo, igual para todos os leads
+    até ser alterada. Caso contrário, cada mensagem recebe apenas os trechos
+    mais relevantes.
+
+    Returns:
+        str: Texto da base, ou string vazia se ela não for para o prefixo
+    """
+    global _base_prefixo
+    if not obter_config_bool('kb_prefixo_base_completa', False):
+        return ''
+    versao, itens = recuperador_conhecimento.todos()
+    if versao is None or versao != _base_prefixo[0]:
+        texto = formatar_base_completa(itens)
+        _base_prefixo = (versao, texto, contar_tokens(texto))
+    _, texto, tokens = _base_prefixo
+    if tokens > orcamentos['base_completa']:
+        logger.warning(f"Base de conhecimento com {tokens} tokens não cabe no prefixo "
+                       f"({orcamentos['base_completa']}); usando os trechos relevantes")
+        return ''
+    return texto
+
+def processar_mensagem(lead_id, mensagem_texto, ao_receber_parte=None):
     """
     Processa mensagem recebida e gera resposta usando IA
 
     Args:
         lead_id (int): ID do lead no banco de dados
         mensagem_texto (str): Texto da mensagem a ser processada
+        ao_receber_parte (callable): Com 'ia_resposta_em_partes' ativo, a resposta é
+            gerada em streaming e cada parte completa é passada a esta função
+            assim que fica pronta
 
     Returns:
-        str: Resposta gerada pelo sistema
+        str: Resposta gerada pelo sistema (completa, mesmo quando enviada em partes)
     """
     try:
-        # Buscar o lead para personalização
-        lead = Lead.query.get(lead_id)
-        if not lead:
-            logger.error(f"Lead ID {lead_id} não encontrado")
-            return "Desculpe, houve um problema ao processar sua mensagem."
-
-        # Buscar histórico de conversas para contexto
-        historico = Interacao.query.filter_by(lead_id=lead_id).order_by(Interacao.data_hora.desc()).limit(10).all()
-        historico.reverse()  # Ordenar do mais antigo para o mais recente
-
-        # Preparar mensagens para o OpenAI
-        mensagens = [
-            {"role": "system", "content": f"""Você é um assistente virtual especializado em nutrição esportiva. 
-             Seu nome é NutriAI e você está aqui para ajudar {lead.nome}. 
-             Seja amigável, profissional e conciso em suas respostas.
-             Seu objetivo é dar orientações gerais sobre nutrição esportiva e 
-             encaminhar o cliente para nutricionistas humanos para orientações específicas.
-             Mantenha suas respostas entre 2 e 4 parágrafos, a menos que seja uma resposta muito simples."""}
-        ]
-
-        # Adicionar histórico recente à conversa
-        for interacao in historico:
-            if interacao.origem == "usuario":
-                mensagens.append({"role": "user", "content": interacao.mensagem})
-            elif interacao.origem == "ia":
-                mensagens.append({"role": "assistant", "content": interacao.mensagem})
-
-        # Adicionar a mensagem atual
-        mensagens.append({"role": "user", "content": mensagem_texto})
-
-        # Gerar resposta usando o modelo gpt-4o (o mais recente)
+        preparo = preparar_conversa(lead_id, mensagem_texto)
+        if preparo['resposta'] is not None:
+            return preparo['resposta']
+        mensagens = preparo['mensagens']
+
+        if ao_receber_parte is not None and resposta_em_partes_ativa() and obter_provedor().suporta_streaming:
+            resposta, interrompida = _gerar_em_partes(mensagens, ao_receber_parte, preparo['modelo'], lead_id)
+            return concluir_conversa(preparo, resposta, interrompida)
+
+        # Gerar resposta com o modelo escolhido pelo roteador (gpt-4o, o mais recente, nos turnos complexos)
         # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
         # do not change this unless explicitly requested by the user
-        if USE_LEGACY_API:
-            # Usar API antiga para versões anteriores da biblioteca
-            logger.info("Usando API legada (v0) para processar mensagem")
-            resposta = client.ChatCompletion.create(
-                model="gpt-4-turbo",  # Modelo mais compatível com versão antiga
-                messages=mensagens,
+        resposta = _chamar_chat(
+            'resposta',
+            lead_id,
+            model=preparo['modelo'],
+            messages=mensagens,
+            temperature=0.7,
+            max_tokens=500,
+        )
+
+        return concluir_conversa(preparo, resposta.choices[0].message.content)
+
+    except Exception as e:
+        logger.error(f"Erro ao processar mensagem com IA: {str(e)}")
+        return MENSAGEM_ERRO_IA
+
+async def processar_mensagem_async(lead_id, mensagem_texto, ao_receber_parte=None):
+    """
+    Versão assíncrona de processar_mensagem, usada pelo modo ASGI
+
+    A montagem do contexto (consultas ao banco) roda em uma thread e a chamada
+    à IA usa o cliente AsyncOpenAI, sem bloquear o loop de eventos.
+
+    Args:
+        lead_id (int): ID do lead no banco de dados
+        mensagem_texto (str): Texto da mensagem a ser processada
+        ao_receber_parte (callable): Corrotina que recebe cada parte da resposta
+            quando 'ia_resposta_em_partes' está ativo
+
+    Returns:
+        str: Resposta gerada pelo sistema
+    """
+    if not obter_provedor().suporta_async:
+        # O SDK legado não tem cliente assíncrono
+        return await executar_em_thread(processar_mensagem, lead_id, mensagem_texto)
+
+    try:
+        preparo = await executar_em_thread(preparar_conversa, lead_id, mensagem_texto)
+        if preparo['resposta'] is not None:
+            return preparo['resposta']
+
+        if ao_receber_parte is not None and resposta_em_partes_ativa():
+            resposta, interrompida = await _gerar_em_partes_async(preparo['mensagens'], ao_receber_parte,
+                                                                  preparo['modelo'], lead_id)
+            return await executar_em_thread(concluir_conversa, preparo, resposta, interrompida)
+
+        resposta = await _chamar_chat_async(
+            'resposta',
+            lead_id,
+            model=preparo['modelo'],
+            messages=preparo['mensagens'],
+            temperature=0.7,
+            max_tokens=500,
+        )
+        # Os caches e o agendamento do resumo consultam o banco e gravam arquivos
+        return await executar_em_thread(concluir_conversa, preparo, resposta.choices[0].message.content)
+
+    except Exception as e:
+        logger.error(f"Erro ao processar mensagem com IA (assíncrono): {str(e)}")
+        return MENSAGEM_ERRO_IA
+
+def _registrar_parte(divisor, inicio):
+    """Registra as métricas de uma parte da resposta enviada antes do fim da geração"""
+    metricas.incrementar('ia_partes_enviadas')
+    if len(divisor.partes) == 1:
+        metricas.registrar_latencia('ia_tempo_primeira_parte', time.perf_counter() - inicio)
+    logger.info(f"Parte {len(divisor.partes)} da resposta enviada "
+                f"({(time.perf_counter() - inicio) * 1000:.0f} ms após o início da geração)")
+
+def _gerar_em_partes(mensagens, ao_receber_parte, modelo=MODELO_PADRAO, lead_id=None):
+    """
+    Gera a resposta em streaming, entregando cada parte assim que fica completa
+
+    Returns:
+        tuple: (texto, interrompida). Se o streaming falhar depois de alguma parte
+               entregue, o texto é apenas o que já foi entregue e interrompida é True
+    """
+    divisor = DivisorPartes()
+    completo = []
+    inicio = time.perf_counter()
+    parametros = dict(model=modelo, messages=mensagens, temperature=0.7, max_tokens=500, stream=True)
+    fluxo = _chamar_chat('resposta_em_partes', lead_id, **parametros)
+    try:
+        for evento in fluxo:
+            if not evento.choices:
+                continue
+            trecho = evento.choices[0].delta.content or ''
+            completo.append(trecho)
+            for parte in divisor.adicionar(trecho):
+                ao_receber_parte(parte)
+                _registrar_parte(divisor, inicio)
+        parte = divisor.finalizar()
+        if parte:
+            ao_receber_parte(parte)
+            _registrar_parte(divisor, inicio)
+    except Exception as e:
+        _registrar_chamada('resposta_em_partes', obter_provedor(), parametros, lead_id, inicio, erro=e)
+        if not divisor.partes:
+            raise
+        logger.error(f"Streaming da resposta interrompido após {len(divisor.partes)} partes: {str(e)}")
+        return divisor.texto_entregue(), True
+
+    texto = ''.join(completo).strip()
+    _registrar_chamada('resposta_em_partes', obter_provedor(), parametros, lead_id, inicio, texto_gerado=texto)
+    return texto, False
+
+async def _gerar_em_partes_async(mensagens, ao_receber_parte, modelo=MODELO_PADRAO, lead_id=None):
+    """Versão assíncrona de _gerar_em_partes (ao_receber_parte é uma corrotina)"""
+    divisor = DivisorPartes()
+    completo = []
+    inicio = time.perf_counter()
+    parametros = dict(model=modelo, messages=mensagens, temperature=0.7, max_tokens=500, stream=True)
+    fluxo = await _chamar_chat_async('resposta_em_partes', lead_id, **parametros)
+    try:
+        async for evento in fluxo:
+            if not evento.choices:
+                continue
+            trecho = evento.choices[0].delta.content or ''
+            completo.append(trecho)
+            for parte in divisor.adicionar(trecho):
+                await ao_receber_parte(parte)
+                _registrar_parte(divisor, inicio)
+        parte = divisor.finalizar()
+        if parte:
+            await ao_receber_parte(parte)
+            _registrar_parte(divisor, inicio)
+    except Exception as e:
+        _registrar_chamada('resposta_em_partes', obter_provedor(), parametros, lead_id, inicio, erro=e)
+        if not divisor.partes:
+            raise
+        logger.error(f"Streaming da resposta interrompido após {len(divisor.partes)} partes: {str(e)}")
+        return divisor.texto_entregue(), True
+
+    texto = ''.join(completo).strip()
+    _registrar_chamada('resposta_em_partes', obter_provedor(), parametros, lead_id, inicio, texto_gerado=texto)
+    return texto, False
+
+# Instruções acrescentadas ao prompt quando a resposta e a análise vêm na mesma chamada
+INSTRUCOES_ANALISE = """Responda sempre com um JSON com os seguintes campos:
+- resposta: o texto da sua resposta ao cliente
+- sentimento: sentimento da última mensagem do cliente, entre -1 (muito negativo) e 1 (muito positivo)
+- prob_conversao: probabilidade de conversão do cliente entre 0 e 1
+- interesse: nível de interesse do cliente entre 0 e 1
+- urgencia: indicação de urgência na resposta entre 0 e 1"""
+
+# Limites de cada campo numérico da análise
+CAMPOS_ANALISE = {
+    "sentimento": (-1.0, 1.0),
+    "prob_conversao": (0.0, 1.0),
+    "interesse": (0.0, 1.0),
+    "urgencia": (0.0, 1.0),
+}
+
+def resposta_com_analise_ativa():
+    """Indica se a resposta e a análise de sentimento são geradas em uma única chamada"""
+    return obter_config_bool('ia_resposta_com_analise', True)
+
+def _mensagens_com_analise(mensagens):
+    """Acrescenta à mensagem de sistema as instruções da resposta estruturada"""
+    sistema = dict(mensagens[0], content=f"{mensagens[0]['content']}\n\n{INSTRUCOES_ANALISE}")
+    return [sistema] + mensagens[1:]
+
+def _interpretar_resposta_com_analise(conteudo):
+    """
+    Separa o texto da resposta e os campos da análise de uma resposta estruturada
+
+    Returns:
+        tuple: (resposta, analise); analise é None se os campos vierem ausentes ou
+               inválidos. A resposta é o conteúdo bruto se ele for texto simples, e
+               None se for um JSON (completo ou cortado) sem o campo "resposta"
+    """
+    try:
+        dados = json.loads(conteudo)
+    except (TypeError, ValueError):
+        if not conteudo or conteudo.lstrip().startswith(("{", "[")):
+            return None, None
+        return conteudo, None
+    if not isinstance(dados, dict) or not str(dados.get("resposta") or "").strip():
+        return None, None
+
+    resposta = str(dados["resposta"]).strip()
+    try:
+        analise = {campo: min(maximo, max(minimo, float(dados[campo])))
+                   for campo, (minimo, maximo) in CAMPOS_ANALISE.items()}
+    except (KeyError, TypeError, ValueError):
+        return resposta, None
+    return resposta, analise
+
+def processar_mensagem_com_analise(lead_id, mensagem_texto, ao_receber_parte=None):
+    """
+    Gera a resposta e a análise de sentimento da mensagem
+
+    Com 'ia_resposta_com_analise' ativo, a IA devolve um JSON com a resposta e os
+    campos da análise em uma única chamada. Se o JSON vier sem a resposta, ela é
+    gerada de novo por uma chamada comum. Respostas do cache ou da base de
+    conhecimento são analisadas pelo léxico local, sem chamar a IA; a análise
+    separada só é feita quando os campos vieram inválidos. Com a análise em lote
+    ativa, nenhuma análise é feita aqui. Respostas enviadas em partes não podem
+    vir em JSON: nesse caso, a análise é feita em uma chamada separada.
+
+    Args:
+        lead_id (int): ID do lead no banco de dados
+        mensagem_texto (str): Texto da mensagem a ser processada
+        ao_receber_parte (callable): Recebe as partes da resposta (ver processar_mensagem)
+
+    Returns:
+        tuple: (resposta, analise) com a análise no formato de analisar_sentimento_cliente,
+               ou None quando ela fica para a análise em lote
+    """
+    if analise_em_lote_ativa():
+        # O sentimento é calculado depois, pela análise em lote em segundo plano
+        agendar_analise_em_lote()
+        return processar_mensagem(lead_id, mensagem_texto, ao_receber_parte), None
+
+    if not resposta_com_analise_ativa() or (ao_receber_parte is not None and resposta_em_partes_ativa()):
+        resposta = processar_mensagem(lead_id, mensagem_texto, ao_receber_parte)
+        return resposta, analisar_sentimento_cliente(mensagem_texto, lead_id)
+
+    try:
+        preparo = preparar_conversa(lead_id, mensagem_texto)
+        if preparo['resposta'] is not None:
+            return preparo['resposta'], analisar_por_lexico(mensagem_texto)
+        mensagens = _mensagens_com_analise(preparo['mensagens'])
+
+        resposta = _chamar_chat(
+            'resposta_com_analise',
+            lead_id,
+            model=preparo['modelo'],
+            messages=mensagens,
+            response_format={"type": "json_object"},
+            temperature=0.7,
+            max_tokens=600,
+        )
+
+        texto, analise = _interpretar_resposta_com_analise(resposta.choices[0].message.content)
+        if texto is None:
+            logger.warning("Resposta estruturada da IA sem o campo 'resposta', gerando a resposta sem análise")
+            metricas.incrementar('ia_resposta_com_analise_invalida')
+            resposta = _chamar_chat(
+                'resposta',
+                lead_id,
+                model=preparo['modelo'],
+                messages=preparo['mensagens'],
                 temperature=0.7,
                 max_tokens=500,
             )
-        else:
-            # Usar API nova (v1+)
-            logger.info("Usando API moderna (v1+) para processar mensagem")  
-            resposta = client.chat.completions.create(
-                model="gpt-4o",
-                messages=mensagens,
+            texto = resposta.choices[0].message.content
+
+    except Exception as e:
+        logger.error(f"Erro ao processar mensagem com análise: {str(e)}")
+        return MENSAGEM_ERRO_IA, dict(ANALISE_NEUTRA)
+
+    concluir_conversa(preparo, texto)
+    if analise is None:
+        logger.warning("Resposta da IA sem análise válida, analisando sentimento separadamente")
+        analise = analisar_sentimento_cliente(mensagem_texto, lead_id)
+    return texto, analise
+
+async def processar_mensagem_com_analise_async(lead_id, mensagem_texto, ao_receber_parte=None):
+    """
+    Versão assíncrona de processar_mensagem_com_analise, usada pelo modo ASGI
+
+    Returns:
+        tuple: (resposta, analise)
+    """
+    if not obter_provedor().suporta_async:
+        return await executar_em_thread(processar_mensagem_com_analise, lead_id, mensagem_texto)
+
+    if analise_em_lote_ativa():
+        agendar_analise_em_lote()
+        return await processar_mensagem_async(lead_id, mensagem_texto, ao_receber_parte), None
+
+    if not resposta_com_analise_ativa() or (ao_receber_parte is not None and resposta_em_partes_ativa()):
+        # Resposta e análise de sentimento são independentes: rodam em paralelo
+        resposta, analise = await asyncio.gather(
+            processar_mensagem_async(lead_id, mensagem_texto, ao_receber_parte),
+            analisar_sentimento_cliente_async(mensagem_texto, lead_id),
+        )
+        return resposta, analise
+
+    try:
+        preparo = await executar_em_thread(preparar_conversa, lead_id, mensagem_texto)
+        if preparo['resposta'] is not None:
+            return preparo['resposta'], analisar_por_lexico(mensagem_texto)
+
+        resposta = await _chamar_chat_async(
+            'resposta_com_analise',
+            lead_id,
+            model=preparo['modelo'],
+            messages=_mensagens_com_analise(preparo['mensagens']),
+            response_format={"type": "json_object"},
+            temperature=0.7,
+            max_tokens=600,
+        )
+        texto, analise = _interpretar_resposta_com_analise(resposta.choices[0].message.content)
+        if texto is None:
+            logger.warning("Resposta estruturada da IA sem o campo 'resposta', gerando a resposta sem análise")
+            metricas.incrementar('ia_resposta_com_analise_invalida')
+            resposta = await _chamar_chat_async(
+                'resposta',
+                lead_id,
+                model=preparo['modelo'],
+                messages=preparo['mensagens'],
                 temperature=0.7,
                 max_tokens=500,
             )
+            texto = resposta.choices[0].message.content
 
-        return resposta.choices[0].message.content
+    except Exception as e:
+        logger.error(f"Erro ao processar mensagem com análise (assíncrono): {str(e)}")
+        return MENSAGEM_ERRO_IA, dict(ANALISE_NEUTRA)
+
+    await executar_em_thread(concluir_conversa, preparo, texto)
+    if analise is None:
+        logger.warning("Resposta da IA sem análise válida, analisando sentimento separadamente")
+        analise = await analisar_sentimento_cliente_async(mensagem_texto, lead_id)
+    return texto, analise
+
+def gerar_resumos_conversa(conversas):
+    """
+    Atualiza os resumos de várias conversas em uma única chamada a um modelo barato
+
+    Args:
+        conversas (dict): lead_id -> {'nome', 'resumo' (anterior), 'interacoes' (novas)}
+
+    Returns:
+        dict: lead_id -> novo resumo; leads ausentes não puderam ser resumidos
+    """
+    blocos = []
+    for lead_id, conversa in conversas.items():
+        linhas = [f"### Lead {lead_id} ({conversa['nome']})",
+                  f"Resumo anterior: {conversa['resumo'] or '(nenhum)'}",
+                  "Novas mensagens:"]
+        for interacao in conversa['interacoes']:
+            autor = "Cliente" if interacao.origem == "usuario" else "Assistente"
+            linhas.append(f"{autor}: {interacao.mensagem}")
+        blocos.append("\n".join(linhas))
+
+    mensagens = [
+        {"role": "system", "content": """Você resume conversas de uma assistente de nutrição esportiva
+         com clientes. Para cada lead, combine o resumo anterior com as novas mensagens em um
+         novo resumo de no máximo 5 frases, mantendo objetivos, restrições, dados pessoais
+         relevantes, dúvidas pendentes e compromissos assumidos.
+         Retorne um JSON no formato {"<id do lead>": "<novo resumo>"}."""},
+        {"role": "user", "content": "\n\n".join(blocos)}
+    ]
+
+    try:
+        resposta = _chamar_chat(
+            'resumo',
+            model=obter_config('ia_modelo_resumo', MODELO_ECONOMICO),
+            messages=mensagens,
+            response_format={"type": "json_object"},
+            temperature=0.2,
+        )
+
+        resultado = json.loads(resposta.choices[0].message.content)
+        return {int(lead_id): str(resumo).strip() for lead_id, resumo in resultado.items()
+                if str(lead_id).isdigit() and int(lead_id) in conversas}
 
     except Exception as e:
-        logger.error(f"Erro ao processar mensagem com IA: {str(e)}")
-        return "Desculpe, estamos com um problema técnico no momento. Tente novamente mais tarde."
+        logger.error(f"Erro ao gerar resumos de conversa: {str(e)}")
+        return {}
+
+# Instruções comuns às mensagens enviadas por iniciativa do sistema
+INSTRUCOES_MENSAGEM_AGENDADA = """Você é a NutriAI, assistente virtual de uma consultoria
+                 de nutrição esportiva. Escreva mensagens curtas de WhatsApp (até 3 frases),
+                 amigáveis e profissionais, sem incluir links."""
+
+def mensagens_lembrete_formulario(nome, formulario_tipo):
+    """Monta as mensagens da geração de um lembrete de formulário"""
+    tipo = formulario_tipo.replace('_', ' ')
+    return [
+        {"role": "system", "content": INSTRUCOES_MENSAGEM_AGENDADA},
+        {"role": "user", "content": f"""Crie uma mensagem de lembrete para {nome} sobre o
+         formulário de {tipo} que ainda não foi preenchido. A mensagem deve ser educada,
+         mas destacar a importância de preencher o formulário para prosseguir com o
+         atendimento nutricional."""}
+    ]
+
+def lembrete_formulario_padrao(nome, formulario_tipo):
+    """Lembrete de formulário usado quando a IA falha"""
+    return (f"Olá {nome}, não se esqueça de preencher o formulário de {formulario_tipo.replace('_', ' ')} "
+            "para continuarmos com seu atendimento nutricional.")
+
+def mensagens_variantes_lembrete(formulario_tipo, quantidade):
+    """Monta as mensagens da geração de variantes de lembrete para um tipo de formulário"""
+    tipo = formulario_tipo.replace('_', ' ')
+    itens = "\n".join(f"### Variante {numero}" for numero in range(1, quantidade + 1))
+    return [
+        {"role": "system", "content": INSTRUCOES_MENSAGEM_AGENDADA},
+        {"role": "user", "content": f"""Crie {quantidade} versões diferentes de uma mensagem de
+         lembrete sobre o formulário de {tipo} que ainda não foi preenchido. As mensagens devem
+         ser educadas, mas destacar a importância de preencher o formulário para prosseguir com
+         o atendimento nutricional. Varie a abertura e a estrutura das frases e escreva
+         {cache_respostas.MARCADOR_NOME} exatamente onde deve entrar o nome da pessoa.
+         Retorne um JSON no formato {{"<número da variante>": "<mensagem>"}}.
+
+{itens}"""}
+    ]
+
+def mensagens_reativacao(nome, resumo=''):
+    """Monta as mensagens da geração de uma mensagem de reativação de lead inativo"""
+    contexto = f"\n\nResumo da conversa até aqui: {resumo}" if resumo else ''
+    return [
+        {"role": "system", "content": INSTRUCOES_MENSAGEM_AGENDADA},
+        {"role": "user", "content": f"""Crie uma mensagem para retomar o contato com {nome}, que
+         conversou conosco mas não responde há alguns dias. A mensagem deve ser leve, sem
+         pressionar, e convidar a pessoa a continuar o atendimento nutricional.{contexto}"""}
+    ]
+
+def reativacao_padrao(nome):
+    """Mensagem de reativação usada quando a IA falha"""
+    return (f"Olá {nome}, tudo bem? Estamos à disposição para continuar seu atendimento "
+            "nutricional sempre que quiser. É só responder esta mensagem!")
+
+def gerar_lembrete_formulario(lead_id, formulario_tipo):
+    """
+    Gera um lembrete personalizado para um formulário não respondido
+
+    Args:
+        lead_id (int): ID do lead
+        formulario_tipo (str): Tipo do formulário pendente
+
+    Returns:
+        str: Texto do lembrete (um texto padrão se a IA falhar)
+    """
+    lead = Lead.query.get(lead_id)
+    if not lead:
+        return MENSAGEM_LEAD_NAO_ENCONTRADO
+
+    try:
+        resposta = _chamar_chat(
+            'lembrete',
+            lead_id,
+            model=obter_config('ia_modelo_lembrete', MODELO_ECONOMICO),
+            messages=mensagens_lembrete_formulario(lead.nome, formulario_tipo),
+            temperature=0.7,
+        )
+        return resposta.choices[0].message.content.strip()
+
+    except Exception as e:
+        logger.error(f"Erro ao gerar lembrete: {str(e)}")
+        return lembrete_formulario_padrao(lead.nome, formulario_tipo)
+
+def gerar_mensagem_reativacao(lead_id):
+    """
+    Gera uma mensagem para retomar o contato com um lead inativo
+
+    Args:
+        lead_id (int): ID do lead
+
+    Returns:
+        str: Texto da mensagem (um texto padrão se a IA falhar)
+    """
+    lead = Lead.query.get(lead_id)
+    if not lead:
+        return MENSAGEM_LEAD_NAO_ENCONTRADO
+
+    resumo = obter_resumo(lead_id)
+    try:
+        resposta = _chamar_chat(
+            'reativacao',
+            lead_id,
+            model=obter_config('ia_modelo_lembrete', MODELO_ECONOMICO),
+            messages=mensagens_reativacao(lead.nome, resumo.resumo if resumo else ''),
+            temperature=0.7,
+        )
+        return resposta.choices[0].message.content.strip()
+
+    except Exception as e:
+        logger.error(f"Erro ao gerar mensagem de reativação: {str(e)}")
+        return reativacao_padrao(lead.nome)
+
+def gerar_variantes_lembrete(formulario_tipo, quantidade):
+    """
+    Gera variantes de lembrete para um tipo de formulário em uma única chamada
+
+    Args:
+        formulario_tipo (str): Tipo do formulário
+        quantidade (int): Quantidade de variantes pedidas
 
-def analisar_sentimento_cliente(texto):
+    Returns:
+        list: Textos com o marcador do nome do lead (vazia se a IA falhar)
+    """
+    try:
+        resposta = _chamar_chat(
+            'lembrete_variantes',
+            model=obter_config('ia_modelo_lembrete', MODELO_ECONOMICO),
+            messages=mensagens_variantes_lembrete(formulario_tipo, quantidade),
+            response_format={"type": "json_object"},
+            temperature=0.9,
+        )
+
+        resultado = json.loads(resposta.choices[0].message.content)
+        # Links são acrescentados no envio; variantes com links próprios são descartadas
+        return [str(texto).strip() for _, texto in sorted(resultado.items())
+                if str(texto).strip() and 'http' not in str(texto)]
+
+    except Exception as e:
+        logger.error(f"Erro ao gerar variantes de lembrete: {str(e)}")
+        return []
+
+def _mensagens_sentimento(texto):
+    """Monta as mensagens da análise de sentimento"""
+    return [
+        {"role": "system", "content": """Analise o sentimento deste texto de um cliente e retorne 
+         um JSON com os seguintes campos:
+         - sentimento: um número entre -1 (muito negativo) e 1 (muito positivo)
+         - prob_conversao: probabilidade de conversão entre 0 e 1
+         - interesse: nível de interesse do cliente entre 0 e 1
+         - urgencia: indicação de urgência na resposta entre 0 e 1
+         """},
+        {"role": "user", "content": texto}
+    ]
+
+def analisar_sentimento_cliente(texto, lead_id=None):
     """
     Analisa o sentimento do cliente e probabilidade de conversão
 
     Args:
         texto (str): Texto a ser analisado
+        lead_id (int): Lead autor da mensagem, para o registro de chamadas
 
     Returns:
         dict: Dicionário com análise de sentimento e probabilidade de conversão
@@ -135,34 +922,16 @@ def analisar_sentimento_cliente(texto):
         # Chamada à API do OpenAI para análise de sentimento
         # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
         # do not change this unless explicitly requested by the user
-        mensagens_sentimento = [
-            {"role": "system", "content": """Analise o sentimento deste texto de um cliente e retorne 
-             um JSON com os seguintes campos:
-             - sentimento: um número entre -1 (muito negativo) e 1 (muito positivo)
-             - prob_conversao: probabilidade de conversão entre 0 e 1
-             - interesse: nível de interesse do cliente entre 0 e 1
-             - urgencia: indicação de urgência na resposta entre 0 e 1
-             """},
-            {"role": "user", "content": texto}
-        ]
-
-        if USE_LEGACY_API:
-            # Usar API antiga para versões anteriores da biblioteca
-            logger.info("Usando API legada (v0) para análise de sentimento")
-            resposta = client.ChatCompletion.create(
-                model="gpt-4-turbo",  # Modelo mais compatível com versão antiga
-                messages=mensagens_sentimento,
-                temperature=0.3,
-            )
-        else:
-            # Usar API nova (v1+)
-            logger.info("Usando API moderna (v1+) para análise de sentimento")  
-            resposta = client.chat.completions.create(
-                model="gpt-4o",
-                messages=mensagens_sentimento,
-                response_format={"type": "json_object"},
-                temperature=0.3,
-            )
+        mensagens_sentimento = _mensagens_sentimento(texto)
+
+        resposta = _chamar_chat(
+            'sentimento',
+            lead_id,
+            model=MODELO_PADRAO,
+            messages=mensagens_sentimento,
+            response_format={"type": "json_object"},
+            temperature=0.3,
+        )
 
         # Processar resultado
         resultado = json.loads(resposta.choices[0].message.content)
@@ -171,9 +940,95 @@ def analisar_sentimento_cliente(texto):
     except Exception as e:
         logger.error(f"Erro ao analisar sentimento: {str(e)}")
         # Retornar valores neutros em caso de erro
-        return {
-            "sentimento": 0,
-            "prob_conversao": 0.5,
-            "interesse": 0.5,
-            "urgencia": 0
-        }
\ No newline at end of file
+        return dict(ANALISE_NEUTRA)
+
+async def analisar_sentimento_cliente_async(texto, lead_id=None):
+    """
+    Versão assíncrona de analisar_sentimento_cliente, usada pelo modo ASGI
+
+    Args:
+        texto (str): Texto a ser analisado
+        lead_id (int): Lead autor da mensagem, para o registro de chamadas
+
+    Returns:
+        dict: Dicionário com análise de sentimento e probabilidade de conversão
+    """
+    if not obter_provedor().suporta_async:
+        return await executar_em_thread(analisar_sentimento_cliente, texto, lead_id)
+
+    try:
+        resposta = await _chamar_chat_async(
+            'sentimento',
+            lead_id,
+            model=MODELO_PADRAO,
+            messages=_mensagens_sentimento(texto),
+            response_format={"type": "json_object"},
+            temperature=0.3,
+        )
+        return json.loads(resposta.choices[0].message.content)
+
+    except Exception as e:
+        logger.error(f"Erro ao analisar sentimento (assíncrono): {str(e)}")
+        return dict(ANALISE_NEUTRA)
+
+def analisar_sentimentos_em_lote(mensagens):
+    """
+    Analisa o sentimento de várias mensagens de clientes em uma única chamada
+
+    Args:
+        mensagens (dict): ID da interação -> texto da mensagem
+
+    Returns:
+        dict: ID da interação -> análise (mesmos campos de analisar_sentimento_cliente);
+              mensagens ausentes não puderam ser analisadas
+    """
+    conteudo = "\n\n".join(f"### Mensagem {interacao_id}\n{texto}"
+                             for interacao_id, texto in mensagens.items())
+    mensagens_analise = [
+        {"role": "system", "content": """Analise o sentimento de cada uma das mensagens de clientes
+         abaixo e retorne um JSON no formato {"<id da mensagem>": {...}}, em que cada objeto
+         tem os seguintes campos:
+         - sentimento: um número entre -1 (muito negativo) e 1 (muito positivo)
+         - prob_conversao: probabilidade de conversão entre 0 e 1
+         - interesse: nível de interesse do cliente entre 0 e 1
+         - urgencia: indicação de urgência na resposta entre 0 e 1
+         """},
+        {"role": "user", "content": conteudo}
+    ]
+
+    try:
+        resposta = _chamar_chat(
+            'sentimento_lote',
+            model=obter_config('ia_modelo_analise_lote', MODELO_ECONOMICO),
+            messages=mensagens_analise,
+            response_format={"type": "json_object"},
+            temperature=0.3,
+        )
+        resultado = json.loads(resposta.choices[0].message.content)
+
+    except Exception as e:
+        logger.error(f"Erro ao analisar sentimentos em lote: {str(e)}")
+        return {}
+
+    analises = {}
+    for interacao_id, campos in resultado.items():
+        if not str(interacao_id).isdigit() or int(interacao_id) not in mensagens:
+            continue
+        try:
+            analises[int(interacao_id)] = {campo: min(maximo, max(minimo, float(campos[campo])))
+                                           for campo, (minimo, maximo) in CAMPOS_ANALISE.items()}
+        except (KeyError, TypeError, ValueError, AttributeError):
+            continue
+    return analises
+
+def estatisticas_cache_prompt():
+    """Proporção dos tokens de prompt servidos do cache do provedor (informada pela API)"""
+    enviados = metricas.obter_contador('ia_tokens_prompt_api')
+    cacheados = metricas.obter_contador('ia_tokens_prompt_cacheados')
+    return {
+        'tokens_prompt': enviados,
+        'tokens_cacheados': cacheados,
+        'proporcao_cacheada': round(cacheados / enviados, 3) if enviados else 0.0,
+    }
+
+metricas.registrar_coletor('cache_prompt', estatisticas_cache_prompt)
@@ -64,6 +64,9 @@ def init_db():
 # Iniciar o agendador
 def start_scheduler():
     if not scheduler.running:
+        # Importar aqui para evitar importações circulares
+        from mensagens_agendadas import agendar_tarefas
+        agendar_tarefas(scheduler)
         scheduler.start()
         logger.info("Agendador em segundo plano iniciado")
 
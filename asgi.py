@@ -0,0 +1,61 @@
+"""
+Ponto de entrada ASGI (modo assíncrono)
+
+Uso: uvicorn asgi:app --host 0.0.0.0 --port $PORT
+
+O webhook do WhatsApp é atendido pelo pipeline assíncrono (pipeline_async);
+todas as demais rotas, incluindo o painel administrativo, continuam sendo
+servidas pela aplicação Flask de main:app sem alterações.
+"""
+import logging
+from urllib.parse import parse_qs
+from asgiref.wsgi import WsgiToAsgi # type: ignore
+from main import app as flask_app
+from pipeline_async import receber_mensagem_whatsapp, fechar_clientes
+
+logger = logging.getLogger(__name__)
+
+ROTA_WEBHOOK_WHATSAPP = '/webhook/whatsapp'
+
+_flask_asgi = WsgiToAsgi(flask_app)
+
+async def app(scope, receive, send):
+    """Aplicação ASGI que encaminha o webhook ao pipeline assíncrono e o resto ao Flask"""
+    if scope['type'] == 'lifespan':
+        await _ciclo_de_vida(receive, send)
+    elif (scope['type'] == 'http' and scope['method'] == 'POST'
+          and scope['path'] == ROTA_WEBHOOK_WHATSAPP):
+        await _webhook_whatsapp(receive, send)
+    else:
+        await _flask_asgi(scope, receive, send)
+
+async def _webhook_whatsapp(receive, send):
+    corpo = b''
+    while True:
+        mensagem = await receive()
+        corpo += mensagem.get('body', b'')
+        if not mensagem.get('more_body'):
+            break
+
+    dados = {chave: valores[0] for chave, valores in
+             parse_qs(corpo.decode('utf-8'), keep_blank_values=True).items()}
+    twiml = (await receber_mensagem_whatsapp(dados)).encode('utf-8')
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/xml; charset=utf-8'),
+                    (b'content-length', str(len(twiml)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': twiml})
+
+async def _ciclo_de_vida(receive, send):
+    while True:
+        mensagem = await receive()
+        if mensagem['type'] == 'lifespan.startup':
+            logger.info("Aplicação ASGI iniciada")
+            await send({'type': 'lifespan.startup.complete'})
+        elif mensagem['type'] == 'lifespan.shutdown':
+            await fechar_clientes()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
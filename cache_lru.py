@@ -0,0 +1,55 @@
+"""
+Cache em memória com expiração (TTL) e descarte do item menos usado (LRU)
+"""
+import time
+import threading
+from collections import OrderedDict
+
+class CacheLRU:
+    """Dicionário limitado, seguro para threads, com expiração por tempo"""
+
+    def __init__(self, tamanho_maximo=1000, ttl=3600):
+        """
+        Args:
+            tamanho_maximo (int): Quantidade máxima de itens mantidos
+            ttl (float): Tempo de vida de cada item em segundos (None para não expirar)
+        """
+        self.tamanho_maximo = tamanho_maximo
+        self.ttl = ttl
+        self._itens = OrderedDict()  # chave -> (expira_em, valor)
+        self._lock = threading.Lock()
+
+    def obter(self, chave, padrao=None):
+        """Retorna o valor da chave, ou o padrão se ausente ou expirado"""
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                return padrao
+            expira_em, valor = item
+            if expira_em is not None and expira_em < time.monotonic():
+                del self._itens[chave]
+                return padrao
+            self._itens.move_to_end(chave)
+            return valor
+
+    def definir(self, chave, valor):
+        """Armazena um valor, descartando os itens menos usados se necessário"""
+        expira_em = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._itens[chave] = (expira_em, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.tamanho_maximo:
+                self._itens.popitem(last=False)
+
+    def remover(self, chave):
+        """Remove a chave do cache, se existir"""
+        with self._lock:
+            self._itens.pop(chave, None)
+
+    def limpar(self):
+        """Remove todos os itens"""
+        with self._lock:
+            self._itens.clear()
+
+    def __len__(self):
+        return len(self._itens)
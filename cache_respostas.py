@@ -0,0 +1,132 @@
+"""
+Cache de respostas da IA para perguntas repetidas
+
+Perguntas frequentes ("quanto custa?", "como funciona?") chegam quase sempre
+com o mesmo texto. A chave do cache é o texto normalizado (minúsculas, sem
+acentos nem pontuação) junto com a versão da base de conhecimento, de modo que
+qualquer alteração na base invalida as respostas antigas. As respostas são
+guardadas sem o nome do lead, que é preenchido novamente a cada acerto.
+"""
+import re
+import logging
+from cache_lru import CacheLRU
+from config_sistema import obter_config_bool, obter_config_int
+from conhecimento import versao_base_conhecimento
+from normalizacao import normalizar_texto
+import metricas
+
+logger = logging.getLogger(__name__)
+
+MARCADOR_NOME = '[nome]'
+
+# Palavras que indicam que a pergunta depende da situação pessoal do lead ou
+# de mensagens anteriores da conversa; essas respostas não são compartilhadas
+PALAVRAS_PESSOAIS = {
+    'eu', 'me', 'mim', 'meu', 'minha', 'meus', 'minhas', 'comigo',
+    'estou', 'tenho', 'tive', 'fiz', 'comi', 'bebi', 'treinei', 'sou', 'fui',
+    'peso', 'kg', 'quilos', 'altura', 'idade', 'anos',
+    'isso', 'isto', 'esse', 'essa', 'esses', 'essas', 'disso', 'nisso', 'desse', 'dessa',
+    'ele', 'ela', 'eles', 'elas', 'aquele', 'aquela', 'anterior', 'acima',
+    'voce', 'falou', 'disse', 'mandou', 'enviou',
+}
+
+MIN_PALAVRAS = 2
+MAX_PALAVRAS = 30
+
+_cache = CacheLRU()
+
+def _configurar_cache():
+    _cache.tamanho_maximo = max(1, obter_config_int('ia_cache_tamanho', 1000))
+    _cache.ttl = max(1, obter_config_int('ia_cache_ttl_segundos', 3600))
+
+def cache_ativo():
+    """Indica se o cache de respostas está habilitado ('ia_cache_respostas')"""
+    return obter_config_bool('ia_cache_respostas', True)
+
+def pergunta_cacheavel(texto_normalizado):
+    """
+    Verifica se a resposta para a pergunta pode ser reaproveitada por outros leads
+
+    Args:
+        texto_normalizado (str): Pergunta já normalizada
+
+    Returns:
+        bool: False se a pergunta é curta/longa demais ou depende do contexto pessoal
+    """
+    palavras = texto_normalizado.split()
+    if not MIN_PALAVRAS <= len(palavras) <= MAX_PALAVRAS:
+        return False
+    if any(palavra.isdigit() for palavra in palavras):
+        return False
+    return not PALAVRAS_PESSOAIS.intersection(palavras)
+
+def _chave(texto_normalizado):
+    return (versao_base_conhecimento(), texto_normalizado)
+
+def buscar_resposta(mensagem_texto, nome_lead):
+    """
+    Busca uma resposta já gerada para a mesma pergunta
+
+    Args:
+        mensagem_texto (str): Mensagem do lead
+        nome_lead (str): Nome usado para personalizar a resposta
+
+    Returns:
+        str: Resposta personalizada, ou None se não houver resposta reaproveitável
+    """
+    if not cache_ativo():
+        return None
+
+    texto_normalizado = normalizar_texto(mensagem_texto)
+    if not pergunta_cacheavel(texto_normalizado):
+        metricas.incrementar('cache_respostas_ignoradas')
+        return None
+
+    _configurar_cache()
+    resposta = _cache.obter(_chave(texto_normalizado))
+    if resposta is None:
+        metricas.incrementar('cache_respostas_falhas')
+        return None
+
+    metricas.incrementar('cache_respostas_acertos')
+    logger.info(f"Resposta obtida do cache para a pergunta: {texto_normalizado}")
+    return resposta.replace(MARCADOR_NOME, nome_lead)
+
+def armazenar_resposta(mensagem_texto, resposta, nome_lead):
+    """
+    Guarda a resposta gerada pela IA para reaproveitamento
+
+    Args:
+        mensagem_texto (str): Mensagem do lead
+        resposta (str): Resposta gerada
+        nome_lead (str): Nome do lead, substituído por um marcador antes de guardar
+    """
+    if not cache_ativo() or not resposta:
+        return
+
+    texto_normalizado = normalizar_texto(mensagem_texto)
+    if not pergunta_cacheavel(texto_normalizado):
+        return
+
+    _configurar_cache()
+    _cache.definir(_chave(texto_normalizado), despersonalizar(resposta, nome_lead))
+
+def despersonalizar(resposta, nome_lead):
+    """Substitui o nome do lead na resposta pelo marcador [nome]"""
+    if nome_lead and len(nome_lead) >= 3:
+        resposta = re.sub(rf'\b{re.escape(nome_lead)}\b', MARCADOR_NOME, resposta)
+    return resposta
+
+def estatisticas():
+    """Retorna tamanho e taxa de acerto do cache"""
+    acertos = metricas.obter_contador('cache_respostas_acertos')
+    falhas = metricas.obter_contador('cache_respostas_falhas')
+    return {
+        'itens': len(_cache),
+        'acertos': acertos,
+        'falhas': falhas,
+        'ignoradas': metricas.obter_contador('cache_respostas_ignoradas'),
+        'taxa_acerto': round(acertos / (acertos + falhas), 3) if acertos + falhas else 0.0,
+    }
+
+metricas.registrar_coletor('cache_respostas', estatisticas)
@@ -0,0 +1,313 @@
+"""
+Cache semântico de respostas (perguntas parecidas, não apenas idênticas)
+
+Cada pergunta é representada localmente, sem chamadas externas, por um vetor
+TF-IDF de n-gramas de caracteres com hashing (dimensão fixa). Os vetores ficam
+em uma matriz NumPy e a pergunta mais parecida é encontrada por similaridade de
+cosseno vetorizada. Se a similaridade passar do limiar configurado, a resposta
+guardada é reaproveitada. O índice é atualizado a cada nova resposta, tem
+tamanho limitado (descarta o item usado há mais tempo) e é salvo em disco
+para que os processos iniciem com o cache já preenchido.
+"""
+import os
+import json
+import time
+import zlib
+import logging
+import threading
+from config_sistema import obter_config, obter_config_bool, obter_config_int, obter_config_float
+from conhecimento import versao_base_conhecimento
+from normalizacao import normalizar_texto
+from cache_respostas import pergunta_cacheavel, despersonalizar, MARCADOR_NOME
+import metricas
+
+try:
+    import numpy as np # type: ignore
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+DIMENSAO = 2048
+TAMANHOS_NGRAMA = (3, 4)
+
+# Quantidade de novas respostas entre gravações do índice em disco
+GRAVAR_A_CADA = 20
+
+def vetorizar(texto_normalizado):
+    """
+    Converte um texto normalizado no vetor de frequências de n-gramas (com hashing)
+
+    Args:
+        texto_normalizado (str): Texto já normalizado
+
+    Returns:
+        numpy.ndarray: Vetor float32 de tamanho DIMENSAO com frequências sublineares
+    """
+    vetor = np.zeros(DIMENSAO, dtype=np.float32)
+    texto = f" {texto_normalizado} "
+    for tamanho in TAMANHOS_NGRAMA:
+        for inicio in range(len(texto) - tamanho + 1):
+            vetor[zlib.crc32(texto[inicio:inicio + tamanho].encode('utf-8')) % DIMENSAO] += 1.0
+    presentes = vetor > 0
+    vetor[presentes] = 1.0 + np.log(vetor[presentes])
+    return vetor
+
+class IndiceSemantico:
+    """Índice de perguntas e respostas com busca por similaridade de cosseno"""
+
+    def __init__(self, capacidade):
+        self.capacidade = capacidade
+        self.versao_base = None
+        self._frequencias = np.zeros((capacidade, DIMENSAO), dtype=np.float32)
+        self._documentos = np.zeros(DIMENSAO, dtype=np.float32)  # em quantas perguntas cada n-grama aparece
+        self._ultimo_uso = np.zeros(capacidade, dtype=np.float64)
+        self._ocupado = np.zeros(capacidade, dtype=bool)
+        self._perguntas = [None] * capacidade
+        self._respostas = [None] * capacidade
+        self._posicoes = {}  # pergunta -> posição na matriz
+
+    def __len__(self):
+        return len(self._posicoes)
+
+    def _idf(self):
+        total = len(self._posicoes)
+        return np.log((1.0 + total) / (1.0 + self._documentos)) + 1.0
+
+    def buscar(self, texto_normalizado, limiar):
+        """
+        Busca a pergunta guardada mais parecida
+
+        Só conta como uso (para o descarte) quando a similaridade passa do limiar.
+
+        Returns:
+            tuple: (similaridade, resposta), ou (0.0, None) se o índice estiver vazio
+        """
+        if not self._posicoes:
+            return 0.0, None
+
+        idf = self._idf()
+        consulta = vetorizar(texto_normalizado) * idf
+        norma_consulta = np.linalg.norm(consulta)
+        if norma_consulta == 0:
+            return 0.0, None
+
+        posicoes = np.flatnonzero(self._ocupado)
+        matriz = self._frequencias[posicoes] * idf
+        normas = np.linalg.norm(matriz, axis=1)
+        similaridades = (matriz @ consulta) / np.maximum(normas * norma_consulta, 1e-12)
+
+        melhor = int(np.argmax(similaridades))
+        posicao = posicoes[melhor]
+        similaridade = float(similaridades[melhor])
+        if similaridade >= limiar:
+            self._ultimo_uso[posicao] = time.time()
+        return similaridade, self._respostas[posicao]
+
+    def adicionar(self, texto_normalizado, resposta):
+        """Adiciona (ou atualiza) uma pergunta, descartando a menos usada se estiver cheio"""
+        posicao = self._posicoes.get(texto_normalizado)
+        if posicao is not None:
+            self._respostas[posicao] = resposta
+            self._ultimo_uso[posicao] = time.time()
+            return
+
+        if len(self._posicoes) < self.capacidade:
+            posicao = int(np.flatnonzero(~self._ocupado)[0])
+        else:
+            posicao = int(np.argmin(self._ultimo_uso))
+            self._remover(posicao)
+
+        vetor = vetorizar(texto_normalizado)
+        self._frequencias[posicao] = vetor
+        self._documentos += vetor > 0
+        self._ultimo_uso[posicao] = time.time()
+        self._ocupado[posicao] = True
+        self._perguntas[posicao] = texto_normalizado
+        self._respostas[posicao] = resposta
+        self._posicoes[texto_normalizado] = posicao
+
+    def _remover(self, posicao):
+        self._documentos -= self._frequencias[posicao] > 0
+        self._frequencias[posicao] = 0
+        self._ocupado[posicao] = False
+        self._ultimo_uso[posicao] = 0
+        del self._posicoes[self._perguntas[posicao]]
+        self._perguntas[posicao] = None
+        self._respostas[posicao] = None
+
+    def instantaneo(self):
+        """Copia o estado do índice para ser gravado sem segurar o lock"""
+        return {
+            'frequencias': self._frequencias.copy(),
+            'documentos': self._documentos.copy(),
+            'ultimo_uso': self._ultimo_uso.copy(),
+            'ocupado': self._ocupado.copy(),
+            'textos': {
+                'versao_base': self.versao_base,
+                'perguntas': list(self._perguntas),
+                'respostas': list(self._respostas),
+            },
+        }
+
+    @staticmethod
+    def salvar(instantaneo, caminho):
+        """Grava em disco (de forma atômica) um instantâneo do índice"""
+        temporario = f"{caminho}.{os.getpid()}.tmp"
+        with open(temporario, 'wb') as arquivo:
+            np.savez_compressed(arquivo,
+                                frequencias=instantaneo['frequencias'],
+                                documentos=instantaneo['documentos'],
+                                ultimo_uso=instantaneo['ultimo_uso'],
+                                ocupado=instantaneo['ocupado'],
+                                textos=np.array(json.dumps(instantaneo['textos'])))
+        os.replace(temporario, caminho)
+
+    @classmethod
+    def carregar(cls, caminho, capacidade):
+        """Carrega um índice salvo; retorna None se o arquivo não for compatível"""
+        with np.load(caminho, allow_pickle=False) as dados:
+            if dados['frequencias'].shape != (capacidade, DIMENSAO):
+                return None
+            textos = json.loads(str(dados['textos']))
+            indice = cls(capacidade)
+            indice._frequencias = dados['frequencias'].copy()
+            indice._documentos = dados['documentos'].copy()
+            indice._ultimo_uso = dados['ultimo_uso'].copy()
+            indice._ocupado = dados['ocupado'].copy()
+        indice.versao_base = textos['versao_base']
+        indice._perguntas = textos['perguntas']
+        indice._respostas = textos['respostas']
+        indice._posicoes = {pergunta: posicao for posicao, pergunta in enumerate(indice._perguntas)
+                            if pergunta is not None}
+        return indice
+
+_indice = None
+_alteracoes = 0
+_gravando = False
+_lock = threading.Lock()
+
+def cache_ativo():
+    """Indica se o cache semântico está habilitado ('ia_cache_semantico') e disponível"""
+    if not obter_config_bool('ia_cache_semantico', False):
+        return False
+    if np is None:
+        logger.warning("Cache semântico habilitado, mas o NumPy não está instalado")
+        return False
+    return True
+
+def _caminho_arquivo():
+    return obter_config('ia_cache_semantico_arquivo', 'cache_semantico.npz')
+
+def _obter_indice():
+    """Retorna o índice, carregando-o do disco na primeira utilização"""
+    global _indice
+    if _indice is None:
+        capacidade = max(1, obter_config_int('ia_cache_semantico_tamanho', 2000))
+        caminho = _caminho_arquivo()
+        if os.path.exists(caminho):
+            try:
+                _indice = IndiceSemantico.carregar(caminho, capacidade)
+                if _indice is not None:
+                    logger.info(f"Cache semântico carregado de {caminho} com {len(_indice)} perguntas")
+            except Exception as e:
+                logger.error(f"Erro ao carregar cache semântico: {str(e)}")
+        if _indice is None:
+            _indice = IndiceSemantico(capacidade)
+
+    # Respostas antigas deixam de valer quando a base de conhecimento muda
+    versao = versao_base_conhecimento()
+    if _indice.versao_base != versao:
+        if len(_indice):
+            logger.info("Base de conhecimento alterada; cache semântico reiniciado")
+        _indice = IndiceSemantico(_indice.capacidade)
+        _indice.versao_base = versao
+    return _indice
+
+def buscar_resposta(mensagem_texto, nome_lead):
+    """
+    Busca a resposta de uma pergunta suficientemente parecida
+
+    Args:
+        mensagem_texto (str): Mensagem do lead
+        nome_lead (str): Nome usado para personalizar a resposta
+
+    Returns:
+        str: Resposta personalizada, ou None se nenhuma pergunta passar do limiar
+    """
+    if not cache_ativo():
+        return None
+
+    texto_normalizado = normalizar_texto(mensagem_texto)
+    if not pergunta_cacheavel(texto_normalizado):
+        return None
+
+    limiar = obter_config_float('ia_cache_semantico_limiar', 0.9)
+    inicio = time.perf_counter()
+    with _lock:
+        similaridade, resposta = _obter_indice().buscar(texto_normalizado, limiar)
+    metricas.registrar_latencia('cache_semantico_busca', time.perf_counter() - inicio)
+
+    if resposta is None or similaridade < limiar:
+        metricas.incrementar('cache_semantico_falhas')
+        return None
+
+    metricas.incrementar('cache_semantico_acertos')
+    logger.info(f"Resposta obtida do cache semântico (similaridade {similaridade:.3f}): {texto_normalizado}")
+    return resposta.replace(MARCADOR_NOME, nome_lead)
+
+def armazenar_resposta(mensagem_texto, resposta, nome_lead):
+    """
+    Adiciona a pergunta e a resposta gerada pela IA ao índice
+
+    Args:
+        mensagem_texto (str): Mensagem do lead
+        resposta (str): Resposta gerada
+        nome_lead (str): Nome do lead, substituído por um marcador antes de guardar
+    """
+    global _alteracoes, _gravando
+
+    if not cache_ativo() or not resposta:
+        return
+
+    texto_normalizado = normalizar_texto(mensagem_texto)
+    if not pergunta_cacheavel(texto_normalizado):
+        return
+
+    with _lock:
+        indice = _obter_indice()
+        indice.adicionar(texto_normalizado, despersonalizar(resposta, nome_lead))
+        _alteracoes += 1
+        if _alteracoes < GRAVAR_A_CADA or _gravando:
+            return
+        _alteracoes = 0
+        _gravando = True
+        instantaneo = indice.instantaneo()
+
+    # A compressão e a escrita em disco ficam fora do lock e da requisição
+    threading.Thread(target=_gravar, args=(instantaneo, _caminho_arquivo()),
+                     name='cache-semantico-gravacao', daemon=True).start()
+
+def _gravar(instantaneo, caminho):
+    """Grava o instantâneo do índice em disco"""
+    global _gravando
+    try:
+        IndiceSemantico.salvar(instantaneo, caminho)
+    except Exception as e:
+        logger.error(f"Erro ao salvar cache semântico: {str(e)}")
+    finally:
+        with _lock:
+            _gravando = False
+
+def estatisticas():
+    """Retorna tamanho e taxa de acerto do cache semântico"""
+    acertos = metricas.obter_contador('cache_semantico_acertos')
+    falhas = metricas.obter_contador('cache_semantico_falhas')
+    return {
+        'itens': len(_indice) if _indice is not None else 0,
+        'acertos': acertos,
+        'falhas': falhas,
+        'taxa_acerto': round(acertos / (acertos + falhas), 3) if acertos + falhas else 0.0,
+    }
+
+metricas.registrar_coletor('cache_semantico', estatisticas)
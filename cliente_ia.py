@@ -0,0 +1,677 @@
+"""
+Chamadas resilientes à API da OpenAI
+
+Cada chamada tem um prazo total: o timeout de cada tentativa é limitado ao
+tempo que ainda resta, para que uma falha lenta do provedor não prenda a
+thread pelo timeout inteiro do socket. Erros transitórios (429, 5xx, timeouts
+e falhas de conexão) são repetidos com espera exponencial aleatorizada,
+respeitando o Retry-After quando informado. Um disjuntor conta as falhas
+consecutivas do provedor e, quando ele está degradado, rejeita as chamadas
+imediatamente (os chamadores usam suas respostas de contingência) até que
+uma chamada de teste volte a funcionar.
+
+Com 'ia_hedge' ativo, as chamadas que respondem ao lead podem ser duplicadas
+(hedging): se a chamada principal não terminar até o percentil configurado
+da latência observada, uma segunda chamada igual (ou com outro modelo) é
+disparada, vale a que terminar primeiro e a outra é cancelada. Um orçamento
+limita a fração de chamadas duplicadas, para que a duplicação não dobre o
+custo nem a carga sobre o provedor quando ele inteiro estiver lento.
+
+Cada tentativa (inclusive as duplicadas) ocupa uma vaga do limite adaptativo
+de concorrência (concorrencia_ia), que cresce enquanto o provedor responde
+bem e é reduzido em falhas transitórias e picos de latência. Em streaming, a
+vaga fica ocupada até o stream ser lido por inteiro ou fechado.
+
+Com o limite de taxa ativo, cada repetição aguarda novas fichas do limite de
+requisições e tokens por minuto, como a primeira tentativa, e uma chamada só
+é duplicada se houver fichas disponíveis na hora.
+"""
+import time
+import random
+import asyncio
+import logging
+import threading
+from concurrent import futures
+import httpx
+from config_sistema import obter_config, obter_config_bool, obter_config_int, obter_config_float
+from concorrencia_ia import (ErroConcorrenciaEsgotada, VagaConcorrencia, concorrencia_adaptativa_ativa,
+                             limite_concorrencia)
+import metricas
+
+try:
+    import openai # type: ignore
+except ImportError:
+    openai = None
+
+logger = logging.getLogger(__name__)
+
+# Conexões HTTP mantidas abertas (keep-alive) com a API
+LIMITES_CONEXOES = httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60)
+
+# Códigos HTTP que indicam falha transitória do provedor
+STATUS_TRANSITORIOS = {408, 409, 429, 500, 502, 503, 504}
+
+class ErroCircuitoAberto(Exception):
+    """Chamada rejeitada porque o disjuntor está aberto"""
+
+class DisjuntorCircuito:
+    """Disjuntor de três estados (fechado, aberto e meio aberto) para o provedor de IA"""
+
+    FECHADO = 'fechado'
+    ABERTO = 'aberto'
+    MEIO_ABERTO = 'meio_aberto'
+
+    def __init__(self):
+        self.estado = self.FECHADO
+        self.falhas_consecutivas = 0
+        self.aberturas = 0
+        self._aberto_em = 0.0
+        self._teste_em_andamento = False
+        self._lock = threading.Lock()
+
+    def permitir(self):
+        """Indica se uma chamada pode ser feita agora"""
+        return self.admitir() is not None
+
+    def admitir(self):
+        """
+        Admite uma chamada, se possível
+
+        Com o disjuntor aberto, após 'ia_disjuntor_espera' segundos uma única
+        chamada de teste é liberada (estado meio aberto). A chamada de teste
+        deve terminar com registrar_sucesso, registrar_falha ou liberar_teste.
+
+        Returns:
+            bool: True para a chamada de teste, False para uma chamada comum,
+            None se a chamada foi rejeitada
+        """
+        with self._lock:
+            if self.estado == self.FECHADO:
+                return False
+            if self.estado == self.ABERTO:
+                if time.monotonic() - self._aberto_em < obter_config_float('ia_disjuntor_espera', 30.0):
+                    return None
+                self.estado = self.MEIO_ABERTO
+                self._teste_em_andamento = False
+            if self._teste_em_andamento:
+                return None
+            self._teste_em_andamento = True
+            return True
+
+    def liberar_teste(self):
+        """
+        Libera a vaga da chamada de teste que terminou sem resposta do provedor
+        (vaga de concorrência esgotada, cancelamento...), para que outra
+        chamada possa testá-lo
+        """
+        with self._lock:
+            if self.estado == self.MEIO_ABERTO:
+                self._teste_em_andamento = False
+
+    def registrar_sucesso(self):
+        with self._lock:
+            if self.estado != self.FECHADO:
+                logger.info("Provedor de IA respondeu, disjuntor fechado")
+            self.estado = self.FECHADO
+            self.falhas_consecutivas = 0
+            self._teste_em_andamento = False
+
+    def registrar_falha(self):
+        with self._lock:
+            self.falhas_consecutivas += 1
+            limite = max(1, obter_config_int('ia_disjuntor_falhas', 5))
+            if self.estado == self.MEIO_ABERTO or (self.estado == self.FECHADO and
+                                                   self.falhas_consecutivas >= limite):
+                self.estado = self.ABERTO
+                self.aberturas += 1
+                self._aberto_em = time.monotonic()
+                self._teste_em_andamento = False
+                logger.warning(f"Disjuntor da IA aberto após {self.falhas_consecutivas} falhas consecutivas")
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'estado': self.estado,
+                'falhas_consecutivas': self.falhas_consecutivas,
+                'aberturas': self.aberturas,
+            }
+
+disjuntor = DisjuntorCircuito()
+
+class OrcamentoHedge:
+    """
+    Limita a taxa de chamadas duplicadas: cada chamada elegível acumula
+    'ia_hedge_taxa_maxima' de crédito (até 'ia_hedge_rajada') e cada
+    duplicação consome um crédito inteiro
+    """
+
+    def __init__(self):
+        self.creditos = 0.0
+        self._lock = threading.Lock()
+
+    def registrar_chamada(self):
+        with self._lock:
+            self.creditos = min(max(1.0, obter_config_float('ia_hedge_rajada', 5.0)),
+                                self.creditos + max(0.0, obter_config_float('ia_hedge_taxa_maxima', 0.05)))
+
+    def consumir(self):
+        with self._lock:
+            if self.creditos < 1.0:
+                return False
+            self.creditos -= 1.0
+            return True
+
+orcamento_hedge = OrcamentoHedge()
+
+_executor_hedge = None
+_threads_livres_hedge = None
+_lock_executor = threading.Lock()
+
+def opcoes_cliente(assincrono=False):
+    """
+    Parâmetros de criação dos clientes OpenAI (v1+): conexões persistentes,
+    timeout padrão e sem repetições internas, que ficam a cargo deste módulo
+    """
+    cliente_http = (httpx.AsyncClient if assincrono else httpx.Client)(limits=LIMITES_CONEXOES)
+    return {
+        'max_retries': 0,
+        'timeout': obter_config_float('ia_timeout', 20.0),
+        'http_client': cliente_http,
+    }
+
+def _status_http(erro):
+    return getattr(erro, 'status_code', None) or getattr(erro, 'http_status', None)
+
+def erro_transitorio(erro):
+    """Indica se o erro é uma falha temporária do provedor, que vale a pena repetir"""
+    if isinstance(erro, (TimeoutError, ConnectionError, httpx.TimeoutException, httpx.TransportError)):
+        return True
+    if openai is not None:
+        tipos = tuple(getattr(openai, nome) for nome in ('APITimeoutError', 'APIConnectionError',
+                                                         'Timeout', 'APIError', 'ServiceUnavailableError')
+                      if isinstance(getattr(openai, nome, None), type))
+        if tipos and isinstance(erro, tipos) and _status_http(erro) is None:
+            # Erros de conexão/timeout não têm código HTTP
+            return True
+    return _status_http(erro) in STATUS_TRANSITORIOS
+
+def _tempo_espera(tentativa, erro):
+    """Espera antes da próxima tentativa: Retry-After ou exponencial com aleatorização"""
+    resposta = getattr(erro, 'response', None)
+    cabecalhos = getattr(resposta, 'headers', None) or {}
+    try:
+        retry_after = float(cabecalhos.get('retry-after'))
+        if retry_after >= 0:
+            return retry_after
+    except (TypeError, ValueError):
+        pass
+    base = obter_config_float('ia_espera_base', 0.5)
+    maxima = obter_config_float('ia_espera_maxima', 8.0)
+    return random.uniform(0, min(maxima, base * 2 ** tentativa))
+
+def _iniciar(proposito):
+    """
+    Returns:
+        tuple: (prazo final da chamada, se ela é a chamada de teste do disjuntor)
+    """
+    teste = disjuntor.admitir()
+    if teste is None:
+        metricas.incrementar('ia_chamadas_rejeitadas_disjuntor')
+        raise ErroCircuitoAberto(f"Provedor de IA indisponível (disjuntor aberto), chamada '{proposito}' rejeitada")
+    metricas.incrementar(f'ia_chamadas_{proposito}')
+    return time.monotonic() + obter_config_float('ia_prazo_total', 30.0), teste
+
+def _parametros_tentativa(parametros, prazo_final, legado):
+    """Acrescenta o timeout da tentativa, limitado ao tempo restante do prazo total"""
+    restante = prazo_final - time.monotonic()
+    if restante <= 0:
+        raise TimeoutError("Prazo da chamada à IA esgotado")
+    timeout = min(obter_config_float('ia_timeout', 20.0), restante)
+    return dict(parametros, **{'request_timeout' if legado else 'timeout': timeout})
+
+def _com_limite(funcao, proposito, prazo_final, legado):
+    """
+    Envolve o método do SDK para que cada tentativa ocupe uma vaga do limite
+    adaptativo de concorrência e informe o resultado a ele
+
+    A função retornada aceita o argumento 'vaga' (VagaConcorrencia), com o qual
+    o hedging devolve a vaga de uma chamada perdedora antes de ela terminar.
+    """
+    ativo = concorrencia_adaptativa_ativa()
+    chave_timeout = 'request_timeout' if legado else 'timeout'
+
+    def executar(vaga=None, **parametros):
+        if not ativo:
+            return funcao(**parametros)
+        if vaga is None:
+            vaga = VagaConcorrencia(limite_concorrencia)
+        if not vaga.ocupar(limite_concorrencia.adquirir(prazo_final)):
+            # Perdedora do hedging abandonada antes de conseguir a vaga
+            raise futures.CancelledError()
+        # O tempo de espera pela vaga sai do timeout da tentativa
+        parametros[chave_timeout] = min(parametros[chave_timeout], max(0.001, prazo_final - time.monotonic()))
+        try:
+            resultado = funcao(**parametros)
+        except Exception as e:
+            vaga.liberar(proposito, erro_transitorio(e))
+            raise
+        if parametros.get('stream'):
+            # A geração continua enquanto o stream é lido
+            return FluxoLimitado(resultado, vaga, proposito)
+        vaga.liberar(proposito)
+        return resultado
+    return executar
+
+def _com_limite_async(funcao, proposito, prazo_final):
+    """Versão assíncrona de _com_limite (aguarda a vaga sem bloquear o loop de eventos)"""
+    if not concorrencia_adaptativa_ativa():
+        return funcao
+
+    async def executar(**parametros):
+        inicio = limite_concorrencia.tentar_adquirir()
+        inicio_espera = time.monotonic()
+        while inicio is None:
+            # As vagas são compartilhadas com as threads do processo: consultar periodicamente
+            if time.monotonic() >= prazo_final:
+                limite_concorrencia.rejeitar(inicio_espera)
+            await asyncio.sleep(0.02)
+            inicio = limite_concorrencia.tentar_adquirir()
+        limite_concorrencia.registrar_espera(inicio_espera)
+        vaga = VagaConcorrencia(limite_concorrencia)
+        vaga.ocupar(inicio)
+        parametros['timeout'] = min(parametros['timeout'], max(0.001, prazo_final - time.monotonic()))
+        try:
+            resultado = await funcao(**parametros)
+        except asyncio.CancelledError:
+            # Chamada cancelada (ex.: perdedora do hedging): o tempo até o cancelamento não é latência
+            vaga.abandonar()
+            raise
+        except Exception as e:
+            vaga.liberar(proposito, erro_transitorio(e))
+            raise
+        if parametros.get('stream'):
+            return FluxoLimitadoAsync(resultado, vaga, proposito)
+        vaga.liberar(proposito)
+        return resultado
+    return executar
+
+class FluxoLimitado:
+    """
+    Stream do SDK que mantém a vaga de concorrência enquanto é lido
+
+    A vaga é devolvida com a latência da geração inteira quando o stream
+    termina (ou falha). Fechado antes do fim, ou descartado sem ser fechado,
+    ele devolve a vaga sem amostra de latência.
+    """
+
+    def __init__(self, fluxo, vaga, proposito):
+        self._fluxo = fluxo
+        self._iterador = iter(fluxo)
+        self._vaga = vaga
+        self._proposito = proposito
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterador)
+        except StopIteration:
+            self._vaga.liberar(self._proposito)
+            raise
+        except Exception as e:
+            self._vaga.liberar(self._proposito, erro_transitorio(e))
+            raise
+
+    def close(self):
+        try:
+            fechar = getattr(self._fluxo, 'close', None)
+            if fechar is not None:
+                fechar()
+        finally:
+            self._vaga.abandonar()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __del__(self):
+        self._vaga.abandonar()
+
+class FluxoLimitadoAsync:
+    """Versão assíncrona de FluxoLimitado"""
+
+    def __init__(self, fluxo, vaga, proposito):
+        self._fluxo = fluxo
+        self._iterador = fluxo.__aiter__()
+        self._vaga = vaga
+        self._proposito = proposito
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._iterador.__anext__()
+        except StopAsyncIteration:
+            self._vaga.liberar(self._proposito)
+            raise
+        except asyncio.CancelledError:
+            self._vaga.abandonar()
+            raise
+        except Exception as e:
+            self._vaga.liberar(self._proposito, erro_transitorio(e))
+            raise
+
+    async def close(self):
+        try:
+            # AsyncStream do SDK tem close(); geradores assíncronos, aclose()
+            fechar = getattr(self._fluxo, 'close', None) or getattr(self._fluxo, 'aclose', None)
+            if fechar is not None:
+                await fechar()
+        finally:
+            self._vaga.abandonar()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+    def __del__(self):
+        self._vaga.abandonar()
+
+def _atraso_hedge(proposito, parametros):
+    """
+    Tempo de espera pela chamada principal antes de duplicá-la
+
+    É o percentil 'ia_hedge_percentil' das latências recentes das chamadas
+    vencedoras com o mesmo propósito; enquanto houver poucas amostras, vale
+    'ia_hedge_atraso_padrao'.
+
+    Returns:
+        float: Segundos, ou None se a chamada não deve ser duplicada
+    """
+    if not obter_config_bool('ia_hedge', False) or parametros.get('stream'):
+        # Em streaming, o texto já começa a chegar antes da resposta completa
+        return None
+    propositos = obter_config('ia_hedge_propositos', 'resposta,resposta_com_analise')
+    if proposito not in {nome.strip() for nome in propositos.split(',')}:
+        return None
+
+    amostras = metricas.obter_latencias(f'ia_chamada_{proposito}')
+    if len(amostras) < max(1, obter_config_int('ia_hedge_amostras_minimas', 20)):
+        return obter_config_float('ia_hedge_atraso_padrao', 4.0)
+    atraso = metricas.percentil(amostras, obter_config_float('ia_hedge_percentil', 95.0))
+    return max(obter_config_float('ia_hedge_atraso_minimo', 0.5), atraso)
+
+def _parametros_hedge(parametros, prazo_final, legado):
+    """Parâmetros da chamada duplicada (com o modelo de 'ia_hedge_modelo', se definido)"""
+    parametros_hedge = _parametros_tentativa(parametros, prazo_final, legado)
+    modelo = obter_config('ia_hedge_modelo', '')
+    if modelo:
+        parametros_hedge['model'] = modelo
+    return parametros_hedge
+
+def _obter_executor_hedge():
+    """
+    Threads que executam as chamadas síncronas com hedging, criadas na primeira
+    utilização, e o semáforo das threads livres
+
+    Returns:
+        tuple: (executor, semáforo)
+    """
+    global _executor_hedge, _threads_livres_hedge
+    if _executor_hedge is None:
+        with _lock_executor:
+            if _executor_hedge is None:
+                threads = max(2, obter_config_int('ia_hedge_threads', 32))
+                _threads_livres_hedge = threading.BoundedSemaphore(threads)
+                _executor_hedge = futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix='ia-hedge')
+    return _executor_hedge, _threads_livres_hedge
+
+def _submeter_hedge(funcao, parametros):
+    """
+    Executa uma tentativa em uma thread do hedging
+
+    Nenhuma chamada espera na fila do executor: sem thread livre, nada é submetido.
+
+    Returns:
+        tuple: (Future, VagaConcorrencia), ou None se todas as threads estiverem ocupadas
+    """
+    executor, threads_livres = _obter_executor_hedge()
+    if not threads_livres.acquire(blocking=False):
+        metricas.incrementar('ia_hedge_sem_threads')
+        return None
+    vaga = VagaConcorrencia(limite_concorrencia)
+    chamada = executor.submit(funcao, vaga=vaga, **parametros)
+    chamada.add_done_callback(lambda _: threads_livres.release())
+    return chamada, vaga
+
+def _pode_duplicar(cobrar):
+    """Consome o orçamento de hedging e as fichas do limite de taxa da chamada duplicada"""
+    if not orcamento_hedge.consumir():
+        metricas.incrementar('ia_hedge_sem_orcamento')
+        return False
+    if cobrar is not None and not cobrar(esperar=False):
+        # Duplicar sem fichas apenas anteciparia os erros 429 do provedor
+        metricas.incrementar('ia_hedge_sem_limite_taxa')
+        return False
+    return True
+
+async def _pode_duplicar_async(cobrar):
+    """Versão assíncrona de _pode_duplicar (cobrar é uma corrotina)"""
+    if not orcamento_hedge.consumir():
+        metricas.incrementar('ia_hedge_sem_orcamento')
+        return False
+    if cobrar is not None and not await cobrar(esperar=False):
+        metricas.incrementar('ia_hedge_sem_limite_taxa')
+        return False
+    return True
+
+def _registrar_latencia_vencedora(proposito, inicio):
+    metricas.registrar_latencia(f'ia_chamada_{proposito}', time.monotonic() - inicio)
+
+def _executar_com_hedge(funcao, proposito, parametros, prazo_final, legado, atraso, cobrar=None):
+    """
+    Executa uma tentativa duplicando-a se a principal demorar mais que o atraso
+
+    O SDK síncrono não permite interromper uma requisição em andamento: a
+    chamada perdedora é cancelada se ainda não começou e, caso contrário,
+    devolve na hora a vaga de concorrência e tem o resultado descartado ao
+    terminar. Sem thread livre no executor, a principal roda na thread atual,
+    sem duplicação.
+    """
+    inicio = time.monotonic()
+    submetida = _submeter_hedge(funcao, _parametros_tentativa(parametros, prazo_final, legado))
+    if submetida is None:
+        resultado = funcao(**_parametros_tentativa(parametros, prazo_final, legado))
+        _registrar_latencia_vencedora(proposito, inicio)
+        return resultado
+    principal, vaga_principal = submetida
+    orcamento_hedge.registrar_chamada()
+
+    concluidas, _ = futures.wait([principal], timeout=atraso)
+    duplicada = None
+    if not concluidas and _pode_duplicar(cobrar):
+        duplicada = _submeter_hedge(funcao, _parametros_hedge(parametros, prazo_final, legado))
+    if duplicada is None:
+        resultado = principal.result()
+        _registrar_latencia_vencedora(proposito, inicio)
+        return resultado
+
+    metricas.incrementar('ia_hedge_disparados')
+    duplicada, vaga_duplicada = duplicada
+    chamadas = {principal: (inicio, vaga_principal), duplicada: (time.monotonic(), vaga_duplicada)}
+    pendentes = set(chamadas)
+    while True:
+        concluidas, pendentes = futures.wait(pendentes, return_when=futures.FIRST_COMPLETED)
+        for chamada in concluidas:
+            if chamada.exception() is None:
+                for perdedora in pendentes:
+                    perdedora.cancel()
+                    chamadas[perdedora][1].abandonar()
+                if chamada is duplicada:
+                    metricas.incrementar('ia_hedge_vencedores')
+                _registrar_latencia_vencedora(proposito, chamadas[chamada][0])
+                return chamada.result()
+        if not pendentes:
+            # As duas falharam: vale o erro da principal
+            return principal.result()
+
+async def _executar_com_hedge_async(funcao, proposito, parametros, prazo_final, atraso, cobrar=None):
+    """Versão assíncrona de _executar_com_hedge (a chamada perdedora é de fato cancelada)"""
+    inicio = time.monotonic()
+    principal = asyncio.ensure_future(funcao(**_parametros_tentativa(parametros, prazo_final, False)))
+    chamadas = {principal: inicio}
+    orcamento_hedge.registrar_chamada()
+    try:
+        concluidas, _ = await asyncio.wait({principal}, timeout=atraso)
+        if concluidas or not await _pode_duplicar_async(cobrar):
+            resultado = await principal
+            _registrar_latencia_vencedora(proposito, inicio)
+            return resultado
+
+        metricas.incrementar('ia_hedge_disparados')
+        duplicada = asyncio.ensure_future(funcao(**_parametros_hedge(parametros, prazo_final, False)))
+        chamadas[duplicada] = time.monotonic()
+        pendentes = set(chamadas)
+        while True:
+            concluidas, pendentes = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+            for chamada in concluidas:
+                if chamada.exception() is None:
+                    if chamada is duplicada:
+                        metricas.incrementar('ia_hedge_vencedores')
+                    _registrar_latencia_vencedora(proposito, chamadas[chamada])
+                    return chamada.result()
+            if not pendentes:
+                return principal.result()
+    finally:
+        # Perdedora, ou as duas se esta tarefa for cancelada: a vaga volta no cancelamento
+        for chamada in chamadas:
+            chamada.cancel()
+
+def _avaliar_falha(erro, tentativa, prazo_final, proposito):
+    """
+    Registra a falha de uma tentativa e decide se haverá outra
+
+    Returns:
+        float: Segundos de espera antes de repetir, ou None para desistir
+    """
+    if isinstance(erro, ErroConcorrenciaEsgotada):
+        # O prazo acabou esperando uma vaga: não há tempo para repetir
+        metricas.incrementar('ia_chamadas_falhas')
+        return None
+
+    transitorio = erro_transitorio(erro)
+    if transitorio:
+        disjuntor.registrar_falha()
+    else:
+        # Erros da requisição (400, 401...) não indicam degradação do provedor
+        disjuntor.registrar_sucesso()
+
+    espera = _tempo_espera(tentativa, erro)
+    if (not transitorio or tentativa + 1 >= max(1, obter_config_int('ia_tentativas', 3))
+            or disjuntor.estado != DisjuntorCircuito.FECHADO
+            or time.monotonic() + espera >= prazo_final):
+        metricas.incrementar('ia_chamadas_falhas')
+        return None
+
+    metricas.incrementar('ia_tentativas_repetidas')
+    logger.warning(f"Falha transitória na chamada '{proposito}' à IA ({str(erro)}), "
+                   f"nova tentativa em {espera:.1f}s")
+    return espera
+
+def chamar(funcao, proposito, parametros, legado=False, cobrar=None):
+    """
+    Executa uma chamada à API com prazo total, repetições e disjuntor
+
+    Args:
+        funcao (callable): Método do SDK a ser chamado (ex.: client.chat.completions.create)
+        proposito (str): Nome da chamada, usado nas métricas e nos logs
+        parametros (dict): Argumentos do método
+        legado (bool): Se o método é do SDK legado (v0), que usa 'request_timeout'
+        cobrar (callable): Cobrança do limite de taxa (limite_taxa.cobranca) das
+            requisições extras; a primeira tentativa é cobrada por quem chama
+
+    Returns:
+        Resultado do método
+
+    Raises:
+        ErroCircuitoAberto: Se o disjuntor estiver aberto
+        Exception: O último erro do SDK, se as tentativas se esgotarem
+    """
+    prazo_final, teste = _iniciar(proposito)
+    funcao = _com_limite(funcao, proposito, prazo_final, legado)
+    atraso = _atraso_hedge(proposito, parametros)
+    tentativa = 0
+    try:
+        while True:
+            try:
+                if atraso is None:
+                    resultado = funcao(**_parametros_tentativa(parametros, prazo_final, legado))
+                else:
+                    resultado = _executar_com_hedge(funcao, proposito, parametros, prazo_final, legado, atraso,
+                                                    cobrar)
+            except Exception as e:
+                espera = _avaliar_falha(e, tentativa, prazo_final, proposito)
+                if espera is None:
+                    raise
+                time.sleep(espera)
+                tentativa += 1
+                if cobrar is not None:
+                    # A repetição é uma nova requisição ao provedor
+                    cobrar()
+                continue
+            disjuntor.registrar_sucesso()
+            return resultado
+    finally:
+        # Sem resposta nem falha do provedor, a chamada de teste não decidiu o estado
+        if teste:
+            disjuntor.liberar_teste()
+
+async def chamar_async(funcao, proposito, parametros, cobrar=None):
+    """Versão assíncrona de chamar, para os métodos do cliente AsyncOpenAI"""
+    prazo_final, teste = _iniciar(proposito)
+    funcao = _com_limite_async(funcao, proposito, prazo_final)
+    atraso = _atraso_hedge(proposito, parametros)
+    tentativa = 0
+    try:
+        while True:
+            try:
+                if atraso is None:
+                    resultado = await funcao(**_parametros_tentativa(parametros, prazo_final, False))
+                else:
+                    resultado = await _executar_com_hedge_async(funcao, proposito, parametros, prazo_final,
+                                                                atraso, cobrar)
+            except Exception as e:
+                espera = _avaliar_falha(e, tentativa, prazo_final, proposito)
+                if espera is None:
+                    raise
+                await asyncio.sleep(espera)
+                tentativa += 1
+                if cobrar is not None:
+                    await cobrar()
+                continue
+            disjuntor.registrar_sucesso()
+            return resultado
+    finally:
+        # Inclui o cancelamento (CancelledError não é uma Exception)
+        if teste:
+            disjuntor.liberar_teste()
+
+def estatisticas():
+    """Estado do disjuntor e totais de repetições, falhas e chamadas duplicadas"""
+    return dict(disjuntor.estatisticas(),
+                tentativas_repetidas=metricas.obter_contador('ia_tentativas_repetidas'),
+                chamadas_falhas=metricas.obter_contador('ia_chamadas_falhas'),
+                rejeitadas_disjuntor=metricas.obter_contador('ia_chamadas_rejeitadas_disjuntor'),
+                hedge_disparados=metricas.obter_contador('ia_hedge_disparados'),
+                hedge_vencedores=metricas.obter_contador('ia_hedge_vencedores'),
+                hedge_sem_orcamento=metricas.obter_contador('ia_hedge_sem_orcamento'),
+                hedge_sem_threads=metricas.obter_contador('ia_hedge_sem_threads'),
+                hedge_sem_limite_taxa=metricas.obter_contador('ia_hedge_sem_limite_taxa'))
+
+metricas.registrar_coletor('cliente_ia', estatisticas)
@@ -0,0 +1,246 @@
+"""
+Limite adaptativo de chamadas simultâneas ao provedor de IA (AIMD)
+
+Um limite fixo de chamadas em andamento fica baixo demais quando o provedor
+está saudável e alto demais quando ele está degradado. Aqui o limite se ajusta
+sozinho, como o controle de congestionamento do TCP: cresce de forma aditiva
+(uma vaga a cada "janela" de chamadas bem-sucedidas, enquanto as vagas estão
+de fato sendo usadas) e é reduzido de forma multiplicativa em erros 429,
+timeouts e outras falhas transitórias, ou quando a latência dispara em relação
+à latência de referência. Reduções seguidas são espaçadas para que uma rajada
+de falhas de uma mesma degradação conte uma única vez.
+
+O limite vale por processo; o estado atual e o histórico de ajustes ficam nas
+métricas.
+"""
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from config_sistema import obter_config_bool, obter_config_int, obter_config_float
+import metricas
+
+logger = logging.getLogger(__name__)
+
+# Peso de cada amostra na latência de referência (média móvel lenta)
+PESO_REFERENCIA = 0.05
+
+# Amostras necessárias antes de detectar picos de latência
+AMOSTRAS_MINIMAS_REFERENCIA = 20
+
+# Ajustes do limite mantidos no histórico
+TAMANHO_HISTORICO = 200
+
+class ErroConcorrenciaEsgotada(Exception):
+    """Chamada rejeitada porque nenhuma vaga foi liberada dentro do prazo"""
+
+def concorrencia_adaptativa_ativa():
+    """Indica se as chamadas à IA passam pelo limite adaptativo de concorrência"""
+    return obter_config_bool('ia_concorrencia_adaptativa', True)
+
+class LimiteConcorrenciaAdaptativo:
+    """Semáforo com limite ajustado por aumento aditivo e redução multiplicativa"""
+
+    def __init__(self):
+        self.limite = float(max(1, obter_config_int('ia_aimd_inicial', 8)))
+        self.em_andamento = 0
+        self.referencias = {}  # propósito -> [latência de referência, amostras]
+        self.historico = deque(maxlen=TAMANHO_HISTORICO)
+        self._reduzido_em = 0.0
+        self._condicao = threading.Condition()
+        metricas.definir('ia_limite_concorrencia', int(self.limite))
+
+    def _limites(self):
+        minimo = max(1, obter_config_int('ia_aimd_minimo', 2))
+        return minimo, max(minimo, obter_config_int('ia_aimd_maximo', 64))
+
+    def _vagas(self):
+        minimo, maximo = self._limites()
+        return int(min(maximo, max(minimo, self.limite)))
+
+    def tentar_adquirir(self):
+        """Reserva uma vaga se houver (não bloqueia); retorna o instante de início ou None"""
+        with self._condicao:
+            if self.em_andamento >= self._vagas():
+                return None
+            self.em_andamento += 1
+            return time.monotonic()
+
+    def adquirir(self, prazo_final):
+        """
+        Aguarda uma vaga até o prazo (time.monotonic)
+
+        Returns:
+            float: Instante de início a ser passado para liberar()
+
+        Raises:
+            ErroConcorrenciaEsgotada: Se o prazo acabar antes de uma vaga ser liberada
+        """
+        inicio_espera = time.monotonic()
+        with self._condicao:
+            while self.em_andamento >= self._vagas():
+                restante = prazo_final - time.monotonic()
+                if restante <= 0:
+                    self.rejeitar(inicio_espera)
+                self._condicao.wait(timeout=restante)
+            self.em_andamento += 1
+        self.registrar_espera(inicio_espera)
+        return time.monotonic()
+
+    def rejeitar(self, inicio_espera):
+        """Conta a rejeição e levanta ErroConcorrenciaEsgotada"""
+        metricas.incrementar('ia_concorrencia_rejeitadas')
+        raise ErroConcorrenciaEsgotada(
+            f"Nenhuma vaga para chamar a IA após {time.monotonic() - inicio_espera:.1f}s "
+            f"({self.em_andamento} chamadas em andamento, limite {self._vagas()})")
+
+    def registrar_espera(self, inicio_espera):
+        """Registra quanto tempo a chamada esperou por uma vaga"""
+        espera = time.monotonic() - inicio_espera
+        metricas.registrar_latencia('ia_concorrencia_espera', espera)
+        if espera > 0.001:
+            metricas.incrementar('ia_concorrencia_esperas')
+
+    def liberar(self, inicio, proposito, sobrecarga=False):
+        """
+        Libera a vaga e ajusta o limite com o resultado da chamada
+
+        Args:
+            inicio (float): Valor retornado por adquirir()
+            proposito (str): Nome da chamada (cada propósito tem sua latência de referência)
+            sobrecarga (bool): Se a chamada falhou por 429, timeout ou outra falha transitória
+        """
+        duracao = time.monotonic() - inicio
+        with self._condicao:
+            utilizacao = self.em_andamento / max(1, self._vagas())
+            self.em_andamento -= 1
+            referencia = self.referencias.setdefault(proposito, [0.0, 0])
+            if sobrecarga:
+                self._reduzir('falha transitória')
+            elif self._pico_latencia(referencia, duracao):
+                self._reduzir(f"pico de latência em '{proposito}' "
+                              f"({duracao:.1f}s, referência {referencia[0]:.1f}s)")
+            else:
+                self._atualizar_referencia(referencia, duracao)
+                # Só cresce enquanto as vagas estão sendo usadas
+                if utilizacao >= 0.5:
+                    self._aumentar()
+            self._condicao.notify()
+
+    def abandonar(self):
+        """Libera a vaga de uma chamada abandonada (cancelada ou perdedora do hedging) sem ajustar o limite"""
+        with self._condicao:
+            self.em_andamento -= 1
+            self._condicao.notify()
+        metricas.incrementar('ia_concorrencia_abandonadas')
+
+    @staticmethod
+    def _pico_latencia(referencia, duracao):
+        tolerancia = obter_config_float('ia_aimd_tolerancia_latencia', 2.0)
+        latencia, amostras = referencia
+        return tolerancia > 0 and amostras >= AMOSTRAS_MINIMAS_REFERENCIA and duracao > tolerancia * latencia
+
+    @staticmethod
+    def _atualizar_referencia(referencia, duracao):
+        referencia[1] += 1
+        if referencia[1] == 1:
+            referencia[0] = duracao
+        else:
+            referencia[0] += PESO_REFERENCIA * (duracao - referencia[0])
+
+    def _aumentar(self):
+        minimo, maximo = self._limites()
+        anterior = self._vagas()
+        # Uma vaga a mais a cada janela de 'limite' chamadas bem-sucedidas
+        self.limite = min(float(maximo), max(float(minimo), self.limite) + 1.0 / max(1.0, self.limite))
+        if self._vagas() != anterior:
+            self._registrar_ajuste(anterior, 'latência saudável')
+
+    def _reduzir(self, motivo):
+        agora = time.monotonic()
+        # Uma redução por intervalo: as falhas de uma mesma degradação chegam em rajada
+        if agora - self._reduzido_em < obter_config_float('ia_aimd_intervalo_reducao', 2.0):
+            return
+        self._reduzido_em = agora
+        minimo, _ = self._limites()
+        anterior = self._vagas()
+        fator = min(0.95, max(0.1, obter_config_float('ia_aimd_fator_reducao', 0.7)))
+        self.limite = max(float(minimo), self.limite * fator)
+        metricas.incrementar('ia_concorrencia_reducoes')
+        self._registrar_ajuste(anterior, motivo)
+        logger.warning(f"Limite de chamadas simultâneas à IA reduzido de {anterior} para {self._vagas()}: {motivo}")
+
+    def _registrar_ajuste(self, anterior, motivo):
+        self.historico.append({
+            'em': datetime.utcnow().isoformat(timespec='seconds'),
+            'de': anterior,
+            'para': self._vagas(),
+            'motivo': motivo,
+        })
+        metricas.definir('ia_limite_concorrencia', self._vagas())
+
+    def estatisticas(self):
+        """Limite atual, chamadas em andamento e histórico recente de ajustes"""
+        with self._condicao:
+            return {
+                'ativo': concorrencia_adaptativa_ativa(),
+                'limite': self._vagas(),
+                'em_andamento': self.em_andamento,
+                'latencia_referencia_s': {proposito: round(latencia, 3)
+                                          for proposito, (latencia, _) in self.referencias.items()},
+                'esperas': metricas.obter_contador('ia_concorrencia_esperas'),
+                'reducoes': metricas.obter_contador('ia_concorrencia_reducoes'),
+                'rejeitadas': metricas.obter_contador('ia_concorrencia_rejeitadas'),
+                'abandonadas': metricas.obter_contador('ia_concorrencia_abandonadas'),
+                'historico': list(self.historico)[-50:],
+            }
+
+class VagaConcorrencia:
+    """
+    Vaga ocupada por uma tentativa, devolvida uma única vez
+
+    Quem disparou a chamada pode abandoná-la antes do fim (ex.: a perdedora do
+    hedging, que o SDK síncrono não interrompe): a vaga volta na hora, sem
+    amostra de latência, e a liberação feita depois pela própria chamada é
+    ignorada.
+    """
+
+    def __init__(self, limite):
+        self._limite = limite
+        self._inicio = None
+        self._abandonada = False
+        self._lock = threading.Lock()
+
+    def ocupar(self, inicio):
+        """
+        Associa a vaga adquirida (instante retornado por adquirir)
+
+        Returns:
+            bool: False se a chamada já foi abandonada (a vaga é devolvida)
+        """
+        with self._lock:
+            if not self._abandonada:
+                self._inicio = inicio
+                return True
+        self._limite.abandonar()
+        return False
+
+    def liberar(self, proposito, sobrecarga=False):
+        """Devolve a vaga ao fim da chamada, ajustando o limite com o resultado"""
+        with self._lock:
+            inicio, self._inicio = self._inicio, None
+        if inicio is not None:
+            self._limite.liberar(inicio, proposito, sobrecarga)
+
+    def abandonar(self):
+        """Devolve a vaga sem ajustar o limite e impede que a chamada ocupe outra"""
+        with self._lock:
+            self._abandonada = True
+            inicio, self._inicio = self._inicio, None
+        if inicio is not None:
+            self._limite.abandonar()
+
+limite_concorrencia = LimiteConcorrenciaAdaptativo()
+
+metricas.registrar_coletor('concorrencia_ia', limite_concorrencia.estatisticas)
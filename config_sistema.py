@@ -0,0 +1,104 @@
+"""
+Leitura de configurações do sistema
+
+As configurações são buscadas primeiro na tabela Configuracao (editável pela
+interface administrativa), depois em variáveis de ambiente com o nome da chave
+em maiúsculas e, por fim, no valor padrão informado.
+"""
+import os
+import time
+import logging
+import threading
+from flask import has_app_context
+
+logger = logging.getLogger(__name__)
+
+# Tempo (em segundos) que os valores da tabela Configuracao ficam em memória
+INTERVALO_RECARGA = 30
+
+# Espera (em segundos) antes de tentar de novo quando a leitura do banco falha
+INTERVALO_NOVA_TENTATIVA = 5
+
+_cache = {}
+_carregado_em = 0.0
+_falhou_em = None
+_lock = threading.Lock()
+
+def _carregar_configuracoes():
+    """
+    Recarrega as configurações do banco caso o cache tenha expirado
+
+    Chamadas sem contexto de aplicação (threads e loop de eventos) usam os
+    valores já carregados sem adiar a próxima recarga; apenas uma leitura bem
+    sucedida renova o cache.
+    """
+    global _cache, _carregado_em, _falhou_em
+
+    agora = time.monotonic()
+    if agora - _carregado_em < INTERVALO_RECARGA:
+        return _cache
+
+    if not has_app_context():
+        return _cache
+
+    with _lock:
+        if agora - _carregado_em < INTERVALO_RECARGA:
+            return _cache
+        if _falhou_em is not None and agora - _falhou_em < INTERVALO_NOVA_TENTATIVA:
+            return _cache
+        try:
+            from models import Configuracao
+            _cache = {config.chave: config.valor for config in Configuracao.query.all()}
+            _carregado_em = agora
+            _falhou_em = None
+        except Exception as e:
+            # Banco indisponível: usar os últimos valores lidos e o ambiente
+            logger.debug(f"Não foi possível carregar configurações do banco: {str(e)}")
+            _falhou_em = agora
+
+    return _cache
+
+def invalidar_cache():
+    """Força a releitura das configurações do banco na próxima consulta"""
+    global _carregado_em, _falhou_em
+    _carregado_em = 0.0
+    _falhou_em = None
+
+def obter_config(chave, padrao=None):
+    """
+    Obtém o valor bruto de uma configuração
+
+    Args:
+        chave (str): Nome da configuração
+        padrao: Valor retornado se a configuração não existir
+
+    Returns:
+        str: Valor configurado ou o padrão
+    """
+    valor = _carregar_configuracoes().get(chave)
+    if valor is None:
+        valor = os.environ.get(chave.upper())
+    return padrao if valor is None or valor == '' else valor
+
+def obter_config_bool(chave, padrao=False):
+    """Obtém uma configuração booleana ('1', 'true', 'sim', 'on' são verdadeiros)"""
+    valor = obter_config(chave)
+    if valor is None:
+        return padrao
+    return str(valor).strip().lower() in ('1', 'true', 'sim', 's', 'yes', 'on')
+
+def obter_config_int(chave, padrao=0):
+    """Obtém uma configuração inteira, usando o padrão se o valor for inválido"""
+    try:
+        return int(obter_config(chave, padrao))
+    except (TypeError, ValueError):
+        logger.warning(f"Valor inválido para a configuração {chave}, usando {padrao}")
+        return padrao
+
+def obter_config_float(chave, padrao=0.0):
+    """Obtém uma configuração decimal, usando o padrão se o valor for inválido"""
+    try:
+        return float(obter_config(chave, padrao))
+    except (TypeError, ValueError):
+        logger.warning(f"Valor inválido para a configuração {chave}, usando {padrao}")
+        return padrao
@@ -0,0 +1,338 @@
+"""
+Acesso à base de conhecimento usada pela IA
+
+Os itens da BaseConhecimento são indexados em um índice invertido com
+ranqueamento BM25 (sobre pergunta, resposta e palavras-chave, com normalização
+para o português). Apenas os itens mais relevantes para cada mensagem são
+enviados no prompt, mantendo o tamanho do prompt estável mesmo com milhares
+de itens na base. O índice é atualizado de forma incremental.
+"""
+import math
+import time
+import logging
+import threading
+from collections import Counter, defaultdict
+from sqlalchemy import func
+from database import db
+from models import BaseConhecimento
+from config_sistema import obter_config, obter_config_int, obter_config_float
+from normalizacao import tokenizar
+
+logger = logging.getLogger(__name__)
+
+# Tempo (em segundos) entre consultas da versão da base no banco
+INTERVALO_VERSAO = 30
+
+_versao = None
+_versao_em = 0.0
+_lock = threading.Lock()
+
+def versao_base_conhecimento():
+    """
+    Retorna um identificador que muda sempre que a base de conhecimento é alterada
+
+    Combina a quantidade de itens com a data da última alteração, o que cobre
+    inclusões, edições e remoções feitas por qualquer processo.
+
+    Returns:
+        str: Versão atual da base
+    """
+    global _versao, _versao_em
+
+    agora = time.monotonic()
+    if _versao is not None and agora - _versao_em < INTERVALO_VERSAO:
+        return _versao
+
+    with _lock:
+        try:
+            total, ultima_alteracao = db.session.query(
+                func.count(BaseConhecimento.id),
+                func.max(BaseConhecimento.atualizado_em)
+            ).one()
+            _versao = f"{total}:{ultima_alteracao.isoformat() if ultima_alteracao else '0'}"
+        except Exception as e:
+            logger.error(f"Erro ao consultar versão da base de conhecimento: {str(e)}")
+            if _versao is None:
+                _versao = '0:0'
+        _versao_em = agora
+
+    return _versao
+
+def invalidar_versao():
+    """Força a releitura da versão na próxima consulta (após alterações na base)"""
+    global _versao_em
+    _versao_em = 0.0
+
+class IndiceBM25:
+    """Índice invertido com ranqueamento BM25, atualizável item a item"""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._invertido = defaultdict(dict)  # termo -> {id do item: frequência}
+        self._comprimentos = {}  # id do item -> quantidade de termos
+        self._termos_item = {}  # id do item -> termos distintos
+        self._total_termos = 0
+
+    def __len__(self):
+        return len(self._comprimentos)
+
+    def __contains__(self, item_id):
+        return item_id in self._comprimentos
+
+    def ids(self):
+        return set(self._comprimentos)
+
+    def atualizar(self, item_id, termos):
+        """Indexa (ou reindexa) um item a partir da sua lista de termos"""
+        self.remover(item_id)
+        frequencias = Counter(termos)
+        for termo, frequencia in frequencias.items():
+            self._invertido[termo][item_id] = frequencia
+        self._termos_item[item_id] = set(frequencias)
+        self._comprimentos[item_id] = len(termos)
+        self._total_termos += len(termos)
+
+    def remover(self, item_id):
+        """Remove um item do índice, se existir"""
+        comprimento = self._comprimentos.pop(item_id, None)
+        if comprimento is None:
+            return
+        self._total_termos -= comprimento
+        for termo in self._termos_item.pop(item_id):
+            del self._invertido[termo][item_id]
+            if not self._invertido[termo]:
+                del self._invertido[termo]
+
+    def idf(self, termo):
+        """Peso de raridade do termo na coleção"""
+        total = len(self._comprimentos)
+        frequencia_documentos = len(self._invertido.get(termo, ()))
+        return math.log(1 + (total - frequencia_documentos + 0.5) / (frequencia_documentos + 0.5))
+
+    def buscar(self, termos, k):
+        """
+        Ranqueia os itens para os termos da consulta
+
+        Args:
+            termos (list): Termos da consulta
+            k (int): Quantidade máxima de resultados
+
+        Returns:
+            list: Tuplas (pontuação, id do item) em ordem decrescente de pontuação
+        """
+        if not self._comprimentos or not termos:
+            return []
+
+        comprimento_medio = self._total_termos / len(self._comprimentos) or 1.0
+        pontuacoes = defaultdict(float)
+        for termo in set(termos):
+            itens = self._invertido.get(termo)
+            if not itens:
+                continue
+            idf = self.idf(termo)
+            for item_id, frequencia in itens.items():
+                normalizacao = self.k1 * (1 - self.b + self.b * self._comprimentos[item_id] / comprimento_medio)
+                pontuacoes[item_id] += idf * frequencia * (self.k1 + 1) / (frequencia + normalizacao)
+
+        melhores = sorted(((pontuacao, item_id) for item_id, pontuacao in pontuacoes.items()), reverse=True)
+        return melhores[:k]
+
+    def cobertura(self, termos, item_id):
+        """
+        Fração da consulta presente no item, ponderada pela raridade de cada termo
+
+        Returns:
+            float: Valor entre 0 (nenhum termo em comum) e 1 (todos os termos presentes)
+        """
+        termos = set(termos)
+        total = sum(self.idf(termo) for termo in termos)
+        if total <= 0:
+            return 0.0
+        presentes = self._termos_item.get(item_id, set())
+        return sum(self.idf(termo) for termo in termos if termo in presentes) / total
+
+def termos_do_item(item):
+    """Termos indexados de um item (pergunta e palavras-chave têm peso dobrado)"""
+    return (tokenizar(item.pergunta) * 2
+            + tokenizar(item.palavras_chave or '') * 2
+            + tokenizar(item.resposta))
+
+class RecuperadorConhecimento:
+    """Mantém o índice BM25 sincronizado com a tabela BaseConhecimento"""
+
+    def __init__(self):
+        self._indice = IndiceBM25()
+        self._itens = {}  # id -> dados do item usados no prompt
+        self._versao = None
+        self._ultima_alteracao = None
+        self._lock = threading.Lock()
+
+    def atualizar_item(self, item):
+        """Indexa um item recém-criado ou editado"""
+        with self._lock:
+            self._indexar(item)
+
+    def remover_item(self, item_id):
+        """Remove um item excluído da base"""
+        with self._lock:
+            self._indice.remover(item_id)
+            self._itens.pop(item_id, None)
+
+    def _indexar(self, item):
+        self._indice.atualizar(item.id, termos_do_item(item))
+        self._itens[item.id] = {
+            'id': item.id,
+            'categoria': item.categoria,
+            'pergunta': item.pergunta,
+            'resposta': item.resposta,
+        }
+        if item.atualizado_em and (self._ultima_alteracao is None or item.atualizado_em > self._ultima_alteracao):
+            self._ultima_alteracao = item.atualizado_em
+
+    def _sincronizar(self):
+        """Aplica ao índice as alterações feitas na base desde a última sincronização"""
+        versao = versao_base_conhecimento()
+        if versao == self._versao:
+            return
+
+        consulta = BaseConhecimento.query
+        if self._ultima_alteracao is not None:
+            consulta = consulta.filter(BaseConhecimento.atualizado_em >= self._ultima_alteracao)
+        alterados = consulta.all()
+        for item in alterados:
+            self._indexar(item)
+
+        # Detectar itens removidos (ou inseridos sem data) comparando os IDs
+        ids_banco = {item_id for (item_id,) in db.session.query(BaseConhecimento.id)}
+        for item_id in self._indice.ids() - ids_banco:
+            self._indice.remover(item_id)
+            self._itens.pop(item_id, None)
+        faltantes = ids_banco - self._indice.ids()
+        if faltantes:
+            for item in BaseConhecimento.query.filter(BaseConhecimento.id.in_(faltantes)).all():
+                self._indexar(item)
+
+        self._versao = versao
+        logger.info(f"Índice da base de conhecimento sincronizado: {len(self._indice)} itens "
+                    f"({len(alterados)} atualizados)")
+
+    def buscar(self, texto, k=None):
+        """
+        Busca os itens da base mais relevantes para um texto
+
+        Args:
+            texto (str): Mensagem do lead
+            k (int): Quantidade máxima de itens (padrão: configuração 'kb_top_k')
+
+        Returns:
+            list: Itens (dicts com categoria, pergunta, resposta, pontuação e
+                  confiança) em ordem decrescente de relevância
+        """
+        if k is None:
+            k = max(0, obter_config_int('kb_top_k', 3))
+        pontuacao_minima = obter_config_float('kb_pontuacao_minima', 1.0)
+        termos = tokenizar(texto)
+        if k == 0 or not termos:
+            return []
+
+        with self._lock:
+            try:
+                self._sincronizar()
+            except Exception as e:
+                logger.error(f"Erro ao sincronizar índice da base de conhecimento: {str(e)}")
+            resultados = self._indice.buscar(termos, k)
+            return [dict(self._itens[item_id],
+                         pontuacao=round(pontuacao, 3),
+                         confianca=round(self._indice.cobertura(termos, item_id), 3))
+                    for pontuacao, item_id in resultados if pontuacao >= pontuacao_minima]
+
+    def todos(self):
+        """
+        Retorna todos os itens da base em ordem estável (por categoria e ID)
+
+        Returns:
+            tuple: (versão da base, lista de itens)
+        """
+        with self._lock:
+            try:
+                self._sincronizar()
+            except Exception as e:
+                logger.error(f"Erro ao sincronizar índice da base de conhecimento: {str(e)}")
+            itens = sorted(self._itens.values(), key=lambda item: ((item['categoria'] or '').lower(), item['id']))
+            return self._versao, itens
+
+recuperador = RecuperadorConhecimento()
+
+def buscar_conhecimento(texto, k=None):
+    """Atalho para recuperador.buscar"""
+    return recuperador.buscar(texto, k)
+
+def formatar_trechos(itens):
+    """
+    Formata os itens recuperados para inclusão no prompt
+
+    Args:
+        itens (list): Itens retornados por buscar_conhecimento
+
+    Returns:
+        str: Bloco de texto com as informações relevantes, ou string vazia
+    """
+    if not itens:
+        return ''
+    linhas = ["Informações da base de conhecimento da empresa relevantes para a mensagem "
+              "(use-as como fonte principal; não invente informações que não estejam aqui):"]
+    for item in itens:
+        linhas.append(f"- [{item['categoria']}] {item['pergunta']}\n  {item['resposta']}")
+    return "\n".join(linhas)
+
+def formatar_base_completa(itens):
+    """
+    Formata a base inteira para o prefixo fixo do prompt
+
+    O texto depende apenas do conteúdo da base: é idêntico em todas as
+    chamadas até a base ser alterada, o que permite ao provedor reaproveitar
+    o prefixo em cache.
+
+    Args:
+        itens (list): Itens em ordem estável (ver RecuperadorConhecimento.todos)
+
+    Returns:
+        str: Bloco de texto com a base de conhecimento, ou string vazia
+    """
+    if not itens:
+        return ''
+    linhas = ["Base de conhecimento da empresa (use-a como fonte principal; "
+              "não invente informações que não estejam aqui):"]
+    for item in itens:
+        linhas.append(f"- [{item['categoria']}] {item['pergunta']}\n  {item['resposta']}")
+    return "\n".join(linhas)
+
+def resposta_direta(itens, nome_lead):
+    """
+    Retorna a resposta do item mais relevante quando ela pode ser enviada sem a IA
+
+    A resposta direta exige que a categoria do item esteja habilitada em
+    'kb_resposta_direta_categorias' (lista separada por vírgulas; vazia desativa)
+    e que a confiança da correspondência alcance 'kb_resposta_direta_limiar'.
+
+    Args:
+        itens (list): Itens retornados por buscar_conhecimento
+        nome_lead (str): Nome do lead, preenchido nos marcadores [nome] e {nome}
+
+    Returns:
+        dict: Item usado, com a 'resposta' já personalizada, ou None
+    """
+    if not itens:
+        return None
+
+    categorias = {categoria.strip().lower() for categoria in
+                  obter_config('kb_resposta_direta_categorias', '').split(',') if categoria.strip()}
+    melhor = itens[0]
+    if (melhor['categoria'] or '').lower() not in categorias:
+        return None
+    if melhor['confianca'] < obter_config_float('kb_resposta_direta_limiar', 0.8):
+        return None
+
+    resposta = melhor['resposta'].replace('[nome]', nome_lead).replace('{nome}', nome_lead)
+    return dict(melhor, resposta=resposta)
@@ -0,0 +1,24 @@
+"""
+Utilitários para executar código síncrono a partir do modo assíncrono (ASGI)
+"""
+import asyncio
+
+def _executar_no_contexto(funcao, args):
+    # Importado aqui para evitar importações circulares
+    from app import app
+    with app.app_context():
+        return funcao(*args)
+
+async def executar_em_thread(funcao, *args):
+    """
+    Executa uma função síncrona (ex.: consultas SQLAlchemy) em uma thread,
+    dentro do contexto da aplicação Flask, sem bloquear o loop de eventos
+
+    Args:
+        funcao (callable): Função a ser executada
+        *args: Argumentos repassados à função
+
+    Returns:
+        O valor retornado pela função
+    """
+    return await asyncio.to_thread(_executar_no_contexto, funcao, args)
@@ -0,0 +1,166 @@
+"""
+Controle de admissão do caminho de resposta da IA
+
+Quando o provedor de IA fica lento, as chamadas se acumulam e todas as
+threads ficam presas aguardando a resposta. O controle de admissão limita
+as chamadas simultâneas e, acima dos limites de fila ou latência, rejeita
+novas mensagens: o lead recebe uma mensagem de espera e a resposta completa
+é gerada depois, por uma thread dedicada, assim que houver capacidade.
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+from app import app
+from config_sistema import obter_config_int, obter_config_float
+from fila_whatsapp import profundidade_total
+from agrupamento_mensagens import unir_mensagens
+import metricas
+
+logger = logging.getLogger(__name__)
+
+# Peso da amostra mais recente na média móvel de latência
+PESO_LATENCIA = 0.2
+
+class ControleAdmissao:
+    """Limita chamadas simultâneas à IA e mantém a fila de respostas adiadas"""
+
+    def __init__(self):
+        self.em_andamento = 0
+        self.latencia_media = 0.0
+        self._adiadas = OrderedDict()  # lead_id -> (textos, funcao)
+        self._lock = threading.Lock()
+        self._condicao = threading.Condition(self._lock)
+        self._thread = None
+
+    def _limites(self):
+        """Limites configurados (as threads do módulo leem dentro do contexto da aplicação)"""
+        return (
+            max(1, obter_config_int('ia_max_em_andamento', 8)),
+            obter_config_int('ia_max_fila', 50),
+            obter_config_float('ia_latencia_maxima', 20.0),
+        )
+
+    def admitir(self, lead_id=None):
+        """
+        Tenta reservar uma vaga para chamar a IA
+
+        Args:
+            lead_id (int): ID do lead; leads com resposta adiada pendente não são
+                           admitidos para que as respostas não saiam fora de ordem
+
+        Returns:
+            float: Instante de início a ser passado para liberar(), ou None se rejeitada
+        """
+        max_em_andamento, max_fila, latencia_maxima = self._limites()
+        profundidade = profundidade_total()
+
+        with self._lock:
+            motivo = None
+            if lead_id is not None and lead_id in self._adiadas:
+                motivo = 'resposta adiada pendente'
+            elif self.em_andamento >= max_em_andamento:
+                motivo = f'{self.em_andamento} chamadas em andamento'
+            elif max_fila > 0 and profundidade > max_fila:
+                motivo = f'fila com {profundidade} mensagens'
+            elif latencia_maxima > 0 and self.latencia_media > latencia_maxima:
+                motivo = f'latência média de {self.latencia_media:.1f}s'
+
+            if motivo is None:
+                self.em_andamento += 1
+                return time.monotonic()
+
+        metricas.incrementar('ia_mensagens_rejeitadas')
+        logger.warning(f"Mensagem rejeitada pelo controle de admissão: {motivo}")
+        return None
+
+    def liberar(self, inicio):
+        """Libera a vaga reservada e atualiza a latência média"""
+        duracao = time.monotonic() - inicio
+        metricas.registrar_latencia('ia_resposta', duracao)
+        with self._lock:
+            self.em_andamento -= 1
+            if self.latencia_media == 0.0:
+                self.latencia_media = duracao
+            else:
+                self.latencia_media += PESO_LATENCIA * (duracao - self.latencia_media)
+            self._condicao.notify_all()
+
+    def adiar(self, lead_id, texto, funcao):
+        """
+        Agenda a resposta completa de uma mensagem rejeitada
+
+        Mensagens adiadas de um mesmo lead são unidas em uma única resposta.
+
+        Args:
+            lead_id (int): ID do lead
+            texto (str): Conteúdo da mensagem
+            funcao (callable): Função chamada com (lead_id, texto) para responder
+
+        Returns:
+            bool: True se a mensagem foi adiada, False se a fila de adiadas está cheia
+        """
+        max_adiadas = obter_config_int('ia_max_fila_adiada', 200)
+        with self._lock:
+            if lead_id in self._adiadas:
+                self._adiadas[lead_id][0].append(texto)
+            elif len(self._adiadas) >= max_adiadas:
+                metricas.incrementar('ia_mensagens_adiadas_descartadas')
+                logger.error(f"Fila de respostas adiadas cheia; mensagem do lead {lead_id} descartada")
+                return False
+            else:
+                self._adiadas[lead_id] = ([texto], funcao)
+            metricas.incrementar('ia_mensagens_adiadas')
+            self._iniciar_thread()
+            self._condicao.notify_all()
+        return True
+
+    def _iniciar_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._processar_adiadas,
+                                            name='ia-adiadas', daemon=True)
+            self._thread.start()
+
+    def _processar_adiadas(self):
+        """Responde as mensagens adiadas, uma por vez, quando houver vaga"""
+        while True:
+            with self._lock:
+                # As adiadas respeitam apenas o limite de chamadas simultâneas
+                while not self._adiadas or self.em_andamento >= self._limite_em_andamento():
+                    self._condicao.wait(timeout=1.0)
+                lead_id, (textos, funcao) = self._adiadas.popitem(last=False)
+                self.em_andamento += 1
+                inicio = time.monotonic()
+
+            try:
+                with app.app_context():
+                    funcao(lead_id, unir_mensagens(textos))
+            except Exception as e:
+                logger.error(f"Erro ao responder mensagem adiada do lead {lead_id}: {str(e)}")
+            finally:
+                self.liberar(inicio)
+
+    def _limite_em_andamento(self):
+        # A thread das adiadas não tem contexto de aplicação: sem ele, as
+        # configurações editadas no banco seriam ignoradas
+        with app.app_context():
+            return self._limites()[0]
+
+    def estatisticas(self):
+        """Retorna o estado atual do controle de admissão"""
+        max_em_andamento, max_fila, latencia_maxima = self._limites()
+        return {
+            'em_andamento': self.em_andamento,
+            'max_em_andamento': max_em_andamento,
+            'fila_adiada': len(self._adiadas),
+            'profundidade_faixas': profundidade_total(),
+            'max_fila': max_fila,
+            'latencia_media_s': round(self.latencia_media, 3),
+            'latencia_maxima_s': latencia_maxima,
+            'rejeitadas': metricas.obter_contador('ia_mensagens_rejeitadas'),
+            'adiadas_descartadas': metricas.obter_contador('ia_mensagens_adiadas_descartadas'),
+        }
+
+controle_admissao = ControleAdmissao()
+
+metricas.registrar_coletor('controle_admissao', controle_admissao.estatisticas)
@@ -0,0 +1,123 @@
+"""
+Faixas de processamento para mensagens do WhatsApp
+
+As mensagens são distribuídas entre N faixas pelo hash do lead. Cada faixa é
+uma thread com sua própria fila, que executa as tarefas em série: mensagens de
+uma mesma conversa nunca são processadas fora de ordem, enquanto conversas
+diferentes avançam em paralelo. Para aumentar a vazão, basta aumentar o número
+de faixas ('whatsapp_faixas') em vez de adicionar processos do gunicorn: a
+ordem só é garantida dentro de um processo, e o Procfile roda um único worker.
+"""
+import time
+import zlib
+import queue
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from app import app
+from config_sistema import obter_config_int
+import metricas
+
+logger = logging.getLogger(__name__)
+
+class FaixaProcessamento:
+    """Thread que executa em série as tarefas dos leads atribuídos a ela"""
+
+    def __init__(self, indice):
+        self.indice = indice
+        self.fila = queue.Queue()
+        self.processadas = 0
+        self.erros = 0
+        self.latencias_espera = deque(maxlen=metricas.AMOSTRAS_LATENCIA)
+        self.latencias_execucao = deque(maxlen=metricas.AMOSTRAS_LATENCIA)
+        self.thread = threading.Thread(target=self._executar,
+                                       name=f'whatsapp-faixa-{indice}',
+                                       daemon=True)
+        self.thread.start()
+
+    def enfileirar(self, funcao, args):
+        """Adiciona uma tarefa ao fim da fila e retorna o Future do seu resultado"""
+        futuro = Future()
+        self.fila.put((time.monotonic(), funcao, args, futuro))
+        return futuro
+
+    def _executar(self):
+        while True:
+            enfileirada_em, funcao, args, futuro = self.fila.get()
+            if not futuro.set_running_or_notify_cancel():
+                continue
+
+            inicio = time.monotonic()
+            self.latencias_espera.append(inicio - enfileirada_em)
+            try:
+                with app.app_context():
+                    futuro.set_result(funcao(*args))
+            except Exception as e:
+                self.erros += 1
+                logger.error(f"Erro ao executar tarefa na faixa {self.indice}: {str(e)}")
+                futuro.set_exception(e)
+            finally:
+                self.processadas += 1
+                self.latencias_execucao.append(time.monotonic() - inicio)
+
+    def estatisticas(self):
+        """Retorna profundidade da fila, totais e latências da faixa"""
+        return {
+            'profundidade': self.fila.qsize(),
+            'processadas': self.processadas,
+            'erros': self.erros,
+            'espera': metricas.resumir_latencias(self.latencias_espera),
+            'execucao': metricas.resumir_latencias(self.latencias_execucao),
+        }
+
+_faixas = None
+_lock = threading.Lock()
+
+def _obter_faixas():
+    """Cria as faixas na primeira utilização"""
+    global _faixas
+    if _faixas is None:
+        with _lock:
+            if _faixas is None:
+                total = max(1, obter_config_int('whatsapp_faixas', 4))
+                _faixas = [FaixaProcessamento(indice) for indice in range(total)]
+                logger.info(f"Processamento do WhatsApp iniciado com {total} faixas")
+    return _faixas
+
+def indice_faixa(chave, total):
+    """Calcula a faixa de uma chave com um hash estável entre processos"""
+    return zlib.crc32(str(chave).encode('utf-8')) % total
+
+def enfileirar_por_lead(chave, funcao, *args):
+    """
+    Agenda a execução de uma tarefa na faixa do lead
+
+    Args:
+        chave: Identificador do lead (ID ou telefone normalizado)
+        funcao (callable): Função a ser executada dentro do contexto da aplicação
+        *args: Argumentos repassados à função
+
+    Returns:
+        Future: Resultado da tarefa, para quem precisar aguardá-lo
+    """
+    faixas = _obter_faixas()
+    return faixas[indice_faixa(chave, len(faixas))].enfileirar(funcao, args)
+
+def profundidade_total():
+    """Retorna a quantidade de tarefas aguardando em todas as faixas"""
+    if _faixas is None:
+        return 0
+    return sum(faixa.fila.qsize() for faixa in _faixas)
+
+def estatisticas_faixas():
+    """Retorna as estatísticas de todas as faixas já iniciadas"""
+    if _faixas is None:
+        return {'faixas': 0}
+    return {
+        'faixas': len(_faixas),
+        'profundidade_total': profundidade_total(),
+        'por_faixa': [faixa.estatisticas() for faixa in _faixas],
+    }
+
+metricas.registrar_coletor('faixas_whatsapp', estatisticas_faixas)
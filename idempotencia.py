@@ -0,0 +1,152 @@
+"""
+Idempotência do webhook do WhatsApp com base no MessageSid da Twilio
+
+A Twilio reenvia o webhook quando não recebe resposta a tempo. Cada MessageSid
+é reservado antes do processamento; reenvios são respondidos com o resultado
+armazenado, sem registrar interações nem chamar a IA novamente. O banco garante
+a deduplicação entre processos e um cache LRU evita a consulta na maioria dos casos.
+"""
+import time
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from database import db
+from models import MensagemProcessada
+from cache_lru import CacheLRU
+from config_sistema import obter_config_float
+import metricas
+
+logger = logging.getLogger(__name__)
+
+# Intervalo mínimo (em segundos) entre limpezas de registros expirados
+INTERVALO_LIMPEZA = 3600
+
+_EM_PROCESSAMENTO = object()
+_AUSENTE = object()
+
+_cache = CacheLRU(tamanho_maximo=5000, ttl=None)
+_ultima_limpeza = 0.0
+
+def _ttl_horas():
+    return max(1.0, obter_config_float('whatsapp_ttl_idempotencia_horas', 24.0))
+
+def reservar_mensagem(message_sid, lead_id=None):
+    """
+    Reserva um MessageSid para processamento
+
+    Args:
+        message_sid (str): Identificador da mensagem enviado pela Twilio
+        lead_id (int): ID do lead, se já conhecido
+
+    Returns:
+        tuple: (duplicada, resposta). Se duplicada for True, resposta contém o
+               resultado armazenado (None se o processamento ainda não terminou)
+    """
+    if not message_sid:
+        return False, None
+
+    _cache.ttl = _ttl_horas() * 3600
+    valor = _cache.obter(message_sid, _AUSENTE)
+    if valor is not _AUSENTE:
+        return _registrar_duplicada(message_sid, valor)
+
+    try:
+        db.session.add(MensagemProcessada(message_sid=message_sid, lead_id=lead_id))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        registro = MensagemProcessada.query.get(message_sid)
+        resposta = registro.resposta if registro and registro.resposta is not None else _EM_PROCESSAMENTO
+        _cache.definir(message_sid, resposta)
+        return _registrar_duplicada(message_sid, resposta)
+
+    _cache.definir(message_sid, _EM_PROCESSAMENTO)
+    metricas.incrementar('webhook_mensagens_unicas')
+    _limpar_expiradas()
+    return False, None
+
+def _registrar_duplicada(message_sid, valor):
+    """Contabiliza um reenvio e marca a mensagem caso a resposta ainda não esteja pronta"""
+    metricas.incrementar('webhook_mensagens_duplicadas')
+    logger.info(f"Mensagem {message_sid} já recebida anteriormente; reenvio ignorado")
+
+    if valor is _EM_PROCESSAMENTO:
+        try:
+            # A resposta do primeiro webhook não chegará à Twilio: ela deve seguir pela API REST
+            MensagemProcessada.query.filter_by(message_sid=message_sid).update({'reentregue': True})
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Erro ao marcar reenvio da mensagem {message_sid}: {str(e)}")
+        return True, None
+
+    return True, valor
+
+def registrar_resposta(message_sid, resposta, lead_id=None):
+    """
+    Armazena o resultado do processamento de uma mensagem reservada
+
+    Args:
+        message_sid (str): Identificador da mensagem
+        resposta (str): Resposta devolvida (vazia se não houve resposta própria)
+        lead_id (int): ID do lead da conversa
+
+    Returns:
+        bool: True se a Twilio reenviou a mensagem durante o processamento, indicando
+              que a resposta deve ser enviada pela API REST
+    """
+    if not message_sid:
+        return False
+
+    resposta = resposta or ''
+    try:
+        registro = MensagemProcessada.query.get(message_sid)
+        if not registro:
+            _cache.definir(message_sid, resposta)
+            return False
+        reentregue = bool(registro.reentregue)
+        if reentregue:
+            # A resposta seguirá pela API REST; novos reenvios recebem apenas a confirmação
+            resposta = ''
+        registro.resposta = resposta
+        if lead_id:
+            registro.lead_id = lead_id
+        db.session.commit()
+        _cache.definir(message_sid, resposta)
+        return reentregue
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erro ao registrar resposta da mensagem {message_sid}: {str(e)}")
+        return False
+
+def liberar_mensagem(message_sid):
+    """Remove a reserva de uma mensagem cujo processamento falhou, permitindo novo envio"""
+    if not message_sid:
+        return
+
+    _cache.remover(message_sid)
+    try:
+        MensagemProcessada.query.filter_by(message_sid=message_sid).delete()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erro ao liberar mensagem {message_sid}: {str(e)}")
+
+def _limpar_expiradas():
+    """Remove do banco os registros mais antigos que o TTL (no máximo uma vez por hora)"""
+    global _ultima_limpeza
+
+    agora = time.monotonic()
+    if agora - _ultima_limpeza < INTERVALO_LIMPEZA:
+        return
+    _ultima_limpeza = agora
+
+    try:
+        limite = datetime.utcnow() - timedelta(hours=_ttl_horas())
+        removidos = MensagemProcessada.query.filter(MensagemProcessada.criado_em < limite).delete()
+        db.session.commit()
+        if removidos:
+            logger.info(f"{removidos} registros de idempotência expirados removidos")
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erro ao limpar registros de idempotência: {str(e)}")
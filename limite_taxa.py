@@ -0,0 +1,229 @@
+"""
+Limite de requisições e tokens por minuto (RPM/TPM) da conta na OpenAI
+
+Os processos do gunicorn e as threads de segundo plano chamam a API de forma
+independente. Para que juntos não ultrapassem os limites da conta, cada
+chamada adquire fichas de dois baldes (requisições e tokens) guardados em uma
+linha da tabela limite_taxa, bloqueada durante a atualização. Os baldes são
+recarregados continuamente na taxa configurada.
+
+As chamadas têm prioridade: as que respondem ao lead (alta) podem usar o balde
+inteiro, enquanto as de segundo plano (baixa) só usam fichas acima de uma
+reserva, para que lembretes e resumos nunca atrasem um atendimento. Quem
+espera além do limite da sua prioridade recebe ErroLimiteTaxa e usa a
+resposta de contingência.
+"""
+import time
+import random
+import asyncio
+import logging
+import threading
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from models import LimiteTaxa
+from config_sistema import obter_config, obter_config_int, obter_config_float
+import metricas
+
+logger = logging.getLogger(__name__)
+
+PRIORIDADE_ALTA = 'alta'
+PRIORIDADE_BAIXA = 'baixa'
+
+# Chamadas do caminho da resposta ao lead
+PROPOSITOS_ALTA = 'resposta,resposta_em_partes,resposta_com_analise,sentimento'
+
+# Espera mínima entre duas tentativas de aquisição
+ESPERA_MINIMA = 0.05
+
+# Serializa as aquisições do processo (entre processos, vale o bloqueio da linha)
+_lock = threading.Lock()
+
+class ErroLimiteTaxa(Exception):
+    """Chamada rejeitada porque o limite de taxa não liberou fichas a tempo"""
+
+def limite_ativo():
+    """Indica se há um limite de requisições ou de tokens por minuto configurado"""
+    return obter_config_int('ia_limite_rpm', 0) > 0 or obter_config_int('ia_limite_tpm', 0) > 0
+
+def prioridade(proposito):
+    """Prioridade de uma chamada a partir do seu propósito"""
+    propositos = obter_config('ia_limite_propositos_alta', PROPOSITOS_ALTA)
+    if proposito in {nome.strip() for nome in propositos.split(',')}:
+        return PRIORIDADE_ALTA
+    return PRIORIDADE_BAIXA
+
+def _tentar(chave, tokens, classe):
+    """
+    Tenta retirar as fichas de uma chamada dos baldes compartilhados
+
+    Returns:
+        float: 0 se as fichas foram retiradas; senão, segundos estimados até haver fichas
+    """
+    rpm = obter_config_int('ia_limite_rpm', 0)
+    tpm = obter_config_int('ia_limite_tpm', 0)
+    # Fração dos baldes que só as chamadas de prioridade alta podem usar
+    reserva = 0.0 if classe == PRIORIDADE_ALTA else min(0.9, max(0.0, obter_config_float('ia_limite_reserva', 0.2)))
+
+    with _lock, app.app_context():
+        try:
+            balde = db.session.query(LimiteTaxa).filter_by(chave=chave).with_for_update().one_or_none()
+            agora = time.time()
+            if balde is None:
+                balde = LimiteTaxa(chave=chave, requisicoes=float(rpm), tokens=float(tpm), atualizado_em=agora)
+                db.session.add(balde)
+
+            decorrido = max(0.0, agora - balde.atualizado_em)
+            balde.requisicoes = min(float(rpm), balde.requisicoes + decorrido * rpm / 60)
+            balde.tokens = min(float(tpm), balde.tokens + decorrido * tpm / 60)
+            balde.atualizado_em = agora
+
+            espera = 0.0
+            if rpm > 0:
+                faltam = 1 + reserva * rpm - balde.requisicoes
+                espera = max(espera, faltam * 60 / rpm)
+            if tpm > 0:
+                # Uma chamada maior que o balde inteiro espera apenas o balde encher
+                faltam = min(tokens, tpm * (1 - reserva)) + reserva * tpm - balde.tokens
+                espera = max(espera, faltam * 60 / tpm)
+            if espera <= 0:
+                if rpm > 0:
+                    balde.requisicoes -= 1
+                if tpm > 0:
+                    balde.tokens -= min(tokens, tpm * (1 - reserva))
+            db.session.commit()
+            return max(0.0, espera)
+        except IntegrityError:
+            # Outro processo criou a linha ao mesmo tempo: tentar de novo em seguida
+            db.session.rollback()
+            return ESPERA_MINIMA
+        except Exception:
+            db.session.rollback()
+            raise
+
+def _espera_maxima(classe):
+    if classe == PRIORIDADE_ALTA:
+        return obter_config_float('ia_limite_espera_maxima_alta', 10.0)
+    return obter_config_float('ia_limite_espera_maxima_baixa', 60.0)
+
+def _proxima_espera(espera, inicio, limite, classe, proposito):
+    """Tempo até a próxima tentativa, ou ErroLimiteTaxa se o limite de espera estourar"""
+    decorrido = time.monotonic() - inicio
+    if decorrido + espera > limite:
+        metricas.incrementar(f'ia_limite_rejeitadas_{classe}')
+        metricas.registrar_latencia(f'ia_limite_espera_{classe}', decorrido)
+        raise ErroLimiteTaxa(f"Limite de taxa da IA atingido, chamada '{proposito}' rejeitada "
+                             f"após {decorrido:.1f}s de espera")
+    # Aleatorizar a espera evita que os processos acordem todos juntos
+    return max(ESPERA_MINIMA, espera * random.uniform(1.0, 1.2))
+
+def _concluir(inicio, classe, tentativas):
+    espera = time.monotonic() - inicio
+    metricas.registrar_latencia(f'ia_limite_espera_{classe}', espera)
+    if tentativas > 1:
+        metricas.incrementar(f'ia_limite_esperas_{classe}')
+        logger.info(f"Chamada de prioridade {classe} aguardou {espera:.2f}s pelo limite de taxa da IA")
+
+def adquirir(proposito, tokens, chave='openai'):
+    """
+    Aguarda até haver fichas para uma chamada e as retira dos baldes
+
+    Se a tabela não puder ser consultada, a chamada segue sem limite (o
+    limite nunca deve derrubar o atendimento).
+
+    Args:
+        proposito (str): Nome da chamada, que define a prioridade
+        tokens (int): Tokens estimados da chamada (prompt + máximo de saída)
+        chave (str): Conta ou provedor limitado
+
+    Raises:
+        ErroLimiteTaxa: Se a espera passar do limite da prioridade
+    """
+    classe = prioridade(proposito)
+    limite = _espera_maxima(classe)
+    inicio = time.monotonic()
+    tentativas = 0
+    while True:
+        tentativas += 1
+        try:
+            espera = _tentar(chave, tokens, classe)
+        except Exception as e:
+            metricas.incrementar('ia_limite_falhas')
+            logger.error(f"Erro ao consultar o limite de taxa da IA, seguindo sem limite: {str(e)}")
+            return
+        if espera <= 0:
+            _concluir(inicio, classe, tentativas)
+            return
+        time.sleep(_proxima_espera(espera, inicio, limite, classe, proposito))
+
+async def adquirir_async(proposito, tokens, chave='openai'):
+    """Versão assíncrona de adquirir (a consulta ao banco roda em uma thread)"""
+    classe = prioridade(proposito)
+    limite = _espera_maxima(classe)
+    inicio = time.monotonic()
+    tentativas = 0
+    while True:
+        tentativas += 1
+        try:
+            espera = await asyncio.to_thread(_tentar, chave, tokens, classe)
+        except Exception as e:
+            metricas.incrementar('ia_limite_falhas')
+            logger.error(f"Erro ao consultar o limite de taxa da IA, seguindo sem limite: {str(e)}")
+            return
+        if espera <= 0:
+            _concluir(inicio, classe, tentativas)
+            return
+        await asyncio.sleep(_proxima_espera(espera, inicio, limite, classe, proposito))
+
+def tentar_adquirir(proposito, tokens, chave='openai'):
+    """
+    Retira as fichas de uma chamada apenas se elas já estiverem disponíveis
+
+    Returns:
+        bool: True se as fichas foram retiradas (ou a tabela não pôde ser consultada)
+    """
+    try:
+        return _tentar(chave, tokens, prioridade(proposito)) <= 0
+    except Exception as e:
+        metricas.incrementar('ia_limite_falhas')
+        logger.error(f"Erro ao consultar o limite de taxa da IA, seguindo sem limite: {str(e)}")
+        return True
+
+def cobranca(proposito, tokens, chave='openai'):
+    """
+    Função com que o cliente_ia cobra dos baldes as requisições extras de uma
+    chamada (repetições e duplicadas do hedging), que também contam nos
+    limites da conta
+
+    Returns:
+        callable: cobrar(esperar=True) aguarda as fichas como adquirir;
+                  cobrar(esperar=False) só as retira se já estiverem disponíveis
+                  e retorna se conseguiu
+    """
+    def cobrar(esperar=True):
+        if not esperar:
+            return tentar_adquirir(proposito, tokens, chave)
+        adquirir(proposito, tokens, chave)
+        return True
+    return cobrar
+
+def cobranca_async(proposito, tokens, chave='openai'):
+    """Versão assíncrona de cobranca (cobrar é uma corrotina)"""
+    async def cobrar(esperar=True):
+        if not esperar:
+            return await asyncio.to_thread(tentar_adquirir, proposito, tokens, chave)
+        await adquirir_async(proposito, tokens, chave)
+        return True
+    return cobrar
+
+def estatisticas():
+    """Esperas, rejeições e falhas do limite de taxa por prioridade"""
+    return {
+        'ativo': limite_ativo(),
+        'esperas_alta': metricas.obter_contador('ia_limite_esperas_alta'),
+        'esperas_baixa': metricas.obter_contador('ia_limite_esperas_baixa'),
+        'rejeitadas_alta': metricas.obter_contador('ia_limite_rejeitadas_alta'),
+        'rejeitadas_baixa': metricas.obter_contador('ia_limite_rejeitadas_baixa'),
+        'falhas': metricas.obter_contador('ia_limite_falhas'),
+    }
+
+metricas.registrar_coletor('limite_taxa', estatisticas)
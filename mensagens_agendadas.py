@@ -0,0 +1,396 @@
+"""
+Mensagens agendadas (lembretes de formulário e reativação de leads) geradas em lote
+
+Uma vez por dia, a tarefa do agendador junta todos os itens devidos, que são
+os formulários pendentes há 'lembrete_formulario_dias' dias e os leads sem
+resposta há 'reativacao_dias' dias, e submete a geração dos textos como um
+único lote na Batch API do provedor, com custo menor e sem disputar o limite
+de taxa com as respostas ao vivo. Outra tarefa consulta os lotes em
+andamento a cada 'lote_consulta_intervalo_minutos' minutos e envia as
+mensagens quando os resultados chegam. Itens sem resultado recebem o texto
+padrão. Assim a tarefa diária não espera uma chamada à IA por lead.
+
+Os lembretes personalizados usam as variantes por tipo de formulário
+(variantes_lembrete) sempre que existirem. Só os tipos sem variantes entram
+no lote com um texto gerado por lead. As variantes são regeneradas por uma
+tarefa própria, uma hora antes da coleta, para que a coleta nunca espere
+uma chamada à IA.
+
+Os itens são gravados com um custom_id que inclui a data (ex.:
+'lembrete-12-20250101'). Isso impede que o mesmo item entre em dois lotes no
+mesmo dia, mesmo com mais de um processo executando o agendador.
+"""
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from models import Formulario, Interacao, ItemLoteIA, Lead, LoteIA
+from config_sistema import obter_config, obter_config_bool, obter_config_int
+from provedores_ia import obter_provedor, requisicao_lote, LOTE_EM_ANDAMENTO, LOTE_CONCLUIDO
+from registro_chamadas import registrar as registrar_chamada, RESULTADO_SUCESSO, RESULTADO_ERRO
+import metricas
+
+logger = logging.getLogger(__name__)
+
+TIPO_LEMBRETE = 'lembrete'
+TIPO_REATIVACAO = 'reativacao'
+
+# Situação dos lotes na tabela LoteIA
+STATUS_ENVIANDO = 'enviando'
+STATUS_EM_ANDAMENTO = 'em_andamento'
+STATUS_ENTREGANDO = 'entregando'
+STATUS_CONCLUIDO = 'concluido'
+STATUS_FALHOU = 'falhou'
+
+# Leads que ainda podem ser reativados
+STATUS_LEADS_ATIVOS = ('novo', 'em_contato')
+
+def mensagens_agendadas_ativas():
+    """Indica se os lembretes e as reativações automáticas estão habilitados"""
+    return obter_config_bool('mensagens_agendadas', False)
+
+def agendar_tarefas(scheduler):
+    """
+    Registra no agendador a atualização das variantes, a coleta diária e a
+    consulta dos lotes
+
+    A hora da coleta ('mensagens_agendadas_hora') é lida ao iniciar o
+    agendador; a habilitação é verificada a cada execução.
+    """
+    hora = obter_config_int('mensagens_agendadas_hora', 9)
+    scheduler.add_job(_executar_variantes, 'cron', hour=(hora - 1) % 24,
+                      id='mensagens_agendadas_variantes', replace_existing=True)
+    scheduler.add_job(_executar_coleta, 'cron', hour=hora,
+                      id='mensagens_agendadas_coleta', replace_existing=True)
+    scheduler.add_job(_executar_consulta, 'interval',
+                      minutes=max(1, obter_config_int('lote_consulta_intervalo_minutos', 5)),
+                      id='mensagens_agendadas_lotes', replace_existing=True)
+
+def _executar_variantes():
+    try:
+        with app.app_context():
+            if mensagens_agendadas_ativas():
+                atualizar_variantes_pendentes()
+    except Exception as e:
+        logger.error(f"Erro na atualização das variantes de lembrete: {str(e)}")
+
+def _executar_coleta():
+    try:
+        with app.app_context():
+            if mensagens_agendadas_ativas():
+                coletar_mensagens_agendadas()
+    except Exception as e:
+        logger.error(f"Erro na coleta de mensagens agendadas: {str(e)}")
+
+def _executar_consulta():
+    try:
+        with app.app_context():
+            processar_lotes_pendentes()
+    except Exception as e:
+        logger.error(f"Erro na consulta de lotes de mensagens: {str(e)}")
+
+def _lembrete_personalizado():
+    return obter_config_bool('ia_lembrete_personalizado', False)
+
+def _parametros(mensagens):
+    """Parâmetros da chamada de chat de cada item do lote"""
+    from ai_agent import MODELO_ECONOMICO
+    return {'model': obter_config('ia_modelo_lembrete', MODELO_ECONOMICO), 'messages': mensagens,
+            'temperature': 0.7}
+
+def _limite_reativacao(agora):
+    return agora - timedelta(days=obter_config_int('reativacao_dias', 5))
+
+def _lead_inativo(lead_id, limite):
+    """Lead cuja última interação é anterior ao limite e não foi uma mensagem do sistema"""
+    ultima = Interacao.query.filter_by(lead_id=lead_id).order_by(Interacao.id.desc()).first()
+    return ultima is not None and ultima.origem != 'sistema' and ultima.data_hora <= limite
+
+def atualizar_variantes_pendentes():
+    """
+    Regenera as variantes de lembrete dos tipos com formulários pendentes
+
+    Returns:
+        int: Quantidade de tipos atualizados
+    """
+    from variantes_lembrete import variantes_ativas, atualizar_variantes
+    if not _lembrete_personalizado() or not variantes_ativas():
+        return 0
+    tipos = [tipo for (tipo,) in db.session.query(Formulario.tipo)
+             .filter(Formulario.status == 'pendente').distinct().all()]
+    return atualizar_variantes(tipos)
+
+def _itens_devidos(agora):
+    """
+    Junta os lembretes e as reativações devidos que ainda não estão em um lote
+
+    Returns:
+        list: Pares (ItemLoteIA, parâmetros da chamada ou None se o item não usa a IA)
+    """
+    from ai_agent import mensagens_lembrete_formulario, mensagens_reativacao
+    from resumo_conversa import obter_resumo
+    from variantes_lembrete import variantes_ativas, obter_variantes
+
+    maximo = max(1, obter_config_int('lote_maximo_itens', 5000))
+    sufixo = agora.strftime('%Y%m%d')
+    itens = []
+
+    limite = agora - timedelta(days=obter_config_int('lembrete_formulario_dias', 2))
+    formularios = (Formulario.query
+                   .filter(Formulario.status == 'pendente',
+                           Formulario.lembrete_enviado.isnot(True),
+                           Formulario.data_envio <= limite)
+                   .order_by(Formulario.id.asc())
+                   .limit(maximo)
+                   .all())
+    leads = {lead.id: lead for lead in
+             Lead.query.filter(Lead.id.in_({formulario.lead_id for formulario in formularios})).all()}
+    personalizado = _lembrete_personalizado()
+    com_variantes = set()
+    if personalizado and variantes_ativas():
+        # Apenas as variantes já geradas: a atualização tem uma tarefa própria
+        com_variantes = {tipo for tipo in {formulario.tipo for formulario in formularios}
+                         if obter_variantes(tipo)}
+    for formulario in formularios:
+        lead = leads.get(formulario.lead_id)
+        if lead is None:
+            continue
+        item = ItemLoteIA(custom_id=f"{TIPO_LEMBRETE}-{formulario.id}-{sufixo}", tipo=TIPO_LEMBRETE,
+                          lead_id=lead.id, formulario_id=formulario.id)
+        # Sem personalização, ou com variantes do tipo, o lembrete não precisa da IA
+        parametros = None
+        if personalizado and formulario.tipo not in com_variantes:
+            parametros = _parametros(mensagens_lembrete_formulario(lead.nome, formulario.tipo))
+        itens.append((item, parametros))
+
+    # Um único contato por dia: leads com lembrete não recebem também a reativação
+    com_lembrete = {item.lead_id for item, _ in itens}
+    ultimas = db.select(db.func.max(Interacao.id)).group_by(Interacao.lead_id)
+    inativos = (db.session.query(Lead)
+                .join(Interacao, Interacao.lead_id == Lead.id)
+                .filter(Interacao.id.in_(ultimas),
+                        Interacao.origem != 'sistema',
+                        Interacao.data_hora <= _limite_reativacao(agora),
+                        Lead.status.in_(STATUS_LEADS_ATIVOS))
+                .order_by(Lead.id.asc())
+                .limit(max(0, maximo - len(itens)))
+                .all())
+    for lead in inativos:
+        if lead.id in com_lembrete:
+            continue
+        resumo = obter_resumo(lead.id)
+        item = ItemLoteIA(custom_id=f"{TIPO_REATIVACAO}-{lead.id}-{sufixo}", tipo=TIPO_REATIVACAO,
+                          lead_id=lead.id)
+        itens.append((item, _parametros(mensagens_reativacao(lead.nome, resumo.resumo if resumo else ''))))
+
+    # Descartar os itens que outra execução já colocou em um lote hoje
+    existentes = {custom_id for (custom_id,) in db.session.query(ItemLoteIA.custom_id)
+                  .filter(ItemLoteIA.custom_id.in_([item.custom_id for item, _ in itens])).all()}
+    return [(item, parametros) for item, parametros in itens if item.custom_id not in existentes]
+
+def coletar_mensagens_agendadas():
+    """
+    Junta as mensagens devidas e submete a geração dos textos em um único lote
+
+    Sem suporte a lotes no provedor, ou com 'ia_lote' desativado, os textos
+    são gerados um a um e as mensagens são enviadas na hora.
+
+    Returns:
+        int: Quantidade de itens coletados
+    """
+    agora = datetime.utcnow()
+    itens = _itens_devidos(agora)
+    if not itens:
+        return 0
+
+    provedor = obter_provedor()
+    lote = LoteIA(provedor=provedor.nome, status=STATUS_ENVIANDO, total_itens=len(itens))
+    db.session.add(lote)
+    db.session.flush()
+    for item, _ in itens:
+        item.lote_id = lote.id
+        db.session.add(item)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Outro processo coletou os mesmos itens ao mesmo tempo
+        db.session.rollback()
+        logger.warning("Mensagens agendadas já coletadas por outro processo")
+        return 0
+    metricas.incrementar('mensagens_agendadas_coletadas', len(itens))
+
+    requisicoes = [requisicao_lote(item.custom_id, parametros) for item, parametros in itens if parametros]
+    if not requisicoes:
+        _entregar(lote, {}, STATUS_CONCLUIDO)
+        return len(itens)
+
+    if not provedor.suporta_lote or not obter_config_bool('ia_lote', True):
+        _entregar(lote, _gerar_sem_lote(itens), STATUS_CONCLUIDO)
+        return len(itens)
+
+    try:
+        lote.lote_externo = provedor.enviar_lote(requisicoes)
+        lote.status = STATUS_EM_ANDAMENTO
+        db.session.commit()
+    except Exception as e:
+        logger.error(f"Erro ao submeter o lote de mensagens agendadas: {str(e)}")
+        db.session.rollback()
+        _entregar(lote, {}, STATUS_FALHOU)
+        return len(itens)
+
+    logger.info(f"Lote {lote.id} de mensagens agendadas submetido ({len(requisicoes)} chamadas, "
+                f"{len(itens)} itens)")
+    return len(itens)
+
+def _gerar_sem_lote(itens):
+    """Gera os textos com uma chamada por item (provedores sem Batch API)"""
+    from ai_agent import gerar_lembrete_formulario, gerar_mensagem_reativacao
+    textos = {}
+    for item, parametros in itens:
+        if not parametros:
+            continue
+        if item.tipo == TIPO_LEMBRETE:
+            formulario = Formulario.query.get(item.formulario_id)
+            if formulario:
+                textos[item.custom_id] = gerar_lembrete_formulario(item.lead_id, formulario.tipo)
+        else:
+            textos[item.custom_id] = gerar_mensagem_reativacao(item.lead_id)
+    return textos
+
+def processar_lotes_pendentes():
+    """
+    Consulta os lotes em andamento e envia as mensagens dos que terminaram
+
+    Lotes sem resultado depois de 'lote_prazo_horas' horas (ou que o provedor
+    atual não consegue consultar) são entregues com os textos padrão.
+
+    Returns:
+        int: Quantidade de lotes entregues
+    """
+    lotes = LoteIA.query.filter_by(status=STATUS_EM_ANDAMENTO).order_by(LoteIA.id.asc()).all()
+    if not lotes:
+        return 0
+
+    provedor = obter_provedor()
+    prazo = datetime.utcnow() - timedelta(hours=obter_config_int('lote_prazo_horas', 26))
+    entregues = 0
+    for lote in lotes:
+        try:
+            if lote.provedor != provedor.nome:
+                raise RuntimeError(f"lote do provedor '{lote.provedor}'")
+            situacao, linhas = provedor.consultar_lote(lote.lote_externo)
+        except Exception as e:
+            logger.error(f"Erro ao consultar o lote {lote.id}: {str(e)}")
+            situacao, linhas = LOTE_EM_ANDAMENTO, []
+
+        if situacao == LOTE_EM_ANDAMENTO:
+            if lote.criado_em > prazo:
+                continue
+            logger.warning(f"Lote {lote.id} sem resultado no prazo, usando os textos padrão")
+            situacao = STATUS_FALHOU
+
+        # Apenas um processo entrega cada lote
+        reivindicado = (LoteIA.query
+                        .filter_by(id=lote.id, status=STATUS_EM_ANDAMENTO)
+                        .update({'status': STATUS_ENTREGANDO}, synchronize_session=False))
+        db.session.commit()
+        if not reivindicado:
+            continue
+
+        textos = _interpretar(lote, linhas)
+        _entregar(lote, textos, STATUS_CONCLUIDO if situacao == LOTE_CONCLUIDO else STATUS_FALHOU)
+        entregues += 1
+    return entregues
+
+def _interpretar(lote, linhas):
+    """
+    Extrai os textos gerados das linhas do arquivo de saída e registra cada chamada
+
+    Returns:
+        dict: custom_id -> texto gerado
+    """
+    itens = {item.custom_id: item for item in ItemLoteIA.query.filter_by(lote_id=lote.id).all()}
+    segundos = (datetime.utcnow() - lote.criado_em).total_seconds()
+    metricas.registrar_latencia('mensagens_agendadas_lote', segundos)
+
+    textos = {}
+    for linha in linhas:
+        item = itens.get(linha.get('custom_id'))
+        if item is None:
+            continue
+        resposta = linha.get('response') or {}
+        corpo = resposta.get('body') or {}
+        uso = corpo.get('usage') or {}
+        proposito = f"{item.tipo}_lote"
+        try:
+            texto = corpo['choices'][0]['message']['content'].strip() if resposta.get('status_code') == 200 else None
+        except (KeyError, IndexError, TypeError, AttributeError):
+            texto = None
+        if texto:
+            textos[item.custom_id] = texto
+            registrar_chamada(proposito, corpo.get('model'), item.lead_id, uso.get('prompt_tokens', 0),
+                              uso.get('completion_tokens', 0), segundos, RESULTADO_SUCESSO, lote=True)
+        else:
+            erro = linha.get('error') or corpo.get('error') or {}
+            registrar_chamada(proposito, corpo.get('model'), item.lead_id, segundos=segundos,
+                              resultado=RESULTADO_ERRO, erro=str(erro.get('code') or 'sem_resposta'),
+                              lote=True)
+    return textos
+
+def _entregar(lote, textos, status_final):
+    """Envia as mensagens dos itens pendentes do lote e registra o resultado de cada um"""
+    from ai_agent import lembrete_formulario_padrao, reativacao_padrao
+    from notification import enviar_lembrete_formulario, enviar_mensagem_reativacao
+    from variantes_lembrete import variantes_ativas, escolher_variante
+
+    limite_reativacao = _limite_reativacao(datetime.utcnow())
+    personalizado = _lembrete_personalizado()
+    contagem = {'enviado': 0, 'descartado': 0, 'falhou': 0}
+    for item in ItemLoteIA.query.filter_by(lote_id=lote.id, status='pendente').order_by(ItemLoteIA.custom_id).all():
+        lead = Lead.query.get(item.lead_id)
+        texto = textos.get(item.custom_id)
+        try:
+            if item.tipo == TIPO_LEMBRETE:
+                # O formulário pode ter sido respondido enquanto o lote era processado
+                formulario = Formulario.query.get(item.formulario_id)
+                if lead is None or formulario is None or formulario.status != 'pendente' or formulario.lembrete_enviado:
+                    item.status = 'descartado'
+                else:
+                    if texto is None and personalizado and variantes_ativas():
+                        texto = escolher_variante(formulario.tipo, lead.nome,
+                                                  lead.id + (formulario.numero_lembretes or 0))
+                    if texto is None and personalizado:
+                        texto = lembrete_formulario_padrao(lead.nome, formulario.tipo)
+                        metricas.incrementar('mensagens_agendadas_texto_padrao')
+                    item.texto = texto
+                    enviado = enviar_lembrete_formulario(formulario.id, texto)
+                    item.status = 'enviado' if enviado else 'falhou'
+            else:
+                # O lead pode ter respondido enquanto o lote era processado
+                if (lead is None or lead.status not in STATUS_LEADS_ATIVOS
+                        or not _lead_inativo(lead.id, limite_reativacao)):
+                    item.status = 'descartado'
+                else:
+                    if texto is None:
+                        texto = reativacao_padrao(lead.nome)
+                        metricas.incrementar('mensagens_agendadas_texto_padrao')
+                    item.texto = texto
+                    enviado = enviar_mensagem_reativacao(lead.id, texto)
+                    item.status = 'enviado' if enviado else 'falhou'
+            db.session.commit()
+        except Exception as e:
+            logger.error(f"Erro ao enviar a mensagem agendada {item.custom_id}: {str(e)}")
+            db.session.rollback()
+            item.status = 'falhou'
+            db.session.commit()
+        contagem[item.status] += 1
+
+    lote.status = status_final
+    lote.concluido_em = datetime.utcnow()
+    db.session.commit()
+
+    metricas.incrementar('mensagens_agendadas_enviadas', contagem['enviado'])
+    metricas.incrementar('mensagens_agendadas_descartadas', contagem['descartado'])
+    metricas.incrementar('mensagens_agendadas_falhas', contagem['falhou'])
+    logger.info(f"Lote {lote.id} de mensagens agendadas entregue: {contagem['enviado']} enviadas, "
+                f"{contagem['descartado']} descartadas, {contagem['falhou']} falhas")
@@ -0,0 +1,97 @@
+"""
+Métricas operacionais do processo (contadores, medidores e latências)
+
+Os valores ficam em memória e são individuais de cada processo do gunicorn.
+Ficam disponíveis em JSON na rota /api/metricas.
+"""
+import threading
+from collections import defaultdict, deque
+
+# Quantidade de amostras de latência mantidas por métrica
+AMOSTRAS_LATENCIA = 1000
+
+_contadores = defaultdict(int)
+_medidores = {}
+_latencias = defaultdict(lambda: deque(maxlen=AMOSTRAS_LATENCIA))
+_coletores = {}
+_lock = threading.Lock()
+
+def incrementar(nome, valor=1):
+    """Soma um valor a um contador"""
+    with _lock:
+        _contadores[nome] += valor
+
+def definir(nome, valor):
+    """Define o valor atual de um medidor"""
+    with _lock:
+        _medidores[nome] = valor
+
+def registrar_latencia(nome, segundos):
+    """Registra uma amostra de latência (em segundos)"""
+    with _lock:
+        _latencias[nome].append(segundos)
+
+def registrar_coletor(nome, funcao):
+    """
+    Registra uma função chamada a cada consulta para gerar métricas sob demanda
+
+    Args:
+        nome (str): Nome da seção nas métricas
+        funcao (callable): Função sem argumentos que retorna um dicionário
+    """
+    _coletores[nome] = funcao
+
+def percentil(amostras, p):
+    """Calcula o percentil p (0-100) de uma lista de amostras"""
+    if not amostras:
+        return 0.0
+    ordenadas = sorted(amostras)
+    indice = min(len(ordenadas) - 1, int(round(p / 100 * (len(ordenadas) - 1))))
+    return ordenadas[indice]
+
+def resumir_latencias(amostras):
+    """Resume uma lista de latências em contagem, média e percentis (ms)"""
+    amostras = list(amostras)
+    if not amostras:
+        return {'amostras': 0}
+    return {
+        'amostras': len(amostras),
+        'media_ms': round(sum(amostras) / len(amostras) * 1000, 1),
+        'p50_ms': round(percentil(amostras, 50) * 1000, 1),
+        'p95_ms': round(percentil(amostras, 95) * 1000, 1),
+        'p99_ms': round(percentil(amostras, 99) * 1000, 1),
+        'max_ms': round(max(amostras) * 1000, 1),
+    }
+
+def obter_contador(nome):
+    """Retorna o valor atual de um contador"""
+    return _contadores.get(nome, 0)
+
+def obter_latencias(nome):
+    """Retorna as amostras de latência (em segundos) mantidas para uma métrica"""
+    with _lock:
+        return list(_latencias.get(nome, ()))
+
+def obter_metricas():
+    """
+    Retorna um retrato de todas as métricas do processo
+
+    Returns:
+        dict: Contadores, medidores, resumos de latência e seções dos coletores
+    """
+    with _lock:
+        resultado = {
+            'contadores': dict(_contadores),
+            'medidores': dict(_medidores),
+            'latencias': {nome: list(amostras) for nome, amostras in _latencias.items()},
+        }
+    resultado['latencias'] = {nome: resumir_latencias(amostras)
+                              for nome, amostras in resultado['latencias'].items()}
+
+    for nome, funcao in list(_coletores.items()):
+        try:
+            resultado[nome] = funcao()
+        except Exception as e:
+            resultado[nome] = {'erro': str(e)}
+
+    return resultado
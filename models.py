@@ -74,3 +74,90 @@ class Configuracao(db.Model):
     descricao = db.Column(db.String(255), nullable=True)
     categoria = db.Column(db.String(50), nullable=True)
     atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class MensagemProcessada(db.Model):
+    """Mensagens do WhatsApp já processadas, para ignorar reenvios do webhook"""
+    __tablename__ = 'mensagem_processada'
+    message_sid = db.Column(db.String(64), primary_key=True)
+    lead_id = db.Column(db.Integer, db.ForeignKey('lead.id'), nullable=True)
+    resposta = db.Column(db.Text, nullable=True)  # Nulo enquanto a mensagem está em processamento
+    reentregue = db.Column(db.Boolean, default=False)  # Twilio reenviou antes da resposta ficar pronta
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ResumoConversa(db.Model):
+    """Resumo acumulado da conversa com um lead, atualizado em segundo plano"""
+    __tablename__ = 'resumo_conversa'
+    lead_id = db.Column(db.Integer, db.ForeignKey('lead.id'), primary_key=True)
+    resumo = db.Column(db.Text, nullable=False)
+    ultima_interacao_id = db.Column(db.Integer, nullable=False)  # Última interação incluída no resumo
+    interacoes_resumidas = db.Column(db.Integer, default=0)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ChamadaIA(db.Model):
+    """Registro de cada chamada ao provedor de IA (latência, tokens e custo)"""
+    __tablename__ = 'chamada_ia'
+    id = db.Column(db.Integer, primary_key=True)
+    lead_id = db.Column(db.Integer, db.ForeignKey('lead.id'), nullable=True, index=True)
+    proposito = db.Column(db.String(30), nullable=False)  # resposta, sentimento, lembrete, resumo...
+    modelo = db.Column(db.String(50), nullable=True)
+    tokens_entrada = db.Column(db.Integer, default=0)
+    tokens_saida = db.Column(db.Integer, default=0)
+    custo_usd = db.Column(db.Float, default=0.0)  # Estimado pelos preços de roteador_modelos
+    latencia_ms = db.Column(db.Integer, nullable=False)  # Inclui repetições e hedging
+    resultado = db.Column(db.String(20), nullable=False)  # sucesso, erro, disjuntor, limite
+    erro = db.Column(db.String(100), nullable=True)  # Tipo do erro, se houver
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class LimiteTaxa(db.Model):
+    """Baldes de fichas do limite de requisições e tokens por minuto, compartilhados entre processos"""
+    __tablename__ = 'limite_taxa'
+    chave = db.Column(db.String(50), primary_key=True)  # Ex.: 'openai'
+    requisicoes = db.Column(db.Float, nullable=False)  # Fichas de requisições disponíveis
+    tokens = db.Column(db.Float, nullable=False)  # Fichas de tokens disponíveis
+    atualizado_em = db.Column(db.Float, nullable=False)  # Horário (epoch) da última recarga
+
+class LoteIA(db.Model):
+    """Lote de mensagens agendadas (lembretes e reativações) gerado pela Batch API do provedor"""
+    __tablename__ = 'lote_ia'
+    id = db.Column(db.Integer, primary_key=True)
+    provedor = db.Column(db.String(30), nullable=False)
+    lote_externo = db.Column(db.String(100), nullable=True)  # ID do lote no provedor (nulo até a submissão)
+    status = db.Column(db.String(20), default='enviando')  # enviando, em_andamento, entregando, concluido, falhou
+    total_itens = db.Column(db.Integer, default=0)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    concluido_em = db.Column(db.DateTime, nullable=True)
+
+class ItemLoteIA(db.Model):
+    """Mensagem de um lote; o custom_id inclui a data para que cada item seja gerado uma vez por dia"""
+    __tablename__ = 'item_lote_ia'
+    custom_id = db.Column(db.String(80), primary_key=True)  # Ex.: 'lembrete-12-20250101'
+    lote_id = db.Column(db.Integer, db.ForeignKey('lote_ia.id'), nullable=False, index=True)
+    tipo = db.Column(db.String(20), nullable=False)  # lembrete, reativacao
+    lead_id = db.Column(db.Integer, db.ForeignKey('lead.id'), nullable=False)
+    formulario_id = db.Column(db.Integer, db.ForeignKey('formulario.id'), nullable=True)
+    texto = db.Column(db.Text, nullable=True)  # Texto gerado (nulo até o resultado chegar)
+    status = db.Column(db.String(20), default='pendente')  # pendente, enviado, descartado, falhou
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class VarianteLembrete(db.Model):
+    """Variante de lembrete pré-gerada para um tipo de formulário (com o marcador [nome])"""
+    __tablename__ = 'variante_lembrete'
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(50), nullable=False, index=True)  # Formulario.tipo
+    texto = db.Column(db.Text, nullable=False)
+    versao = db.Column(db.String(20), nullable=False)  # Hash do prompt e do modelo que geraram a variante
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+class TentativaSentimento(db.Model):
+    """Análises em lote que não pontuaram a mensagem (a IA a omitiu ou a chamada falhou)"""
+    __tablename__ = 'tentativa_sentimento'
+    interacao_id = db.Column(db.Integer, db.ForeignKey('interacao.id'), primary_key=True)
+    tentativas = db.Column(db.Integer, default=0, nullable=False)
+    ultima_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class TentativaResumo(db.Model):
+    """Atualizações de resumo que falharam para o lead (a IA o omitiu ou a chamada falhou)"""
+    __tablename__ = 'tentativa_resumo'
+    lead_id = db.Column(db.Integer, db.ForeignKey('lead.id'), primary_key=True)
+    tentativas = db.Column(db.Integer, default=0, nullable=False)
+    ultima_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,93 @@
+"""
+Normalização de textos em português para comparação e busca
+"""
+import re
+import unicodedata
+
+_PONTUACAO = re.compile(r'[^\w\s]', re.UNICODE)
+_ESPACOS = re.compile(r'\s+')
+
+def remover_acentos(texto):
+    """Remove acentos e cedilhas ('ação' -> 'acao')"""
+    decomposto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in decomposto if not unicodedata.combining(c))
+
+def normalizar_texto(texto):
+    """
+    Normaliza um texto para comparação: minúsculas, sem acentos,
+    sem pontuação e com espaços simples
+
+    Args:
+        texto (str): Texto original
+
+    Returns:
+        str: Texto normalizado
+    """
+    texto = remover_acentos((texto or '').lower())
+    texto = _PONTUACAO.sub(' ', texto.replace('_', ' '))
+    return _ESPACOS.sub(' ', texto).strip()
+
+# Palavras muito comuns, que não ajudam a diferenciar os textos na busca
+STOPWORDS = {
+    'a', 'o', 'as', 'os', 'um', 'uma', 'uns', 'umas', 'ao', 'aos',
+    'de', 'do', 'da', 'dos', 'das', 'dum', 'duma', 'em', 'no', 'na', 'nos', 'nas',
+    'num', 'numa', 'por', 'pelo', 'pela', 'pelos', 'pelas', 'para', 'pra', 'pro',
+    'com', 'sem', 'sob', 'sobre', 'entre', 'ate', 'apos', 'desde',
+    'e', 'ou', 'mas', 'que', 'se', 'como', 'qual', 'quais', 'quando', 'onde', 'porque',
+    'eu', 'tu', 'ele', 'ela', 'nos', 'voce', 'voces', 'eles', 'elas', 'me', 'te', 'lhe',
+    'meu', 'minha', 'meus', 'minhas', 'seu', 'sua', 'seus', 'suas',
+    'este', 'esta', 'estes', 'estas', 'esse', 'essa', 'esses', 'essas', 'isso', 'isto',
+    'aquele', 'aquela', 'aquilo', 'ser', 'sou', 'sao', 'foi', 'era', 'estar', 'esta',
+    'estou', 'ter', 'tem', 'tenho', 'ha', 'ja', 'nao', 'sim', 'mais', 'muito', 'muita',
+    'tambem', 'so', 'bem', 'tudo', 'todo', 'toda', 'oi', 'ola', 'entao', 'vc',
+}
+
+_PLURAIS = (('oes', 'ao'), ('aes', 'ao'), ('ais', 'al'), ('eis', 'el'), ('ns', 'm'), ('res', 'r'))
+_SUFIXOS = ('amento', 'imento', 'mente', 'cao', 'idade', 'ar', 'er', 'ir')
+
+def reduzir_radical(palavra):
+    """
+    Reduz uma palavra normalizada a um radical aproximado (stemming leve)
+
+    Remove plurais, alguns sufixos derivacionais e a vogal final, de modo que
+    'proteinas', 'proteina' e 'alimentacao', 'alimentar', 'alimentos' resultem
+    no mesmo radical.
+
+    Args:
+        palavra (str): Palavra já normalizada (minúsculas, sem acentos)
+
+    Returns:
+        str: Radical da palavra
+    """
+    if len(palavra) <= 3:
+        return palavra
+
+    for sufixo, substituto in _PLURAIS:
+        if palavra.endswith(sufixo) and len(palavra) > len(sufixo) + 2:
+            palavra = palavra[:-len(sufixo)] + substituto
+            break
+    else:
+        if palavra.endswith('s') and len(palavra) > 4:
+            palavra = palavra[:-1]
+
+    for sufixo in _SUFIXOS:
+        if palavra.endswith(sufixo) and len(palavra) - len(sufixo) >= 4:
+            palavra = palavra[:-len(sufixo)]
+            break
+
+    if len(palavra) > 4 and palavra[-1] in 'aeo':
+        palavra = palavra[:-1]
+    return palavra
+
+def tokenizar(texto):
+    """
+    Divide um texto em termos de busca: normalizados, sem stopwords e reduzidos ao radical
+
+    Args:
+        texto (str): Texto original
+
+    Returns:
+        list: Termos do texto, na ordem em que aparecem
+    """
+    return [reduzir_radical(palavra) for palavra in normalizar_texto(texto).split()
+            if len(palavra) > 1 and palavra not in STOPWORDS]
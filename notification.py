@@ -92,50 +92,67 @@ def notificar_potencial_conversao(nome_cliente, telefone_cliente, probabilidade)
     Returns:
         bool: True se a notificação foi enviada com sucesso, False caso contrário
     """
+    # Enviar notificação
+    mensagem = formatar_notificacao_conversao(nome_cliente, telefone_cliente, probabilidade)
+    return enviar_notificacao_whatsapp(obter_numero_administrador(), mensagem)
+
+def obter_numero_administrador():
+    """Retorna o número do administrador que recebe as notificações"""
     # Número do administrador (poderia ser obtido da tabela de configurações)
-    numero_admin = os.environ.get("ADMIN_PHONE_NUMBER", "+5561985870944")
+    return os.environ.get("ADMIN_PHONE_NUMBER", "+5561985870944")
+
+def formatar_notificacao_conversao(nome_cliente, telefone_cliente, probabilidade):
+    """
+    Formata a notificação de lead com alta probabilidade de conversão
+    
+    Args:
+        nome_cliente (str): Nome do cliente
+        telefone_cliente (str): Telefone do cliente
+        probabilidade (float): Probabilidade de conversão (0-1)
     
-    # Formatar mensagem
-    mensagem = f"""🔔 *Lead com alta probabilidade de conversão!*
+    Returns:
+        str: Mensagem formatada para o administrador
+    """
+    return f"""🔔 *Lead com alta probabilidade de conversão!*
     
 *Cliente:* {nome_cliente}
 *Telefone:* {telefone_cliente}
 *Probabilidade:* {int(probabilidade * 100)}%
 
 Recomendamos que entre em contato rapidamente com este cliente."""
-    
-    # Enviar notificação
-    return enviar_notificacao_whatsapp(numero_admin, mensagem)
 
-def enviar_lembrete_formulario(lead_id, tipo_formulario):
+def enviar_lembrete_formulario(formulario_id, texto=None):
     """
     Envia um lembrete para preenchimento de formulário
     
     Args:
-        lead_id (int): ID do lead
-        tipo_formulario (str): Tipo do formulário pendente
+        formulario_id (int): ID do formulário pendente
+        texto (str): Texto já gerado para o lembrete (ex.: por um lote); o link é
+            acrescentado. Sem ele, é enviado o lembrete padrão
     
     Returns:
         bool: True se o lembrete foi enviado com sucesso, False caso contrário
     """
     from app import db
-    from models import Lead, Formulario, Interacao
+    from models import Formulario, Interacao
     
     try:
-        # Buscar informações do lead
-        lead = Lead.query.get(lead_id)
-        if not lead:
-            logger.error(f"Lead ID {lead_id} não encontrado para envio de lembrete")
-            return False
-        
         # Buscar formulário
-        formulario = Formulario.query.filter_by(lead_id=lead_id, tipo=tipo_formulario, status='pendente').first()
-        if not formulario:
-            logger.error(f"Formulário {tipo_formulario} não encontrado para o lead {lead_id}")
+        formulario = Formulario.query.get(formulario_id)
+        if not formulario or formulario.status != 'pendente':
+            logger.error(f"Formulário pendente {formulario_id} não encontrado para envio de lembrete")
             return False
         
+        # Buscar informações do lead
+        lead = formulario.lead
+        lead_id = lead.id
+        tipo_formulario = formulario.tipo
+        
         # Formatar mensagem de lembrete
-        mensagem = f"""Olá {lead.nome}, 
+        if texto:
+            mensagem = f"{texto}\n\nAcesse o formulário aqui: {formulario.link}"
+        else:
+            mensagem = f"""Olá {lead.nome}, 
 
 Notamos que você ainda não preencheu o formulário de {tipo_formulario.replace('_', ' ').title()} que enviamos.
 
@@ -170,3 +187,37 @@ Estamos à disposição para qualquer dúvida!"""
     except Exception as e:
         logger.error(f"Erro ao enviar lembrete de formulário: {str(e)}")
         return False
+
+def enviar_mensagem_reativacao(lead_id, texto):
+    """
+    Envia uma mensagem para retomar o contato com um lead inativo
+    
+    Args:
+        lead_id (int): ID do lead
+        texto (str): Texto da mensagem
+    
+    Returns:
+        bool: True se a mensagem foi enviada com sucesso, False caso contrário
+    """
+    from app import db
+    from models import Lead, Interacao
+    
+    try:
+        lead = Lead.query.get(lead_id)
+        if not lead:
+            logger.error(f"Lead ID {lead_id} não encontrado para envio de reativação")
+            return False
+        
+        enviado = enviar_notificacao_whatsapp(lead.telefone, texto)
+        
+        if enviado:
+            # Registrar a interação no histórico
+            db.session.add(Interacao(lead_id=lead_id, mensagem=texto, origem="sistema"))
+            db.session.commit()
+            logger.info(f"Mensagem de reativação enviada com sucesso para o lead {lead_id}")
+        
+        return enviado
+    
+    except Exception as e:
+        logger.error(f"Erro ao enviar mensagem de reativação: {str(e)}")
+        return False
@@ -0,0 +1,235 @@
+"""
+Montagem de prompts com orçamento de tokens
+
+Cada seção do prompt (instruções do sistema, trechos da base de conhecimento,
+resumo da conversa, histórico e mensagem atual) tem um limite de tokens
+configurável. As seções que passam do limite são reduzidas: itens menos
+relevantes da base de conhecimento são descartados, os turnos mais antigos do
+histórico saem primeiro (o último que couber parcialmente é truncado) e
+mensagens repetidas são consolidadas. A contagem é feita localmente, com o tiktoken quando instalado
+ou por estimativa a partir do tamanho do texto.
+"""
+import logging
+from config_sistema import obter_config_int
+
+try:
+    import tiktoken # type: ignore
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Tokens adicionais que a API de chat cobra por mensagem (papel e separadores)
+TOKENS_POR_MENSAGEM = 4
+
+# Média aproximada de caracteres por token em português, usada sem o tiktoken
+CARACTERES_POR_TOKEN = 4
+
+# Turnos do histórico com menos espaço que isso são descartados em vez de truncados
+MINIMO_TURNO_TRUNCADO = 30
+
+MARCADOR_TRUNCADO = '…'
+
+ORCAMENTOS_PADRAO = {
+    'sistema': 400,
+    'conhecimento': 700,
+    'resumo': 300,
+    'historico': 1200,
+    'mensagem': 600,
+    # Base de conhecimento completa no prefixo fixo (ver kb_prefixo_base_completa)
+    'base_completa': 3000,
+}
+
+_codificador = None
+
+def _obter_codificador():
+    """Carrega o codificador do tiktoken na primeira utilização"""
+    global _codificador
+    if _codificador is None and tiktoken is not None:
+        try:
+            _codificador = tiktoken.get_encoding('o200k_base')
+        except Exception as e:
+            logger.warning(f"tiktoken indisponível, usando estimativa de tokens: {str(e)}")
+            return None
+    return _codificador
+
+def contar_tokens(texto):
+    """Conta (ou estima) os tokens de um texto"""
+    if not texto:
+        return 0
+    codificador = _obter_codificador()
+    if codificador is not None:
+        return len(codificador.encode(texto))
+    return -(-len(texto) // CARACTERES_POR_TOKEN)
+
+def contar_tokens_mensagens(mensagens):
+    """Conta os tokens de uma lista de mensagens no formato da API de chat"""
+    return sum(contar_tokens(mensagem['content']) + TOKENS_POR_MENSAGEM for mensagem in mensagens)
+
+def truncar_texto(texto, limite, manter_final=False):
+    """
+    Reduz um texto para caber no limite de tokens
+
+    Args:
+        texto (str): Texto original
+        limite (int): Quantidade máxima de tokens
+        manter_final (bool): Preserva o fim do texto em vez do início
+
+    Returns:
+        str: Texto original, se couber, ou versão truncada com marcador
+    """
+    if limite <= 0:
+        return ''
+    if contar_tokens(texto) <= limite:
+        return texto
+
+    codificador = _obter_codificador()
+    if codificador is not None:
+        tokens = codificador.encode(texto)
+        trecho = tokens[-(limite - 1):] if manter_final else tokens[:limite - 1]
+        parte = codificador.decode(trecho)
+    else:
+        caracteres = (limite - 1) * CARACTERES_POR_TOKEN
+        parte = texto[-caracteres:] if manter_final else texto[:caracteres]
+
+    # Evitar cortar palavras ao meio
+    if manter_final:
+        parte = parte.split(' ', 1)[-1] if ' ' in parte else parte
+        return MARCADOR_TRUNCADO + parte.lstrip()
+    parte = parte.rsplit(' ', 1)[0] if ' ' in parte else parte
+    return parte.rstrip() + MARCADOR_TRUNCADO
+
+def obter_orcamentos():
+    """Retorna o limite de tokens de cada seção ('ia_orcamento_<secao>')"""
+    return {secao: max(0, obter_config_int(f'ia_orcamento_{secao}', padrao))
+            for secao, padrao in ORCAMENTOS_PADRAO.items()}
+
+def ajustar_itens(itens, formatar, limite):
+    """
+    Formata a maior quantidade de itens (em ordem de relevância) que cabe no limite
+
+    Args:
+        itens (list): Itens do mais para o menos relevante
+        formatar (callable): Função que converte uma lista de itens em texto
+        limite (int): Quantidade máxima de tokens
+
+    Returns:
+        tuple: (texto, quantidade de itens incluídos)
+    """
+    itens = list(itens or [])
+    while itens:
+        texto = formatar(itens)
+        if contar_tokens(texto) <= limite:
+            return texto, len(itens)
+        itens.pop()
+    return '', 0
+
+def ajustar_historico(historico, limite):
+    """
+    Mantém os turnos mais recentes do histórico que cabem no limite
+
+    Mensagens consecutivas repetidas (com o mesmo papel e conteúdo) são
+    consolidadas antes da contagem.
+
+    Args:
+        historico (list): Mensagens {'role', 'content'} da mais antiga para a mais recente
+        limite (int): Quantidade máxima de tokens
+
+    Returns:
+        list: Mensagens que couberam, na ordem original
+    """
+    consolidado = []
+    for mensagem in historico:
+        if not mensagem['content']:
+            continue
+        if consolidado and consolidado[-1] == mensagem:
+            continue
+        consolidado.append(mensagem)
+
+    selecionadas = []
+    restante = limite
+    for mensagem in reversed(consolidado):
+        custo = contar_tokens(mensagem['content']) + TOKENS_POR_MENSAGEM
+        if custo <= restante:
+            selecionadas.append(mensagem)
+            restante -= custo
+            continue
+        # O turno mais antigo que ainda cabe em parte é truncado; os anteriores saem
+        if restante - TOKENS_POR_MENSAGEM >= MINIMO_TURNO_TRUNCADO:
+            conteudo = truncar_texto(mensagem['content'], restante - TOKENS_POR_MENSAGEM, manter_final=True)
+            selecionadas.append({'role': mensagem['role'], 'content': conteudo})
+        break
+
+    selecionadas.reverse()
+    return selecionadas
+
+def montar_prompt(sistema, conhecimento, historico, mensagem_atual, orcamentos=None, resumo='',
+                  contexto='', conhecimento_no_prefixo=False):
+    """
+    Monta as mensagens da API de chat respeitando o orçamento de cada seção
+
+    As mensagens vão da parte mais estável para a mais variável, para que o
+    provedor reaproveite em cache o prefixo já visto em chamadas anteriores:
+
+    1. instruções do sistema, iguais para todos os leads (e, com
+       conhecimento_no_prefixo, a base de conhecimento completa);
+    2. contexto do lead e resumo da conversa, estáveis ao longo da conversa;
+    3. histórico;
+    4. trechos da base de conhecimento relevantes para a mensagem atual;
+    5. mensagem atual.
+
+    Blocos repetidos aparecem uma só vez.
+
+    Args:
+        sistema (str): Instruções do sistema (não devem conter dados do lead)
+        conhecimento (str): Trechos da base de conhecimento já ajustados ao orçamento
+        historico (list): Mensagens anteriores {'role', 'content'}, da mais antiga para a mais recente
+        mensagem_atual (str): Mensagem do usuário a ser respondida
+        orcamentos (dict): Limites por seção; usa obter_orcamentos() se omitido
+        resumo (str): Resumo da conversa anterior ao histórico enviado
+        contexto (str): Dados do lead (nome etc.)
+        conhecimento_no_prefixo (bool): Se o conhecimento é a base completa, que vai no prefixo
+
+    Returns:
+        tuple: (mensagens, relatorio) com o relatório de tokens por seção
+    """
+    orcamentos = orcamentos or obter_orcamentos()
+
+    secoes = {}
+    for secao, texto, limite, manter_final in (
+            ('sistema', sistema, orcamentos['sistema'], False),
+            # A base completa só é passada quando cabe no seu orçamento
+            ('conhecimento', conhecimento, None if conhecimento_no_prefixo else orcamentos['conhecimento'], False),
+            ('contexto', contexto, orcamentos['sistema'], False),
+            ('resumo', resumo, orcamentos['resumo'], True)):
+        bloco = truncar_texto(texto, limite, manter_final=manter_final) if limite is not None else texto
+        if bloco and bloco not in secoes.values():
+            secoes[secao] = bloco
+
+    prefixo = [secoes.get('sistema')]
+    if conhecimento_no_prefixo:
+        prefixo.append(secoes.get('conhecimento'))
+    mensagens = [{'role': 'system', 'content': "\n\n".join(bloco for bloco in prefixo if bloco)}]
+    blocos_lead = [bloco for bloco in (secoes.get('contexto'), secoes.get('resumo')) if bloco]
+    if blocos_lead:
+        mensagens.append({'role': 'system', 'content': "\n\n".join(blocos_lead)})
+
+    turnos = ajustar_historico(historico, orcamentos['historico'])
+    mensagens.extend(turnos)
+    if secoes.get('conhecimento') and not conhecimento_no_prefixo:
+        mensagens.append({'role': 'system', 'content': secoes['conhecimento']})
+    atual = truncar_texto(mensagem_atual, orcamentos['mensagem'], manter_final=True)
+    mensagens.append({'role': 'user', 'content': atual})
+
+    relatorio = {
+        'sistema': contar_tokens(secoes.get('sistema')) + contar_tokens(secoes.get('contexto')),
+        'conhecimento': contar_tokens(secoes.get('conhecimento')),
+        'resumo': contar_tokens(secoes.get('resumo')),
+        'historico': contar_tokens_mensagens(turnos),
+        'mensagem': contar_tokens(atual),
+        'turnos': len(turnos),
+        'turnos_descartados': len(historico) - len(turnos),
+        'prefixo': contar_tokens_mensagens(mensagens[:1]),
+    }
+    relatorio['total'] = contar_tokens_mensagens(mensagens)
+    return mensagens, relatorio
@@ -0,0 +1,80 @@
+"""
+Divisão de respostas da IA em partes para envio antecipado
+
+Com a resposta em streaming, o texto chega aos poucos. As partes são cortadas
+em fins de parágrafo ou de frase assim que atingem o tamanho mínimo, para que
+a primeira mensagem chegue ao lead enquanto o restante ainda é gerado, sem
+transformar a resposta em uma rajada de mensagens curtas.
+"""
+import re
+from config_sistema import obter_config_bool, obter_config_int
+
+_FIM_PARAGRAFO = re.compile(r'\n\s*\n')
+_FIM_FRASE = re.compile(r'[.!?…:](?=\s)')
+
+def resposta_em_partes_ativa():
+    """Indica se as respostas enviadas pela API REST são geradas em streaming e enviadas em partes"""
+    return obter_config_bool('ia_resposta_em_partes', False)
+
+class DivisorPartes:
+    """Acumula o texto recebido em streaming e libera as partes completas"""
+
+    def __init__(self, tamanho_primeira=None, tamanho_minimo=None):
+        # A primeira parte é menor para reduzir o tempo até a primeira mensagem
+        self.tamanho_primeira = tamanho_primeira or max(1, obter_config_int('ia_partes_tamanho_primeira', 120))
+        self.tamanho_minimo = tamanho_minimo or max(1, obter_config_int('ia_partes_tamanho_minimo', 400))
+        self.partes = []
+        self._buffer = ''
+
+    def adicionar(self, texto):
+        """
+        Adiciona um trecho recebido do streaming
+
+        Returns:
+            list: Partes que ficaram completas com este trecho
+        """
+        self._buffer += texto or ''
+        prontas = []
+        while True:
+            parte = self._proxima_parte()
+            if parte is None:
+                return prontas
+            prontas.append(parte)
+
+    def finalizar(self):
+        """Libera o texto restante ao fim do streaming (None se não houver)"""
+        parte = self._buffer.strip()
+        self._buffer = ''
+        if not parte:
+            return None
+        self.partes.append(parte)
+        return parte
+
+    def texto_entregue(self):
+        """Texto de todas as partes já liberadas"""
+        return "\n\n".join(self.partes)
+
+    def _proxima_parte(self):
+        self._buffer = self._buffer.lstrip()
+        minimo = self.tamanho_minimo if self.partes else self.tamanho_primeira
+        if len(self._buffer) < minimo:
+            return None
+
+        # Preferir o primeiro fim de parágrafo depois do mínimo; sem ele, cortar em
+        # um fim de frase (na primeira parte, logo que possível; nas demais, apenas
+        # quando o parágrafo já estiver longo)
+        corte = None
+        for fim in _FIM_PARAGRAFO.finditer(self._buffer, minimo):
+            corte = fim.start()
+            break
+        if corte is None and (not self.partes or len(self._buffer) >= 2 * minimo):
+            for fim in _FIM_FRASE.finditer(self._buffer, minimo - 1):
+                corte = fim.end()
+                break
+        if corte is None:
+            return None
+
+        parte = self._buffer[:corte].strip()
+        self._buffer = self._buffer[corte:]
+        self.partes.append(parte)
+        return parte
@@ -0,0 +1,230 @@
+"""
+Pipeline assíncrono de conversas do WhatsApp (modo ASGI)
+
+O webhook, as chamadas à IA e os envios pela Twilio são corrotinas, de modo que
+um único processo mantém centenas de conversas em andamento. As operações no
+banco continuam usando o SQLAlchemy síncrono, executadas em threads.
+"""
+import asyncio
+import logging
+import contextlib
+import httpx
+from twilio.twiml.messaging_response import MessagingResponse
+from database import db
+from models import Interacao
+from ai_agent import agente_boas_vindas, processar_mensagem_com_analise_async
+from whatsapp_integration import (registrar_mensagem_recebida, registrar_analise, TWILIO_ACCOUNT_SID,
+                                  TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER, MENSAGEM_PROBLEMA_TECNICO)
+from notification import (formatar_numero_internacional, formatar_notificacao_conversao,
+                          obter_numero_administrador)
+from idempotencia import reservar_mensagem, registrar_resposta, liberar_mensagem
+from agrupamento_mensagens import agrupador, obter_janela_agrupamento, unir_mensagens
+from contexto_async import executar_em_thread
+from config_sistema import obter_config_int
+import metricas
+
+logger = logging.getLogger(__name__)
+
+TWILIO_API_URL = "https://api.twilio.com/2010-04-01/Accounts/{conta}/Messages.json"
+
+_cliente_http = None
+_semaforo_ia = None
+_locks_lead = {}  # lead_id -> [lock, tarefas usando ou aguardando o lock]
+_tarefas = set()
+
+def _obter_cliente_http():
+    """Cliente HTTP compartilhado (com keep-alive) para a API REST da Twilio"""
+    global _cliente_http
+    if _cliente_http is None:
+        _cliente_http = httpx.AsyncClient(
+            auth=(TWILIO_ACCOUNT_SID or '', TWILIO_AUTH_TOKEN or ''),
+            timeout=httpx.Timeout(10.0),
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        )
+    return _cliente_http
+
+def _obter_semaforo_ia():
+    """Limita as chamadas simultâneas à IA dentro do loop de eventos"""
+    global _semaforo_ia
+    if _semaforo_ia is None:
+        _semaforo_ia = asyncio.Semaphore(max(1, obter_config_int('ia_max_em_andamento_async', 200)))
+    return _semaforo_ia
+
+@contextlib.asynccontextmanager
+async def _lock_lead(lead_id):
+    """
+    Mantém as respostas de um mesmo lead em ordem de chegada
+
+    O lock do lead é descartado quando nenhuma tarefa o usa nem aguarda, para
+    que o dicionário não cresça com cada lead atendido pelo processo.
+    """
+    entrada = _locks_lead.get(lead_id)
+    if entrada is None:
+        entrada = _locks_lead[lead_id] = [asyncio.Lock(), 0]
+    entrada[1] += 1
+    try:
+        async with entrada[0]:
+            yield
+    finally:
+        entrada[1] -= 1
+        if entrada[1] == 0 and _locks_lead.get(lead_id) is entrada:
+            del _locks_lead[lead_id]
+
+async def enviar_mensagem_whatsapp_async(numero_destino, mensagem):
+    """
+    Envia uma mensagem para o WhatsApp pela API REST da Twilio, sem bloquear o loop
+    
+    Args:
+        numero_destino (str): Número de telefone de destino (formato internacional)
+        mensagem (str): Conteúdo da mensagem a ser enviada
+    
+    Returns:
+        bool: True se a mensagem foi enviada com sucesso, False caso contrário
+    """
+    try:
+        # Verificar se as credenciais do Twilio estão configuradas
+        if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN or not TWILIO_PHONE_NUMBER:
+            logger.error("Credenciais do Twilio não configuradas")
+            return False
+        
+        numero_destino = formatar_numero_internacional(numero_destino)
+        resposta = await _obter_cliente_http().post(
+            TWILIO_API_URL.format(conta=TWILIO_ACCOUNT_SID),
+            data={
+                'From': f'whatsapp:{TWILIO_PHONE_NUMBER}',
+                'To': f'whatsapp:{numero_destino}',
+                'Body': mensagem,
+            },
+        )
+        resposta.raise_for_status()
+        
+        logger.info(f"Mensagem WhatsApp enviada com sucesso. SID: {resposta.json().get('sid')}")
+        return True
+    
+    except Exception as e:
+        logger.error(f"Erro ao enviar mensagem WhatsApp (assíncrono): {str(e)}")
+        return False
+
+async def fechar_clientes():
+    """Fecha as conexões abertas pelo pipeline (chamado no encerramento do servidor)"""
+    global _cliente_http
+    if _cliente_http is not None:
+        await _cliente_http.aclose()
+        _cliente_http = None
+
+def _registrar_mensagem(mensagem_de, mensagem_texto):
+    """Registra a mensagem e retorna os dados do lead desacoplados da sessão"""
+    lead, novo_lead = registrar_mensagem_recebida(mensagem_de, mensagem_texto)
+    return {'id': lead.id, 'nome': lead.nome, 'telefone': lead.telefone}, novo_lead
+
+def _registrar_resposta_ia(lead_id, resposta, origem="ia"):
+    db.session.add(Interacao(lead_id=lead_id, mensagem=resposta, origem=origem))
+    db.session.commit()
+
+async def receber_mensagem_whatsapp(dados):
+    """
+    Trata uma requisição do webhook do WhatsApp
+    
+    A mensagem é registrada e o recebimento é confirmado imediatamente com um
+    TwiML vazio; a resposta é gerada e enviada por uma tarefa em segundo plano.
+    
+    Args:
+        dados (dict): Campos do formulário enviado pela Twilio
+    
+    Returns:
+        str: TwiML de resposta ao webhook
+    """
+    message_sid = dados.get('MessageSid')
+    try:
+        mensagem_de = dados.get('From', '')
+        mensagem_texto = dados.get('Body', '')
+        
+        logger.info(f"Mensagem recebida via WhatsApp de {mensagem_de}: {mensagem_texto}")
+        
+        duplicada, resposta_anterior = await executar_em_thread(reservar_mensagem, message_sid)
+        if duplicada:
+            resp = MessagingResponse()
+            if resposta_anterior:
+                resp.message(resposta_anterior)
+            return str(resp)
+        
+        lead, novo_lead = await executar_em_thread(_registrar_mensagem, mensagem_de, mensagem_texto)
+        await executar_em_thread(registrar_resposta, message_sid, '')
+        
+        tarefa = asyncio.create_task(_responder(lead, mensagem_texto, novo_lead))
+        _tarefas.add(tarefa)
+        tarefa.add_done_callback(_finalizar_tarefa)
+        metricas.definir('conversas_async_em_andamento', len(_tarefas))
+        
+        return str(MessagingResponse())
+    
+    except Exception as e:
+        logger.error(f"Erro no webhook assíncrono do WhatsApp: {str(e)}")
+        await executar_em_thread(liberar_mensagem, message_sid)
+        resp = MessagingResponse()
+        resp.message("Estamos com dificuldades técnicas. Por favor, tente novamente mais tarde.")
+        return str(resp)
+
+async def _responder(lead, mensagem_texto, novo_lead):
+    """Gera e envia a resposta de uma mensagem (ou grupo de mensagens) do lead"""
+    # O webhook já confirmou o recebimento: se a resposta falhar, o lead recebe
+    # a mesma mensagem de problema técnico do caminho síncrono
+    partes_enviadas = []
+    resposta = None
+    respondido = False
+    try:
+        # A leitura das configurações pode consultar o banco
+        janela, espera_maxima = await executar_em_thread(obter_janela_agrupamento)
+        if janela > 0:
+            if not agrupador.adicionar(lead['id'], mensagem_texto, novo_lead):
+                # A mensagem será respondida junto com o grupo já aberto para o lead
+                return
+            while (restante := agrupador.tempo_restante(lead['id'], janela, espera_maxima)) > 0:
+                await asyncio.sleep(restante)
+            textos, novo_lead = agrupador.coletar(lead['id'])
+            mensagem_texto = unir_mensagens(textos)
+        
+        async with _lock_lead(lead['id']):
+            analise = None
+            
+            async def enviar_parte(parte):
+                # Respostas geradas em streaming saem em partes, à medida que ficam prontas
+                partes_enviadas.append(await enviar_mensagem_whatsapp_async(lead['telefone'], parte))
+            
+            if novo_lead:
+                resposta = agente_boas_vindas(lead['nome'])
+            else:
+                async with _obter_semaforo_ia():
+                    resposta, analise = await processar_mensagem_com_analise_async(
+                        lead['id'], mensagem_texto, enviar_parte)
+                await executar_em_thread(registrar_analise, lead['id'], analise)
+            
+            await executar_em_thread(_registrar_resposta_ia, lead['id'], resposta)
+            if not partes_enviadas:
+                await enviar_mensagem_whatsapp_async(lead['telefone'], resposta)
+            respondido = True
+        
+        # Se a probabilidade de conversão for alta, notificar administrador
+        if analise and analise.get('prob_conversao', 0) > 0.8:
+            await enviar_mensagem_whatsapp_async(
+                obter_numero_administrador(),
+                formatar_notificacao_conversao(lead['nome'], lead['telefone'], analise['prob_conversao'])
+            )
+    
+    except Exception as e:
+        logger.error(f"Erro ao responder mensagem do lead {lead['id']} (assíncrono): {str(e)}")
+        if respondido or partes_enviadas:
+            return
+        if resposta:
+            # A resposta foi gerada, mas não pôde ser registrada: enviá-la mesmo assim
+            await enviar_mensagem_whatsapp_async(lead['telefone'], resposta)
+            return
+        await enviar_mensagem_whatsapp_async(lead['telefone'], MENSAGEM_PROBLEMA_TECNICO)
+        try:
+            await executar_em_thread(_registrar_resposta_ia, lead['id'], MENSAGEM_PROBLEMA_TECNICO, "sistema")
+        except Exception as erro:
+            logger.error(f"Erro ao registrar a mensagem de problema técnico: {str(erro)}")
+
+def _finalizar_tarefa(tarefa):
+    _tarefas.discard(tarefa)
+    metricas.definir('conversas_async_em_andamento', len(_tarefas))
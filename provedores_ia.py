@@ -0,0 +1,400 @@
+"""
+Provedores de IA usados pelo agente
+
+O agente fala com a IA por meio de um provedor, escolhido pela configuração
+'ia_provedor':
+
+- 'openai' (padrão): API da OpenAI, com o SDK novo (v1+) ou, se ele não
+  estiver disponível, o SDK legado (v0);
+- 'simulado': provedor local e determinístico, sem chamadas externas, com
+  latência, taxa de erros e respostas configuráveis. Permite medir vazão e
+  latência do bot inteiro offline e em CI.
+
+Todos os provedores recebem os argumentos de chat.completions.create e
+retornam objetos com a mesma estrutura das respostas do SDK da OpenAI. Os
+que suportam lotes também recebem pedidos no formato de arquivo da Batch API
+da OpenAI (uma linha com custom_id, method, url e body por chamada) e
+devolvem os resultados nas linhas do arquivo de saída da mesma API.
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import zlib
+import random
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from types import SimpleNamespace
+from config_sistema import obter_config, obter_config_float, obter_config_int
+import cliente_ia
+
+logger = logging.getLogger(__name__)
+
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+
+# Modelo usado com o SDK legado, que não conhece os modelos mais recentes
+MODELO_LEGADO = "gpt-4-turbo"
+
+# Situação de um lote de chamadas no provedor
+LOTE_EM_ANDAMENTO = 'em_andamento'
+LOTE_CONCLUIDO = 'concluido'
+LOTE_FALHOU = 'falhou'  # Falhou, expirou ou foi cancelado (pode ter resultados parciais)
+
+def requisicao_lote(custom_id, parametros):
+    """Linha do arquivo de entrada da Batch API para uma chamada de chat"""
+    return {'custom_id': custom_id, 'method': 'POST', 'url': '/v1/chat/completions', 'body': parametros}
+
+class ProvedorIA:
+    """Interface dos provedores de IA"""
+
+    nome = None
+    suporta_async = True
+    suporta_streaming = True
+    legado = False  # SDK legado: o timeout de cada chamada vai em 'request_timeout'
+    suporta_lote = False
+
+    def criar_chat(self, **parametros):
+        """Executa uma chamada de chat (mesmos argumentos de chat.completions.create)"""
+        raise NotImplementedError
+
+    async def criar_chat_async(self, **parametros):
+        """Versão assíncrona de criar_chat"""
+        raise NotImplementedError
+
+    def enviar_lote(self, requisicoes):
+        """
+        Submete um lote de chamadas de chat para processamento assíncrono
+
+        Args:
+            requisicoes (list): Linhas no formato de requisicao_lote
+
+        Returns:
+            str: Identificador do lote no provedor
+        """
+        raise NotImplementedError
+
+    def consultar_lote(self, lote_id):
+        """
+        Consulta um lote submetido
+
+        Returns:
+            tuple: (situação, linhas do arquivo de saída; vazia enquanto em andamento)
+        """
+        raise NotImplementedError
+
+class ProvedorOpenAI(ProvedorIA):
+    """API da OpenAI com o SDK v1+ (clientes síncrono e assíncrono)"""
+
+    nome = 'openai'
+    suporta_lote = True
+
+    def __init__(self):
+        from openai import OpenAI # type: ignore
+        self.client = OpenAI(api_key=OPENAI_API_KEY, **cliente_ia.opcoes_cliente())
+        self._cliente_async = None
+        logger.info("OpenAI client v1+ inicializado com sucesso")
+
+    def _obter_cliente_async(self):
+        """Cliente AsyncOpenAI do modo ASGI, criado na primeira utilização"""
+        if self._cliente_async is None:
+            from openai import AsyncOpenAI # type: ignore
+            self._cliente_async = AsyncOpenAI(api_key=OPENAI_API_KEY,
+                                              **cliente_ia.opcoes_cliente(assincrono=True))
+            logger.info("OpenAI client assíncrono inicializado com sucesso")
+        return self._cliente_async
+
+    def criar_chat(self, **parametros):
+        return self.client.chat.completions.create(**parametros)
+
+    async def criar_chat_async(self, **parametros):
+        return await self._obter_cliente_async().chat.completions.create(**parametros)
+
+    def enviar_lote(self, requisicoes):
+        conteudo = "\n".join(json.dumps(requisicao, ensure_ascii=False) for requisicao in requisicoes)
+        arquivo = self.client.files.create(file=('lote.jsonl', conteudo.encode('utf-8')), purpose='batch')
+        lote = self.client.batches.create(input_file_id=arquivo.id, endpoint='/v1/chat/completions',
+                                          completion_window='24h')
+        return lote.id
+
+    def consultar_lote(self, lote_id):
+        lote = self.client.batches.retrieve(lote_id)
+        if lote.status not in ('completed', 'failed', 'expired', 'cancelled'):
+            return LOTE_EM_ANDAMENTO, []
+        # Resultados com sucesso e com erro ficam em arquivos separados
+        linhas = []
+        for arquivo_id in (lote.output_file_id, lote.error_file_id):
+            if arquivo_id:
+                texto = self.client.files.content(arquivo_id).text
+                linhas.extend(json.loads(linha) for linha in texto.splitlines() if linha.strip())
+        return (LOTE_CONCLUIDO if lote.status == 'completed' else LOTE_FALHOU), linhas
+
+class ProvedorOpenAILegado(ProvedorIA):
+    """API da OpenAI com o SDK legado (v0), sem cliente assíncrono nem streaming"""
+
+    nome = 'openai_legado'
+    suporta_async = False
+    suporta_streaming = False
+    legado = True
+
+    def __init__(self):
+        import openai as client # type: ignore
+        client.api_key = OPENAI_API_KEY
+        self.client = client
+        logger.info("OpenAI client (legacy) inicializado com sucesso")
+
+    def criar_chat(self, **parametros):
+        # O SDK legado não conhece os modelos novos nem as respostas estruturadas
+        parametros = dict(parametros, model=MODELO_LEGADO)
+        parametros.pop('response_format', None)
+        return self.client.ChatCompletion.create(**parametros)
+
+# Cache de prompt simulado: prefixos com pelo menos este número de tokens são
+# reaproveitados em blocos de TOKENS_BLOCO_CACHE, como no cache da OpenAI
+MINIMO_TOKENS_CACHE = 1024
+TOKENS_BLOCO_CACHE = 128
+PREFIXOS_EM_CACHE = 1000
+
+class ErroProvedorSimulado(Exception):
+    """Falha transitória sorteada pelo provedor simulado (equivale a um HTTP 503)"""
+    status_code = 503
+
+class ProvedorSimulado(ProvedorIA):
+    """
+    Provedor local e determinístico para testes de carga e CI
+
+    Configurações:
+        ia_simulado_latencia: distribuição da latência ('lognormal', 'uniforme' ou 'fixa')
+        ia_simulado_latencia_ms: latência média em milissegundos
+        ia_simulado_latencia_desvio: desvio da lognormal (sigma) ou fração da média na uniforme
+        ia_simulado_taxa_erro: fração das chamadas que falham com erro transitório
+        ia_simulado_respostas: respostas fixas separadas por '||' (escolhidas pelo texto da mensagem)
+        ia_simulado_semente: semente do sorteio de latências e erros
+        ia_simulado_lote_segundos: tempo até um lote ficar pronto
+
+    Os lotes ficam apenas na memória do processo que os submeteu.
+    """
+
+    nome = 'simulado'
+    suporta_lote = True
+
+    def __init__(self):
+        self._aleatorio = random.Random(obter_config_int('ia_simulado_semente', 42))
+        self._lock = threading.Lock()
+        self._prefixos = OrderedDict()  # hash da primeira mensagem -> None (LRU)
+        self._lotes = {}  # id -> (horário em que fica pronto, requisições)
+
+    def _sortear(self):
+        """Sorteia a latência (segundos) e se a chamada vai falhar"""
+        media = max(0.0, obter_config_float('ia_simulado_latencia_ms', 800.0)) / 1000
+        desvio = max(0.0, obter_config_float('ia_simulado_latencia_desvio', 0.5))
+        distribuicao = obter_config('ia_simulado_latencia', 'lognormal')
+        with self._lock:
+            if media <= 0 or distribuicao == 'fixa':
+                latencia = media
+            elif distribuicao == 'uniforme':
+                latencia = self._aleatorio.uniform(media * (1 - desvio), media * (1 + desvio))
+            else:
+                # Lognormal com a média configurada: mu = ln(media) - sigma²/2
+                latencia = self._aleatorio.lognormvariate(math.log(media) - desvio ** 2 / 2, desvio)
+            falha = self._aleatorio.random() < obter_config_float('ia_simulado_taxa_erro', 0.0)
+        return max(0.0, latencia), falha
+
+    def _conteudo(self, parametros):
+        """Gera o conteúdo da resposta, sempre o mesmo para as mesmas mensagens"""
+        mensagens = parametros.get('messages') or [{'content': ''}]
+        ultima = mensagens[-1].get('content') or ''
+        sorteio = random.Random(zlib.crc32(ultima.encode('utf-8')))
+
+        def analise():
+            return {
+                'sentimento': round(sorteio.uniform(-0.5, 1.0), 2),
+                'prob_conversao': round(sorteio.uniform(0.1, 0.9), 2),
+                'interesse': round(sorteio.uniform(0.2, 1.0), 2),
+                'urgencia': round(sorteio.uniform(0.0, 0.6), 2),
+            }
+
+        respostas = [resposta.strip() for resposta in obter_config('ia_simulado_respostas', '').split('||')
+                     if resposta.strip()]
+        if respostas:
+            texto = sorteio.choice(respostas)
+        else:
+            texto = (f"Olá! Esta é uma resposta simulada para a sua mensagem: \"{ultima[:80]}\".\n\n"
+                     "Em um atendimento real, a NutriAI responderia aqui com orientações gerais "
+                     "de nutrição esportiva e indicaria um nutricionista para um plano individual.")
+
+        if (parametros.get('response_format') or {}).get('type') != 'json_object':
+            return texto
+
+        # Pedidos em lote identificam cada item por um cabeçalho '### Lead N', '### Mensagem N'
+        # ou '### Variante N'
+        itens = re.findall(r'^### (Lead|Mensagem|Variante) (\d+)', ultima, re.MULTILINE)
+        if itens:
+            def item(tipo, numero):
+                if tipo == 'Lead':
+                    return "Resumo simulado da conversa."
+                if tipo == 'Variante':
+                    return f"Olá [nome], este é o lembrete simulado número {numero}. Preencha o formulário!"
+                return analise()
+            return json.dumps({numero: item(tipo, numero) for tipo, numero in itens}, ensure_ascii=False)
+        return json.dumps(dict(analise(), resposta=texto), ensure_ascii=False)
+
+    def _tokens_cacheados(self, mensagens):
+        """Simula o cache de prompt: a primeira mensagem já vista e longa o bastante é reaproveitada"""
+        from orcamento_prompt import contar_tokens_mensagens
+        if not mensagens:
+            return 0
+        tokens_prefixo = contar_tokens_mensagens(mensagens[:1])
+        if tokens_prefixo < MINIMO_TOKENS_CACHE:
+            return 0
+        chave = zlib.crc32(str(mensagens[0].get('content')).encode('utf-8'))
+        with self._lock:
+            vista = chave in self._prefixos
+            self._prefixos[chave] = None
+            self._prefixos.move_to_end(chave)
+            if len(self._prefixos) > PREFIXOS_EM_CACHE:
+                self._prefixos.popitem(last=False)
+        return tokens_prefixo // TOKENS_BLOCO_CACHE * TOKENS_BLOCO_CACHE if vista else 0
+
+    def _resposta(self, parametros, conteudo):
+        from orcamento_prompt import contar_tokens, contar_tokens_mensagens
+        tokens_entrada = contar_tokens_mensagens(parametros.get('messages') or [])
+        tokens_saida = contar_tokens(conteudo)
+        tokens_cacheados = self._tokens_cacheados(parametros.get('messages') or [])
+        return SimpleNamespace(
+            model=parametros.get('model'),
+            choices=[SimpleNamespace(message=SimpleNamespace(role='assistant', content=conteudo),
+                                     finish_reason='stop')],
+            usage=SimpleNamespace(prompt_tokens=tokens_entrada, completion_tokens=tokens_saida,
+                                  total_tokens=tokens_entrada + tokens_saida,
+                                  prompt_tokens_details=SimpleNamespace(cached_tokens=tokens_cacheados)),
+        )
+
+    @staticmethod
+    def _trechos(conteudo):
+        """Divide o conteúdo em trechos de streaming (uma palavra por evento)"""
+        for trecho in re.findall(r'\S+\s*|\s+', conteudo):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=trecho),
+                                                           finish_reason=None)])
+
+    def _verificar(self, latencia, falha, timeout):
+        """Limita a espera ao timeout da chamada e define o erro, se houver"""
+        if timeout is not None and latencia > timeout:
+            return timeout, TimeoutError("Tempo limite excedido no provedor simulado")
+        if falha:
+            return latencia, ErroProvedorSimulado("Falha simulada do provedor de IA")
+        return latencia, None
+
+    def criar_chat(self, **parametros):
+        latencia, erro = self._verificar(*self._sortear(), parametros.get('timeout'))
+        conteudo = self._conteudo(parametros)
+        if not parametros.get('stream'):
+            time.sleep(latencia)
+            if erro:
+                raise erro
+            return self._resposta(parametros, conteudo)
+
+        # Em streaming, a latência sorteada é o tempo até o primeiro trecho
+        time.sleep(latencia)
+        if erro:
+            raise erro
+        return self._trechos(conteudo)
+
+    async def criar_chat_async(self, **parametros):
+        latencia, erro = self._verificar(*self._sortear(), parametros.get('timeout'))
+        conteudo = self._conteudo(parametros)
+        await asyncio.sleep(latencia)
+        if erro:
+            raise erro
+        if not parametros.get('stream'):
+            return self._resposta(parametros, conteudo)
+
+        async def trechos():
+            for trecho in self._trechos(conteudo):
+                yield trecho
+        return trechos()
+
+    def enviar_lote(self, requisicoes):
+        pronto_em = time.monotonic() + max(0.0, obter_config_float('ia_simulado_lote_segundos', 0.0))
+        with self._lock:
+            lote_id = f"batch_simulado_{len(self._lotes) + 1}"
+            self._lotes[lote_id] = (pronto_em, list(requisicoes))
+        return lote_id
+
+    def consultar_lote(self, lote_id):
+        with self._lock:
+            if lote_id not in self._lotes:
+                raise KeyError(f"Lote {lote_id} desconhecido pelo provedor simulado")
+            pronto_em, requisicoes = self._lotes[lote_id]
+        if time.monotonic() < pronto_em:
+            return LOTE_EM_ANDAMENTO, []
+
+        linhas = []
+        for requisicao in requisicoes:
+            parametros = requisicao['body']
+            _, falha = self._sortear()
+            if falha:
+                linhas.append({'custom_id': requisicao['custom_id'], 'response': None,
+                               'error': {'code': 'server_error', 'message': "Falha simulada do provedor de IA"}})
+                continue
+            resposta = self._resposta(parametros, self._conteudo(parametros))
+            corpo = {
+                'model': resposta.model,
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': resposta.choices[0].message.content}}],
+                'usage': {'prompt_tokens': resposta.usage.prompt_tokens,
+                          'completion_tokens': resposta.usage.completion_tokens,
+                          'total_tokens': resposta.usage.total_tokens},
+            }
+            linhas.append({'custom_id': requisicao['custom_id'],
+                           'response': {'status_code': 200, 'body': corpo}, 'error': None})
+        return LOTE_CONCLUIDO, linhas
+
+_provedor = None
+_lock = threading.Lock()
+
+def _criar_provedor_openai():
+    """Cria o provedor da OpenAI, com o SDK novo ou, na falta dele, o legado"""
+    try:
+        logger.info("Tentando importar OpenAI SDK novo (v1+)")
+        return ProvedorOpenAI()
+    except (ImportError, TypeError) as e:
+        logger.warning(f"Erro ao inicializar OpenAI novo: {str(e)}")
+    try:
+        logger.info("Tentando importar SDK antigo do OpenAI")
+        return ProvedorOpenAILegado()
+    except Exception as e:
+        logger.error(f"Erro crítico ao inicializar OpenAI: {str(e)}")
+        sys.stderr.write(f"ERRO FATAL: Não foi possível inicializar OpenAI: {str(e)}")
+        raise
+
+PROVEDORES = {
+    'openai': _criar_provedor_openai,
+    'simulado': ProvedorSimulado,
+}
+
+def obter_provedor():
+    """
+    Retorna o provedor configurado em 'ia_provedor', criado na primeira utilização
+
+    Returns:
+        ProvedorIA: Provedor em uso
+    """
+    global _provedor
+    configurado = obter_config('ia_provedor', 'openai')
+    nome = configurado if configurado in PROVEDORES else 'openai'
+    if _provedor is None or _nome_configuracao(_provedor) != nome:
+        with _lock:
+            if _provedor is None or _nome_configuracao(_provedor) != nome:
+                if nome != configurado:
+                    logger.error(f"Provedor de IA desconhecido '{configurado}', usando 'openai'")
+                _provedor = PROVEDORES[nome]()
+                logger.info(f"Provedor de IA em uso: {_provedor.nome}")
+    return _provedor
+
+def _nome_configuracao(provedor):
+    """Nome do provedor em 'ia_provedor' (o SDK legado também é configurado como 'openai')"""
+    return 'openai' if isinstance(provedor, ProvedorOpenAILegado) else provedor.nome
@@ -0,0 +1,247 @@
+"""
+Registro das chamadas à IA (ledger de latência, tokens e custo)
+
+Cada chamada feita pelo agente gera um registro com o lead, o propósito, o
+modelo, os tokens, a latência e o resultado. Os registros não são gravados
+no caminho da resposta: entram em uma fila em memória e uma thread dedicada
+os grava em lotes na tabela chamada_ia (write-behind). Se a fila encher, os
+registros excedentes são descartados e contados, sem bloquear o atendimento.
+"""
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app import app, db
+from models import ChamadaIA, Lead
+from config_sistema import obter_config_bool, obter_config_int, obter_config_float
+from roteador_modelos import estimar_custo
+import metricas
+
+logger = logging.getLogger(__name__)
+
+RESULTADO_SUCESSO = 'sucesso'
+RESULTADO_ERRO = 'erro'
+RESULTADO_DISJUNTOR = 'disjuntor'
+RESULTADO_LIMITE = 'limite'
+
+# Máximo de latências lidas por propósito para os percentis, fora do PostgreSQL
+AMOSTRAS_PERCENTIL = 5000
+
+_fila = None
+_thread = None
+_lock = threading.Lock()
+
+def registro_ativo():
+    """Indica se as chamadas à IA são registradas na tabela chamada_ia"""
+    return obter_config_bool('ia_registro_chamadas', True)
+
+def registrar(proposito, modelo, lead_id=None, tokens_entrada=0, tokens_saida=0,
+              segundos=0.0, resultado=RESULTADO_SUCESSO, erro=None, tokens_cacheados=0, lote=False):
+    """
+    Enfileira o registro de uma chamada à IA (não bloqueia)
+
+    Args:
+        proposito (str): Nome da chamada (resposta, sentimento, lembrete, resumo...)
+        modelo (str): Modelo usado
+        lead_id (int): Lead da conversa, se a chamada for de um único lead
+        tokens_entrada (int): Tokens do prompt
+        tokens_saida (int): Tokens gerados
+        segundos (float): Latência total da chamada
+        resultado (str): sucesso, erro, disjuntor ou limite
+        erro (str): Tipo do erro, se houver
+        tokens_cacheados (int): Tokens do prompt servidos do cache do provedor (custo reduzido)
+        lote (bool): Chamada processada pela Batch API (custo reduzido)
+    """
+    if not registro_ativo():
+        return
+    try:
+        _obter_fila().put_nowait({
+            'lead_id': lead_id,
+            'proposito': proposito,
+            'modelo': modelo,
+            'tokens_entrada': tokens_entrada,
+            'tokens_saida': tokens_saida,
+            'custo_usd': estimar_custo(modelo, tokens_entrada, tokens_saida, tokens_cacheados, lote),
+            'latencia_ms': int(round(segundos * 1000)),
+            'resultado': resultado,
+            'erro': erro[:100] if erro else None,
+            'criado_em': datetime.utcnow(),
+        })
+    except queue.Full:
+        metricas.incrementar('ia_registro_descartados')
+        return
+    _iniciar()
+
+def _obter_fila():
+    """Cria a fila na primeira utilização, com o tamanho configurado ('ia_registro_fila_maxima')"""
+    global _fila
+    if _fila is None:
+        with _lock:
+            if _fila is None:
+                _fila = queue.Queue(maxsize=max(1, obter_config_int('ia_registro_fila_maxima', 5000)))
+    return _fila
+
+def _iniciar():
+    """Garante que a thread de gravação está em execução"""
+    global _thread
+    if _thread is not None:
+        return
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_executar, name='ia-registro-chamadas', daemon=True)
+            _thread.start()
+
+def _coletar_lote():
+    """Aguarda o primeiro registro e junta os seguintes até o tamanho ou o intervalo do lote"""
+    registros = [_fila.get()]
+    tamanho = max(1, obter_config_int('ia_registro_lote', 100))
+    prazo = time.monotonic() + max(0.0, obter_config_float('ia_registro_intervalo', 5.0))
+    while len(registros) < tamanho:
+        restante = prazo - time.monotonic()
+        if restante <= 0:
+            break
+        try:
+            registros.append(_fila.get(timeout=restante))
+        except queue.Empty:
+            break
+    return registros
+
+def _gravar(registros):
+    try:
+        with app.app_context():
+            db.session.bulk_insert_mappings(ChamadaIA, registros)
+            db.session.commit()
+        metricas.incrementar('ia_registro_gravados', len(registros))
+    except Exception as e:
+        # Os registros são descartados: o ledger não pode acumular memória sem limite
+        metricas.incrementar('ia_registro_falhas', len(registros))
+        logger.error(f"Erro ao gravar {len(registros)} registros de chamadas à IA: {str(e)}")
+        with app.app_context():
+            db.session.rollback()
+
+def _executar():
+    while True:
+        _gravar(_coletar_lote())
+
+def descarregar():
+    """Grava imediatamente os registros pendentes na fila (ex.: no encerramento do processo)"""
+    if _fila is None:
+        return
+    registros = []
+    while True:
+        try:
+            registros.append(_fila.get_nowait())
+        except queue.Empty:
+            break
+    if registros:
+        _gravar(registros)
+
+atexit.register(descarregar)
+
+def agregados(dias=7):
+    """
+    Agregados do ledger para o dashboard
+
+    Args:
+        dias (int): Período considerado
+
+    Returns:
+        dict: Latência (p50/p95) e tokens por propósito, tokens e custo por dia
+              e custo médio das conversas dos leads convertidos
+    """
+    inicio = datetime.utcnow() - timedelta(days=dias)
+    percentis = _percentis_latencia(inicio)
+
+    por_proposito = []
+    custo_total = 0.0
+    for proposito, chamadas, falhas, tokens_entrada, tokens_saida, custo in (
+            db.session.query(ChamadaIA.proposito,
+                             func.count(ChamadaIA.id),
+                             func.sum(db.case((ChamadaIA.resultado != RESULTADO_SUCESSO, 1), else_=0)),
+                             func.sum(ChamadaIA.tokens_entrada),
+                             func.sum(ChamadaIA.tokens_saida),
+                             func.sum(ChamadaIA.custo_usd))
+            .filter(ChamadaIA.criado_em >= inicio)
+            .group_by(ChamadaIA.proposito)
+            .order_by(func.count(ChamadaIA.id).desc())):
+        p50, p95 = percentis(proposito)
+        custo_total += custo or 0.0
+        por_proposito.append({
+            'proposito': proposito,
+            'chamadas': chamadas,
+            'falhas': falhas or 0,
+            'p50_ms': round(p50),
+            'p95_ms': round(p95),
+            'tokens_entrada': tokens_entrada or 0,
+            'tokens_saida': tokens_saida or 0,
+            'custo_usd': round(custo or 0.0, 4),
+        })
+
+    dia = func.date(ChamadaIA.criado_em)
+    por_dia = [{'dia': str(data), 'tokens': (entrada or 0) + (saida or 0), 'custo_usd': round(custo or 0.0, 4)}
+               for data, entrada, saida, custo in (
+                   db.session.query(dia, func.sum(ChamadaIA.tokens_entrada),
+                                    func.sum(ChamadaIA.tokens_saida), func.sum(ChamadaIA.custo_usd))
+                   .filter(ChamadaIA.criado_em >= inicio)
+                   .group_by(dia)
+                   .order_by(dia))]
+
+    # Custo de todas as chamadas (de qualquer período) das conversas que terminaram em conversão
+    custo_convertidos, leads_convertidos = (
+        db.session.query(func.sum(ChamadaIA.custo_usd), func.count(func.distinct(ChamadaIA.lead_id)))
+        .join(Lead, Lead.id == ChamadaIA.lead_id)
+        .filter(Lead.status == 'convertido')
+        .one())
+
+    return {
+        'dias': dias,
+        'por_proposito': por_proposito,
+        'por_dia': por_dia,
+        'custo_total_usd': round(custo_total, 4),
+        'custo_por_lead_convertido_usd': (round(custo_convertidos / leads_convertidos, 4)
+                                          if leads_convertidos else None),
+    }
+
+def _percentis_latencia(inicio):
+    """
+    Percentis 50 e 95 da latência das chamadas bem-sucedidas desde o início
+
+    No PostgreSQL, os percentis são calculados no banco (percentile_cont). Nos
+    outros bancos, apenas as AMOSTRAS_PERCENTIL chamadas mais recentes de cada
+    propósito são lidas.
+
+    Returns:
+        callable: Recebe o propósito e retorna a tupla (p50, p95) em milissegundos
+    """
+    filtros = (ChamadaIA.criado_em >= inicio, ChamadaIA.resultado == RESULTADO_SUCESSO)
+    if db.engine.dialect.name == 'postgresql':
+        calculados = {proposito: (p50 or 0.0, p95 or 0.0) for proposito, p50, p95 in (
+            db.session.query(ChamadaIA.proposito,
+                             func.percentile_cont(0.5).within_group(ChamadaIA.latencia_ms),
+                             func.percentile_cont(0.95).within_group(ChamadaIA.latencia_ms))
+            .filter(*filtros)
+            .group_by(ChamadaIA.proposito))}
+        return lambda proposito: calculados.get(proposito, (0.0, 0.0))
+
+    def amostrar(proposito):
+        amostras = [latencia_ms for latencia_ms, in (
+            db.session.query(ChamadaIA.latencia_ms)
+            .filter(ChamadaIA.proposito == proposito, *filtros)
+            .order_by(ChamadaIA.id.desc())
+            .limit(AMOSTRAS_PERCENTIL))]
+        return metricas.percentil(amostras, 50), metricas.percentil(amostras, 95)
+    return amostrar
+
+def estatisticas():
+    """Tamanho da fila e totais de registros gravados, descartados e com falha"""
+    return {
+        'fila': _fila.qsize() if _fila is not None else 0,
+        'gravados': metricas.obter_contador('ia_registro_gravados'),
+        'descartados': metricas.obter_contador('ia_registro_descartados'),
+        'falhas': metricas.obter_contador('ia_registro_falhas'),
+    }
+
+metricas.registrar_coletor('registro_chamadas', estatisticas)
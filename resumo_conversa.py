@@ -0,0 +1,183 @@
+"""
+Resumo acumulado das conversas com os leads
+
+Em vez de reenviar um histórico longo a cada mensagem, a IA recebe o resumo
+da conversa e apenas os turnos posteriores a ele. Os resumos são atualizados
+fora do caminho da resposta: cada resposta da IA marca o lead como pendente e
+uma thread dedicada, a cada intervalo, junta os leads com interações novas
+suficientes e atualiza vários resumos em uma única chamada a um modelo barato.
+As falhas são contadas por lead: após 'ia_resumo_tentativas' atualizações sem
+resumo, o lead deixa de ser reenviado à IA por 'ia_resumo_pausa_horas' horas.
+"""
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from app import app, db
+from models import Interacao, Lead, ResumoConversa, TentativaResumo
+from config_sistema import obter_config_bool, obter_config_int, obter_config_float
+import metricas
+
+logger = logging.getLogger(__name__)
+
+# Interações novas enviadas por lead em cada atualização do resumo
+MAXIMO_INTERACOES_POR_LEAD = 30
+
+_pendentes = set()
+_lock = threading.Lock()
+_thread = None
+
+def resumo_ativo():
+    """Indica se os resumos de conversa estão habilitados ('ia_resumo_conversa')"""
+    return obter_config_bool('ia_resumo_conversa', True)
+
+def obter_resumo(lead_id):
+    """
+    Retorna o resumo atual da conversa com o lead
+
+    Returns:
+        ResumoConversa: Resumo persistido, ou None se ainda não existir ou estiver desativado
+    """
+    if not resumo_ativo():
+        return None
+    return ResumoConversa.query.get(lead_id)
+
+def agendar_resumo(lead_id):
+    """Marca o lead para ter o resumo avaliado na próxima rodada da thread"""
+    if not resumo_ativo():
+        return
+    global _thread
+    with _lock:
+        _pendentes.add(lead_id)
+        if _thread is None:
+            _thread = threading.Thread(target=_executar, name='ia-resumos', daemon=True)
+            _thread.start()
+
+def _executar():
+    while True:
+        time.sleep(max(1.0, obter_config_float('ia_resumo_intervalo', 60.0)))
+        try:
+            with app.app_context():
+                atualizar_resumos_pendentes()
+        except Exception as e:
+            logger.error(f"Erro ao atualizar resumos de conversa: {str(e)}")
+            db.session.remove()
+
+def _interacoes_novas(lead_id, resumo):
+    """Busca as interações do lead posteriores ao resumo, da mais antiga para a mais recente"""
+    consulta = Interacao.query.filter(Interacao.lead_id == lead_id,
+                                      Interacao.origem.in_(("usuario", "ia")))
+    if resumo is not None:
+        consulta = consulta.filter(Interacao.id > resumo.ultima_interacao_id)
+    return consulta.order_by(Interacao.id.asc()).limit(MAXIMO_INTERACOES_POR_LEAD).all()
+
+def atualizar_resumos_pendentes():
+    """
+    Atualiza, em lotes, os resumos dos leads pendentes com interações novas suficientes
+
+    Leads que ainda não acumularam 'ia_resumo_a_cada' interações novas são
+    ignorados; eles voltam a ser avaliados na próxima resposta da IA. Leads sem
+    resumo após 'ia_resumo_tentativas' tentativas ficam fora dos lotes até
+    'ia_resumo_pausa_horas' horas depois da última falha.
+
+    Returns:
+        int: Quantidade de resumos atualizados
+    """
+    from ai_agent import gerar_resumos_conversa
+
+    with _lock:
+        leads = sorted(_pendentes)
+        _pendentes.clear()
+    if not leads:
+        return 0
+
+    minimo = max(1, obter_config_int('ia_resumo_a_cada', 10))
+    tamanho_lote = max(1, obter_config_int('ia_resumo_lote', 10))
+    maximo_tentativas = max(1, obter_config_int('ia_resumo_tentativas', 3))
+    pausa = timedelta(hours=obter_config_int('ia_resumo_pausa_horas', 24))
+
+    tentativas = {tentativa.lead_id: tentativa for tentativa in
+                  TentativaResumo.query.filter(TentativaResumo.lead_id.in_(leads)).all()}
+    conversas = {}
+    for lead_id in leads:
+        lead = Lead.query.get(lead_id)
+        if lead is None:
+            continue
+        tentativa = tentativas.get(lead_id)
+        if tentativa is not None and tentativa.tentativas >= maximo_tentativas:
+            if tentativa.ultima_em and datetime.utcnow() - tentativa.ultima_em < pausa:
+                metricas.incrementar('ia_resumos_ignorados_apos_tentativas')
+                continue
+            tentativa.tentativas = 0
+        resumo = ResumoConversa.query.get(lead_id)
+        interacoes = _interacoes_novas(lead_id, resumo)
+        if len(interacoes) < minimo:
+            continue
+        conversas[lead_id] = {
+            'nome': lead.nome,
+            'resumo': resumo.resumo if resumo else '',
+            'interacoes': interacoes,
+        }
+
+    atualizados = 0
+    esgotados = 0
+    ids = list(conversas)
+    for posicao in range(0, len(ids), tamanho_lote):
+        lote = {lead_id: conversas[lead_id] for lead_id in ids[posicao:posicao + tamanho_lote]}
+        inicio = time.perf_counter()
+        resumos = gerar_resumos_conversa(lote)
+        metricas.registrar_latencia('ia_resumo_lote', time.perf_counter() - inicio)
+
+        for lead_id, texto in resumos.items():
+            conversa = lote.get(lead_id)
+            if conversa is None or not texto:
+                continue
+            resumo = ResumoConversa.query.get(lead_id)
+            if resumo is None:
+                resumo = ResumoConversa(lead_id=lead_id, interacoes_resumidas=0)
+                db.session.add(resumo)
+            resumo.resumo = texto
+            resumo.ultima_interacao_id = conversa['interacoes'][-1].id
+            resumo.interacoes_resumidas = (resumo.interacoes_resumidas or 0) + len(conversa['interacoes'])
+            atualizados += 1
+
+        # Contar as falhas; os leads resumidos saem da contagem
+        repetir = []
+        for lead_id, conversa in lote.items():
+            tentativa = tentativas.get(lead_id)
+            if resumos.get(lead_id):
+                if tentativa is not None:
+                    db.session.delete(tentativa)
+                if len(conversa['interacoes']) >= MAXIMO_INTERACOES_POR_LEAD:
+                    repetir.append(lead_id)
+                continue
+            if tentativa is None:
+                tentativa = tentativas[lead_id] = TentativaResumo(lead_id=lead_id, tentativas=0)
+                db.session.add(tentativa)
+            tentativa.tentativas += 1
+            tentativa.ultima_em = datetime.utcnow()
+            if tentativa.tentativas < maximo_tentativas:
+                repetir.append(lead_id)
+            else:
+                esgotados += 1
+
+        # Leads sem resumo na resposta da IA, ou com mais interações do que cabem
+        # em uma atualização, são avaliados novamente na próxima rodada
+        with _lock:
+            _pendentes.update(repetir)
+
+    db.session.commit()
+    if esgotados:
+        metricas.incrementar('ia_resumos_tentativas_esgotadas', esgotados)
+        logger.warning(f"{esgotados} leads sem resumo após {maximo_tentativas} tentativas")
+    if atualizados:
+        metricas.incrementar('ia_resumos_atualizados', atualizados)
+        logger.info(f"{atualizados} resumos de conversa atualizados")
+    return atualizados
+
+def estatisticas():
+    """Retorna a quantidade de leads aguardando avaliação do resumo"""
+    with _lock:
+        return {'pendentes': len(_pendentes)}
+
+metricas.registrar_coletor('resumos_conversa', estatisticas)
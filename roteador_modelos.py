@@ -0,0 +1,119 @@
+"""
+Roteamento de modelos por complexidade da mensagem
+
+Cada turno é classificado com características locais e baratas (tamanho,
+palavras de intenção, se a base de conhecimento tem a resposta e o estágio da
+conversa). Turnos simples, como agradecimentos, confirmações e perguntas
+cobertas pela base de conhecimento, vão para um modelo menor e mais rápido;
+dúvidas de nutrição mais elaboradas continuam no modelo principal. As regras
+são configuráveis pela tabela Configuracao, e a latência e o custo estimado
+de cada rota ficam nas métricas.
+"""
+import logging
+from config_sistema import obter_config, obter_config_bool, obter_config_int, obter_config_float
+from normalizacao import normalizar_texto
+import metricas
+
+logger = logging.getLogger(__name__)
+
+ROTA_SIMPLES = 'simples'
+ROTA_COMPLEXA = 'complexa'
+
+# Preço estimado (US$ por milhão de tokens de entrada e de saída)
+PRECOS_MODELOS = {
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4-turbo': (10.00, 30.00),
+}
+
+# Fração do preço de entrada cobrada pelos tokens de prompt servidos do cache do provedor
+FATOR_PRECO_CACHE = 0.5
+
+# Fração do preço cobrada pelas chamadas processadas pela Batch API
+FATOR_PRECO_LOTE = 0.5
+
+# Mensagens formadas apenas por estas palavras são de cortesia ou confirmação
+PALAVRAS_SIMPLES = (
+    'ok,okay,blz,beleza,certo,sim,nao,obrigado,obrigada,obg,valeu,vlw,oi,ola,bom,boa,dia,tarde,'
+    'noite,tchau,ate,mais,entendi,perfeito,otimo,show,legal,combinado,top,tudo,bem,e,voce,kkk,haha'
+)
+
+# Termos que indicam uma dúvida que pede orientação mais elaborada
+PALAVRAS_COMPLEXAS = (
+    'dieta,cardapio,treino,hipertrofia,emagrecer,emagrecimento,definicao,suplemento,suplementacao,'
+    'creatina,whey,proteina,carboidrato,gordura,caloria,calorias,macro,macros,jejum,lesao,diabetes,'
+    'pressao,colesterol,gravida,gestante,alergia,intolerancia,lactose,gluten,vegano,vegetariano,'
+    'exame,medicamento,remedio,porque,explica,explicar,diferenca,comparar'
+)
+
+def _lista_configurada(chave, padrao):
+    return {palavra.strip() for palavra in obter_config(chave, padrao).split(',') if palavra.strip()}
+
+def classificar_turno(mensagem_texto, conhecimento=None, turnos_anteriores=0):
+    """
+    Classifica a mensagem como simples ou complexa
+
+    Args:
+        mensagem_texto (str): Mensagem do lead (turno atual)
+        conhecimento (list): Itens recuperados da base de conhecimento
+        turnos_anteriores (int): Turnos do histórico enviados junto com a mensagem
+
+    Returns:
+        tuple: (rota, motivo)
+    """
+    palavras = normalizar_texto(mensagem_texto).split()
+    complexas = _lista_configurada('ia_roteador_palavras_complexas', PALAVRAS_COMPLEXAS)
+    simples = _lista_configurada('ia_roteador_palavras_simples', PALAVRAS_SIMPLES)
+
+    if any(palavra in complexas for palavra in palavras):
+        return ROTA_COMPLEXA, 'palavra de intenção complexa'
+    if len(mensagem_texto or '') > obter_config_int('ia_roteador_tamanho_maximo_simples', 160):
+        return ROTA_COMPLEXA, 'mensagem longa'
+    if palavras and all(palavra in simples for palavra in palavras):
+        return ROTA_SIMPLES, 'cortesia ou confirmação'
+
+    melhor = conhecimento[0] if conhecimento else None
+    if melhor and melhor.get('confianca', 0) >= obter_config_float('ia_roteador_confianca_kb', 0.6):
+        return ROTA_SIMPLES, 'respondida pela base de conhecimento'
+
+    # No início da conversa, mensagens curtas costumam ser apresentações e perguntas gerais
+    if (len(palavras) <= obter_config_int('ia_roteador_palavras_curta', 6)
+            and turnos_anteriores <= obter_config_int('ia_roteador_turnos_iniciais', 2)):
+        return ROTA_SIMPLES, 'mensagem curta no início da conversa'
+
+    return ROTA_COMPLEXA, 'padrão'
+
+def escolher_modelo(mensagem_texto, conhecimento=None, turnos_anteriores=0, modelo_padrao='gpt-4o'):
+    """
+    Escolhe o modelo que vai responder o turno
+
+    Com 'ia_roteador' desativado, todas as mensagens usam o modelo padrão.
+
+    Returns:
+        tuple: (rota, modelo)
+    """
+    if not obter_config_bool('ia_roteador', True):
+        return ROTA_COMPLEXA, modelo_padrao
+
+    rota, motivo = classificar_turno(mensagem_texto, conhecimento, turnos_anteriores)
+    if rota == ROTA_SIMPLES:
+        modelo = obter_config('ia_modelo_simples', 'gpt-4o-mini')
+    else:
+        modelo = obter_config('ia_modelo_complexo', modelo_padrao)
+    logger.info(f"Rota '{rota}' ({motivo}), modelo {modelo}")
+    return rota, modelo
+
+def estimar_custo(modelo, tokens_entrada, tokens_saida, tokens_cacheados=0, lote=False):
+    """Custo estimado de uma chamada em US$ (0 para modelos sem preço conhecido)"""
+    preco_entrada, preco_saida = PRECOS_MODELOS.get(modelo, (0.0, 0.0))
+    entrada = tokens_entrada - tokens_cacheados * (1 - FATOR_PRECO_CACHE)
+    custo = (entrada * preco_entrada + tokens_saida * preco_saida) / 1_000_000
+    return custo * FATOR_PRECO_LOTE if lote else custo
+
+def registrar_uso(rota, modelo, tokens_entrada, tokens_saida, segundos):
+    """Registra latência, tokens e custo estimado de uma resposta na rota"""
+    metricas.incrementar(f'ia_rota_{rota}_chamadas')
+    metricas.incrementar(f'ia_rota_{rota}_tokens_entrada', tokens_entrada)
+    metricas.incrementar(f'ia_rota_{rota}_tokens_saida', tokens_saida)
+    metricas.incrementar(f'ia_rota_{rota}_custo_usd', estimar_custo(modelo, tokens_entrada, tokens_saida))
+    metricas.registrar_latencia(f'ia_rota_{rota}', segundos)
@@ -5,6 +5,10 @@ from werkzeug.security import check_password_hash, generate_password_hash
 from app import app
 from database import db
 from models import User, Lead, Interacao, Formulario, Configuracao, BaseConhecimento
+from config_sistema import invalidar_cache as invalidar_cache_configuracoes
+from metricas import obter_metricas
+from registro_chamadas import agregados as agregados_chamadas_ia
+from conhecimento import invalidar_versao as invalidar_versao_conhecimento, recuperador as recuperador_conhecimento
 
 # Setup logging
 logger = logging.getLogger(__name__)
@@ -104,13 +108,17 @@ def dashboard():
         if lead:
             interacoes_recentes.append((interacao, lead))
     
+    # Latência, tokens e custo das chamadas à IA
+    chamadas_ia = agregados_chamadas_ia(dias=7)
+    
     return render_template('dashboard.html',
                           total_leads=total_leads,
                           leads_novos=leads_novos,
                           leads_convertidos=leads_convertidos,
                           taxa_conversao=taxa_conversao,
                           formularios_pendentes=formularios_pendentes,
-                          interacoes_recentes=interacoes_recentes)
+                          interacoes_recentes=interacoes_recentes,
+                          chamadas_ia=chamadas_ia)
 
 # Gestão de leads
 @app.route('/leads')
@@ -211,6 +219,7 @@ def criar_lead():
 @login_required
 def base_conhecimento():
     if request.method == 'POST':
+        conhecimento_id = request.form.get('id')
         categoria = request.form.get('categoria')
         pergunta = request.form.get('pergunta')
         resposta = request.form.get('resposta')
@@ -220,17 +229,34 @@ def base_conhecimento():
             flash('Por favor, preencha todos os campos obrigatórios.', 'danger')
             return redirect(url_for('base_conhecimento'))
         
-        novo_conhecimento = BaseConhecimento(
-            categoria=categoria,
-            pergunta=pergunta,
-            resposta=resposta,
-            palavras_chave=palavras_chave
-        )
+        if conhecimento_id:
+            # Edição de um item existente
+            if not conhecimento_id.isdigit():
+                flash('Item da base de conhecimento inválido.', 'danger')
+                return redirect(url_for('base_conhecimento'))
+            conhecimento = BaseConhecimento.query.get_or_404(int(conhecimento_id))
+            conhecimento.categoria = categoria
+            conhecimento.pergunta = pergunta
+            conhecimento.resposta = resposta
+            conhecimento.palavras_chave = palavras_chave
+            mensagem = 'Conhecimento atualizado com sucesso!'
+        else:
+            conhecimento = BaseConhecimento(
+                categoria=categoria,
+                pergunta=pergunta,
+                resposta=resposta,
+                palavras_chave=palavras_chave
+            )
+            db.session.add(conhecimento)
+            mensagem = 'Conhecimento adicionado com sucesso!'
         
-        db.session.add(novo_conhecimento)
         db.session.commit()
         
-        flash('Conhecimento adicionado com sucesso!', 'success')
+        # Atualizar o índice de busca usado pela IA apenas com o item alterado
+        recuperador_conhecimento.atualizar_item(conhecimento)
+        invalidar_versao_conhecimento()
+        
+        flash(mensagem, 'success')
         return redirect(url_for('base_conhecimento'))
     
     # Buscar todos os itens da base de conhecimento
@@ -257,6 +283,7 @@ def configuracoes():
                     db.session.add(nova_config)
         
         db.session.commit()
+        invalidar_cache_configuracoes()
         flash('Configurações atualizadas com sucesso.', 'success')
         return redirect(url_for('configuracoes'))
     
@@ -265,6 +292,19 @@ def configuracoes():
     
     return render_template('configuracoes.html', configuracoes=configuracoes)
 
+# Métricas operacionais do processo
+@app.route('/api/metricas')
+@login_required
+def api_metricas():
+    return jsonify(obter_metricas())
+
+# Agregados do registro de chamadas à IA
+@app.route('/api/metricas/chamadas-ia')
+@login_required
+def api_metricas_chamadas_ia():
+    dias = request.args.get('dias', 7, type=int)
+    return jsonify(agregados_chamadas_ia(dias=max(1, min(dias, 90))))
+
 # Rota para manipular erros 404
 @app.errorhandler(404)
 def page_not_found(e):
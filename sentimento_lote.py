@@ -0,0 +1,215 @@
+"""
+Análise de sentimento em lote, fora do caminho da resposta
+
+Com 'ia_analise_em_lote' ativo, as respostas do WhatsApp não esperam pela
+análise de sentimento. Uma thread dedicada busca periodicamente as mensagens
+de clientes ainda sem sentimento e as analisa em lotes: várias mensagens por
+chamada à IA ou, com 'ia_analise_lote_metodo' igual a 'lexico', por um léxico
+local, sem chamadas externas. Os resultados são gravados de uma só vez e a
+notificação de potencial conversão é reavaliada para os leads atualizados.
+Mensagens que a IA deixou sem análise em 'ia_analise_lote_tentativas' lotes
+seguidos passam a ser analisadas pelo léxico, para não serem reenviadas
+indefinidamente.
+"""
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from app import app, db
+from models import Interacao, Lead, TentativaSentimento
+from config_sistema import obter_config, obter_config_bool, obter_config_int, obter_config_float
+from normalizacao import normalizar_texto, reduzir_radical
+import metricas
+
+logger = logging.getLogger(__name__)
+
+# Probabilidade de conversão a partir da qual o administrador é notificado
+LIMIAR_NOTIFICACAO = 0.8
+
+# Léxico do método local (radicais de palavras normalizadas)
+PALAVRAS_POSITIVAS = {reduzir_radical(palavra) for palavra in (
+    'obrigado', 'obrigada', 'otimo', 'otima', 'excelente', 'perfeito', 'perfeita', 'adorei',
+    'gostei', 'legal', 'show', 'maravilha', 'top', 'bom', 'boa', 'incrivel', 'feliz',
+    'animado', 'animada', 'satisfeito', 'satisfeita', 'ajudou', 'certo', 'combinado',
+)}
+PALAVRAS_NEGATIVAS = {reduzir_radical(palavra) for palavra in (
+    'ruim', 'pessimo', 'pessima', 'horrivel', 'caro', 'cara', 'demora', 'demorado',
+    'problema', 'reclamacao', 'insatisfeito', 'insatisfeita', 'chato', 'irritado',
+    'irritada', 'cancelar', 'desistir', 'absurdo', 'decepcionado', 'decepcionada', 'odeio',
+)}
+PALAVRAS_INTERESSE = {reduzir_radical(palavra) for palavra in (
+    'quero', 'contratar', 'comprar', 'assinar', 'agendar', 'marcar', 'consulta', 'plano',
+    'valor', 'preco', 'pagamento', 'pagar', 'pix', 'cartao', 'matricula', 'comecar', 'fechar',
+)}
+PALAVRAS_URGENCIA = {reduzir_radical(palavra) for palavra in (
+    'urgente', 'hoje', 'agora', 'rapido', 'logo', 'amanha', 'imediato', 'pressa',
+)}
+NEGACOES = {'nao', 'nunca', 'nem', 'jamais'}
+
+_thread = None
+_lock = threading.Lock()
+
+def analise_em_lote_ativa():
+    """Indica se a análise de sentimento é feita em lote, em segundo plano"""
+    return obter_config_bool('ia_analise_em_lote', False)
+
+def agendar_analise_em_lote():
+    """Garante que a thread da análise em lote está em execução"""
+    global _thread
+    if _thread is not None:
+        return
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_executar, name='ia-sentimento-lote', daemon=True)
+            _thread.start()
+
+def _executar():
+    while True:
+        time.sleep(max(1.0, obter_config_float('ia_analise_lote_intervalo', 30.0)))
+        try:
+            with app.app_context():
+                # Lotes completos indicam que ainda há mensagens pendentes:
+                # continuar sem esperar o intervalo
+                while analisar_pendentes() >= max(1, obter_config_int('ia_analise_lote_maximo', 200)):
+                    pass
+        except Exception as e:
+            logger.error(f"Erro na análise de sentimento em lote: {str(e)}")
+            db.session.remove()
+
+def analisar_por_lexico(texto):
+    """
+    Analisa o sentimento de uma mensagem com o léxico local
+
+    Returns:
+        dict: Mesmos campos de analisar_sentimento_cliente
+    """
+    positivas = negativas = interesse = urgencia = 0
+    negar = False
+    for palavra in normalizar_texto(texto).split():
+        if palavra in NEGACOES:
+            negar = True
+            continue
+        radical = reduzir_radical(palavra)
+        if radical in PALAVRAS_POSITIVAS:
+            if negar:
+                negativas += 1
+            else:
+                positivas += 1
+        elif radical in PALAVRAS_NEGATIVAS:
+            if negar:
+                positivas += 1
+            else:
+                negativas += 1
+        elif radical in PALAVRAS_INTERESSE and not negar:
+            interesse += 1
+        elif radical in PALAVRAS_URGENCIA:
+            urgencia += 1
+        negar = False
+
+    total = positivas + negativas
+    sentimento = (positivas - negativas) / total if total else 0.0
+    nivel_interesse = min(1.0, 0.3 + 0.25 * interesse)
+    return {
+        'sentimento': round(sentimento, 2),
+        'prob_conversao': round(min(1.0, max(0.0, 0.6 * nivel_interesse + 0.2 * sentimento + 0.1)), 2),
+        'interesse': round(nivel_interesse, 2),
+        'urgencia': round(min(1.0, 0.5 * urgencia), 2),
+    }
+
+def analisar_pendentes():
+    """
+    Analisa um lote de mensagens de clientes ainda sem sentimento
+
+    Considera apenas mensagens das últimas 'ia_analise_lote_horas' horas, até
+    'ia_analise_lote_maximo' por execução, enviadas à IA em grupos de
+    'ia_analise_lote_tamanho'. As tentativas sem resultado são contadas por
+    mensagem; após 'ia_analise_lote_tentativas', ela é analisada pelo léxico.
+
+    Returns:
+        int: Quantidade de mensagens analisadas com sucesso
+    """
+    from ai_agent import analisar_sentimentos_em_lote
+    from notification import notificar_potencial_conversao
+
+    limite = datetime.utcnow() - timedelta(hours=obter_config_int('ia_analise_lote_horas', 24))
+    maximo = max(1, obter_config_int('ia_analise_lote_maximo', 200))
+    pendentes = (Interacao.query
+                 .filter(Interacao.origem == "usuario",
+                         Interacao.sentimento.is_(None),
+                         Interacao.data_hora >= limite)
+                 .order_by(Interacao.id.asc())
+                 .limit(maximo)
+                 .all())
+    if not pendentes:
+        return 0
+
+    inicio = time.perf_counter()
+    tentativas = {tentativa.interacao_id: tentativa for tentativa in
+                  TentativaSentimento.query.filter(
+                      TentativaSentimento.interacao_id.in_([interacao.id for interacao in pendentes])).all()}
+    if obter_config('ia_analise_lote_metodo', 'ia') == 'lexico':
+        analises = {interacao.id: analisar_por_lexico(interacao.mensagem) for interacao in pendentes}
+    else:
+        maximo_tentativas = max(1, obter_config_int('ia_analise_lote_tentativas', 3))
+        esgotadas = [interacao for interacao in pendentes if interacao.id in tentativas
+                     and tentativas[interacao.id].tentativas >= maximo_tentativas]
+        analises = {interacao.id: analisar_por_lexico(interacao.mensagem) for interacao in esgotadas}
+        metricas.incrementar('sentimento_lote_lexico_apos_tentativas', len(esgotadas))
+
+        restantes = [interacao for interacao in pendentes if interacao.id not in analises]
+        tamanho = max(1, obter_config_int('ia_analise_lote_tamanho', 50))
+        for posicao in range(0, len(restantes), tamanho):
+            lote = restantes[posicao:posicao + tamanho]
+            analises.update(analisar_sentimentos_em_lote(
+                {interacao.id: interacao.mensagem for interacao in lote}))
+
+    # Contar as tentativas sem resultado; as mensagens analisadas saem da contagem
+    for interacao in pendentes:
+        tentativa = tentativas.get(interacao.id)
+        if interacao.id in analises:
+            if tentativa is not None:
+                db.session.delete(tentativa)
+        elif tentativa is None:
+            db.session.add(TentativaSentimento(interacao_id=interacao.id, tentativas=1))
+        else:
+            tentativa.tentativas += 1
+
+    # A análise da mensagem mais recente de cada lead define a pontuação dele
+    ultima_por_lead = {}
+    for interacao in pendentes:
+        if interacao.id in analises:
+            ultima_por_lead[interacao.lead_id] = analises[interacao.id]
+
+    leads = {lead.id: lead for lead in Lead.query.filter(Lead.id.in_(list(ultima_por_lead))).all()}
+    notificar = []
+    for lead_id, analise in ultima_por_lead.items():
+        lead = leads.get(lead_id)
+        if lead is None:
+            continue
+        if analise['prob_conversao'] > LIMIAR_NOTIFICACAO >= (lead.score or 0.0):
+            notificar.append((lead.nome, lead.telefone, analise['prob_conversao']))
+
+    db.session.bulk_update_mappings(Interacao, [
+        {'id': interacao_id, 'sentimento': analise['sentimento']}
+        for interacao_id, analise in analises.items()
+    ])
+    db.session.bulk_update_mappings(Lead, [
+        {'id': lead_id, 'score': analise['prob_conversao']}
+        for lead_id, analise in ultima_por_lead.items() if lead_id in leads
+    ])
+    db.session.commit()
+
+    metricas.incrementar('sentimento_lote_analisadas', len(analises))
+    metricas.incrementar('sentimento_lote_falhas', len(pendentes) - len(analises))
+    metricas.registrar_latencia('sentimento_lote', time.perf_counter() - inicio)
+    logger.info(f"Análise em lote: {len(analises)} de {len(pendentes)} mensagens analisadas, "
+                f"{len(ultima_por_lead)} leads atualizados")
+
+    # Notificar apenas os leads que passaram do limiar nesta análise
+    for nome, telefone, probabilidade in notificar:
+        try:
+            notificar_potencial_conversao(nome, telefone, probabilidade)
+        except Exception as e:
+            logger.error(f"Erro ao notificar potencial conversão: {str(e)}")
+
+    return len(analises)
@@ -0,0 +1,44 @@
+"""
+Configuração dos testes
+
+Os testes usam um banco SQLite temporário e o provedor de IA simulado
+('ia_provedor' = 'simulado'), sem chamadas externas. As configurações de cada
+teste são definidas por variáveis de ambiente, que config_sistema consulta
+quando a chave não está na tabela de configurações.
+"""
+import os
+import tempfile
+
+_pasta = tempfile.mkdtemp(prefix='agentbot-testes-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_pasta, 'testes.db')}"
+os.environ.setdefault('OPENAI_API_KEY', 'sk-teste')
+os.environ['IA_PROVEDOR'] = 'simulado'
+os.environ['IA_SIMULADO_LATENCIA_MS'] = '0'
+
+import pytest
+import main  # Registra os modelos e as rotas
+from app import app, init_db
+from database import db
+import config_sistema
+
+init_db()
+
+@pytest.fixture
+def contexto():
+    """Contexto da aplicação; as tabelas são esvaziadas ao fim do teste"""
+    with app.app_context():
+        config_sistema.invalidar_cache()
+        yield
+        db.session.rollback()
+        for tabela in reversed(db.metadata.sorted_tables):
+            db.session.execute(tabela.delete())
+        db.session.commit()
+
+@pytest.fixture
+def whatsapp(monkeypatch):
+    """Substitui o envio pela Twilio; retorna a lista de (número, mensagem) enviados"""
+    import notification
+    enviados = []
+    monkeypatch.setattr(notification, 'enviar_notificacao_whatsapp',
+                        lambda numero, mensagem: enviados.append((numero, mensagem)) or True)
+    return enviados
@@ -0,0 +1,75 @@
+"""Agrupamento de mensagens consecutivas do lead: janela de silêncio, espera máxima e resposta única"""
+import time
+import pytest
+import whatsapp_integration
+from agrupamento_mensagens import AgrupadorMensagens, obter_janela_agrupamento, unir_mensagens
+from whatsapp_integration import enfileirar_mensagem_whatsapp, registrar_mensagem_recebida
+
+def test_primeira_mensagem_abre_o_grupo():
+    agrupador = AgrupadorMensagens()
+
+    assert agrupador.adicionar(1, "oi", novo_lead=True)
+    assert not agrupador.adicionar(1, "tudo bem?")
+    assert agrupador.adicionar(2, "olá")
+
+    assert agrupador.coletar(1) == (["oi", "tudo bem?"], True)
+    assert agrupador.coletar(1) == ([], False)
+    assert agrupador.adicionar(1, "voltei")
+
+def test_nova_mensagem_reinicia_a_janela(monkeypatch):
+    agora = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: agora[0])
+    agrupador = AgrupadorMensagens()
+
+    agrupador.adicionar(1, "oi")
+    agora[0] = 101.5
+    assert agrupador.tempo_restante(1, janela=2.0, espera_maxima=10.0) == pytest.approx(0.5)
+    agrupador.adicionar(1, "quero emagrecer")
+    assert agrupador.tempo_restante(1, janela=2.0, espera_maxima=10.0) == pytest.approx(2.0)
+
+    agora[0] = 103.5
+    assert agrupador.tempo_restante(1, janela=2.0, espera_maxima=10.0) == 0.0
+
+def test_espera_maxima_fecha_o_grupo_de_quem_nao_para_de_digitar(monkeypatch):
+    agora = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: agora[0])
+    agrupador = AgrupadorMensagens()
+    agrupador.adicionar(1, "oi")
+
+    for _ in range(5):
+        agora[0] += 1.0
+        agrupador.adicionar(1, "...")
+
+    assert agrupador.tempo_restante(1, janela=2.0, espera_maxima=6.0) == pytest.approx(1.0)
+    agora[0] += 1.0
+    assert agrupador.tempo_restante(1, janela=2.0, espera_maxima=6.0) == 0.0
+
+def test_configuracao_da_janela(contexto, monkeypatch):
+    assert obter_janela_agrupamento()[0] == 0.0
+
+    monkeypatch.setenv('WHATSAPP_JANELA_AGRUPAMENTO', '3')
+    monkeypatch.setenv('WHATSAPP_ESPERA_MAXIMA_AGRUPAMENTO', '1')
+
+    # A espera máxima nunca é menor que a própria janela
+    assert obter_janela_agrupamento() == (3.0, 3.0)
+
+def test_unir_mensagens_ignora_textos_vazios():
+    assert unir_mensagens(["oi", "", "quanto custa?"]) == "oi\nquanto custa?"
+
+def test_mensagens_em_sequencia_recebem_uma_resposta(contexto, monkeypatch):
+    monkeypatch.setenv('WHATSAPP_JANELA_AGRUPAMENTO', '0.2')
+    monkeypatch.setenv('IA_REGISTRO_CHAMADAS', 'false')
+    registrar_mensagem_recebida('whatsapp:+5511999990000', "oi")
+    enviadas = []
+    monkeypatch.setattr(whatsapp_integration, 'enviar_mensagem_whatsapp',
+                        lambda numero, mensagem: enviadas.append(mensagem) or True)
+
+    for texto in ("quanto custa", "o plano mensal"):
+        enfileirar_mensagem_whatsapp('whatsapp:+5511999990000', texto)
+
+    fim = time.monotonic() + 5
+    while not enviadas and time.monotonic() < fim:
+        time.sleep(0.02)
+    time.sleep(0.3)
+    assert len(enviadas) == 1
+    assert "quanto custa\no plano mensal" in enviadas[0]
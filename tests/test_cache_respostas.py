@@ -0,0 +1,48 @@
+"""Cache de respostas para perguntas repetidas: normalização, perguntas pessoais, nome do lead e versão da base"""
+import pytest
+import cache_respostas
+from cache_lru import CacheLRU
+from cache_respostas import armazenar_resposta, buscar_resposta, pergunta_cacheavel
+
+@pytest.fixture(autouse=True)
+def cache(contexto, monkeypatch):
+    """Cache vazio, restaurado ao fim do teste"""
+    monkeypatch.setattr(cache_respostas, '_cache', CacheLRU())
+    monkeypatch.setattr(cache_respostas, 'versao_base_conhecimento', lambda: '1:0')
+
+def test_pergunta_repetida_reaproveita_a_resposta():
+    armazenar_resposta("Quanto custa a consulta?", "Ana, a consulta custa R$ 200.", "Ana")
+
+    # Pontuação, acentos e maiúsculas não mudam a chave; o nome é trocado pelo do lead
+    assert buscar_resposta("quanto  custa a CONSULTA", "Bruno") == "Bruno, a consulta custa R$ 200."
+    assert buscar_resposta("quanto custa o plano?", "Bruno") is None
+
+@pytest.mark.parametrize('pergunta', [
+    "oi",
+    "quanto custa para 2 pessoas",
+    "eu posso comer pão",
+    "e isso funciona",
+])
+def test_perguntas_que_nao_sao_compartilhadas(pergunta):
+    armazenar_resposta(pergunta, "Resposta", "Ana")
+
+    assert buscar_resposta(pergunta, "Ana") is None
+    assert len(cache_respostas._cache) == 0
+
+def test_pergunta_longa_demais_nao_e_cacheavel():
+    assert pergunta_cacheavel(" ".join(["palavra"] * 30))
+    assert not pergunta_cacheavel(" ".join(["palavra"] * 31))
+
+def test_alteracao_na_base_invalida_as_respostas(monkeypatch):
+    armazenar_resposta("como funciona o acompanhamento", "Funciona assim.", "Ana")
+
+    monkeypatch.setattr(cache_respostas, 'versao_base_conhecimento', lambda: '2:0')
+
+    assert buscar_resposta("como funciona o acompanhamento", "Ana") is None
+
+def test_cache_desativado(monkeypatch):
+    armazenar_resposta("como funciona o acompanhamento", "Funciona assim.", "Ana")
+
+    monkeypatch.setenv('IA_CACHE_RESPOSTAS', 'false')
+
+    assert buscar_resposta("como funciona o acompanhamento", "Ana") is None
@@ -0,0 +1,167 @@
+"""Cliente resiliente da IA: repetições de falhas transitórias, Retry-After, prazo total e hedging"""
+import time
+import asyncio
+import pytest
+import cliente_ia
+import metricas
+from cliente_ia import DisjuntorCircuito, OrcamentoHedge, erro_transitorio
+from provedores_ia import ErroProvedorSimulado
+
+PARAMETROS = {'model': 'gpt-4o-mini', 'messages': [{'role': 'user', 'content': 'oi'}]}
+
+class ErroHTTP(Exception):
+    """Erro do SDK com código HTTP e, opcionalmente, cabeçalho Retry-After"""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type('Resposta', (), {'headers': {'retry-after': retry_after} if retry_after else {}})()
+
+@pytest.fixture(autouse=True)
+def cliente(monkeypatch):
+    """Disjuntor novo, três tentativas e repetições sem espera"""
+    monkeypatch.setattr(cliente_ia, 'disjuntor', DisjuntorCircuito())
+    monkeypatch.setenv('IA_TENTATIVAS', '3')
+    monkeypatch.setenv('IA_ESPERA_BASE', '0')
+
+def _provedor(*erros):
+    """Provedor que falha com os erros informados, em ordem, e depois responde 'ok'"""
+    pendentes = list(erros)
+    chamadas = []
+
+    def criar_chat(**parametros):
+        chamadas.append(parametros)
+        if pendentes:
+            raise pendentes.pop(0)
+        return 'ok'
+    return criar_chat, chamadas
+
+def test_falhas_transitorias_sao_repetidas():
+    criar_chat, chamadas = _provedor(ErroHTTP(429), ErroProvedorSimulado("falha"))
+    repetidas = metricas.obter_contador('ia_tentativas_repetidas')
+
+    assert cliente_ia.chamar(criar_chat, 'teste', PARAMETROS) == 'ok'
+
+    assert len(chamadas) == 3
+    assert metricas.obter_contador('ia_tentativas_repetidas') == repetidas + 2
+    assert cliente_ia.disjuntor.estado == DisjuntorCircuito.FECHADO
+
+def test_desiste_apos_as_tentativas():
+    criar_chat, chamadas = _provedor(*[ErroProvedorSimulado("falha")] * 3)
+
+    with pytest.raises(ErroProvedorSimulado):
+        cliente_ia.chamar(criar_chat, 'teste', PARAMETROS)
+    assert len(chamadas) == 3
+
+def test_erro_da_requisicao_nao_e_repetido():
+    criar_chat, chamadas = _provedor(ErroHTTP(400))
+
+    with pytest.raises(ErroHTTP):
+        cliente_ia.chamar(criar_chat, 'teste', PARAMETROS)
+    assert len(chamadas) == 1
+
+@pytest.mark.parametrize('erro, transitorio', [
+    (ErroHTTP(429), True), (ErroHTTP(503), True), (TimeoutError(), True), (ConnectionError(), True),
+    (ErroHTTP(400), False), (ErroHTTP(401), False), (ValueError(), False),
+])
+def test_classificacao_dos_erros(erro, transitorio):
+    assert erro_transitorio(erro) is transitorio
+
+def test_espera_respeita_o_retry_after(monkeypatch):
+    monkeypatch.setenv('IA_ESPERA_BASE', '100')
+
+    assert cliente_ia._tempo_espera(0, ErroHTTP(429, retry_after='2')) == 2.0
+    assert 0 <= cliente_ia._tempo_espera(5, ErroHTTP(503)) <= 8.0
+
+def test_retry_after_alem_do_prazo_nao_e_repetido(monkeypatch):
+    monkeypatch.setenv('IA_PRAZO_TOTAL', '1')
+    criar_chat, chamadas = _provedor(ErroHTTP(429, retry_after='5'))
+
+    with pytest.raises(ErroHTTP):
+        cliente_ia.chamar(criar_chat, 'teste', PARAMETROS)
+    assert len(chamadas) == 1
+
+def test_timeout_da_tentativa_limitado_ao_prazo(monkeypatch):
+    monkeypatch.setenv('IA_PRAZO_TOTAL', '2')
+    monkeypatch.setenv('IA_TIMEOUT', '20')
+    criar_chat, chamadas = _provedor()
+
+    cliente_ia.chamar(criar_chat, 'teste', PARAMETROS)
+    cliente_ia.chamar(criar_chat, 'teste', PARAMETROS, legado=True)
+
+    assert 0 < chamadas[0]['timeout'] <= 2
+    assert 0 < chamadas[1]['request_timeout'] <= 2
+
+def test_prazo_esgotado_nao_chama_o_provedor():
+    with pytest.raises(TimeoutError):
+        cliente_ia._parametros_tentativa(PARAMETROS, prazo_final=0, legado=False)
+
+@pytest.fixture
+def hedge(monkeypatch):
+    """Orçamento novo; as chamadas de resposta são duplicadas depois de 50 ms"""
+    monkeypatch.setattr(cliente_ia, 'orcamento_hedge', OrcamentoHedge())
+    monkeypatch.setenv('IA_HEDGE', 'true')
+    monkeypatch.setenv('IA_HEDGE_ATRASO_PADRAO', '0.05')
+    monkeypatch.setenv('IA_HEDGE_TAXA_MAXIMA', '1')
+
+def _provedor_lento(latencias):
+    """Provedor cuja n-ésima chamada demora latencias[n] segundos e responde com o próprio número"""
+    chamadas = []
+
+    def criar_chat(**parametros):
+        numero = len(chamadas)
+        chamadas.append(parametros)
+        time.sleep(latencias[numero])
+        return numero
+    return criar_chat, chamadas
+
+def test_chamada_lenta_e_duplicada(hedge, monkeypatch):
+    monkeypatch.setenv('IA_HEDGE_MODELO', 'gpt-4o-mini')
+    criar_chat, chamadas = _provedor_lento([0.5, 0.0])
+    vencedores = metricas.obter_contador('ia_hedge_vencedores')
+
+    assert cliente_ia.chamar(criar_chat, 'resposta', dict(PARAMETROS, model='gpt-4o')) == 1
+
+    assert [parametros['model'] for parametros in chamadas] == ['gpt-4o', 'gpt-4o-mini']
+    assert metricas.obter_contador('ia_hedge_vencedores') == vencedores + 1
+
+def test_chamada_rapida_nao_e_duplicada(hedge):
+    criar_chat, chamadas = _provedor_lento([0.0])
+
+    assert cliente_ia.chamar(criar_chat, 'resposta', PARAMETROS) == 0
+    assert len(chamadas) == 1
+
+def test_sem_orcamento_a_chamada_nao_e_duplicada(hedge, monkeypatch):
+    monkeypatch.setenv('IA_HEDGE_TAXA_MAXIMA', '0.5')
+    criar_chat, chamadas = _provedor_lento([0.2, 0.2, 0.0])
+
+    # A primeira chamada acumula meio crédito; só a segunda pode ser duplicada
+    assert cliente_ia.chamar(criar_chat, 'resposta', PARAMETROS) == 0
+    assert cliente_ia.chamar(criar_chat, 'resposta', PARAMETROS) == 2
+
+def test_apenas_propositos_configurados_sem_streaming_sao_duplicados(hedge):
+    assert cliente_ia._atraso_hedge('resposta', PARAMETROS) == pytest.approx(0.05)
+    assert cliente_ia._atraso_hedge('resumo', PARAMETROS) is None
+    assert cliente_ia._atraso_hedge('resposta', dict(PARAMETROS, stream=True)) is None
+
+def test_atraso_segue_o_percentil_das_latencias(hedge, monkeypatch):
+    monkeypatch.setattr(metricas, 'obter_latencias', lambda nome: [0.1 * numero for numero in range(1, 101)])
+    monkeypatch.setenv('IA_HEDGE_PERCENTIL', '90')
+
+    assert cliente_ia._atraso_hedge('resposta', PARAMETROS) == pytest.approx(9.0, abs=0.15)
+
+def test_perdedora_async_e_cancelada(hedge):
+    canceladas = []
+    chamadas = []
+
+    async def criar_chat(**parametros):
+        chamadas.append(parametros)
+        try:
+            await asyncio.sleep(0.5 if len(chamadas) == 1 else 0.0)
+        except asyncio.CancelledError:
+            canceladas.append(len(chamadas))
+            raise
+        return len(chamadas)
+
+    assert asyncio.run(cliente_ia.chamar_async(criar_chat, 'resposta', PARAMETROS)) == 2
+    assert len(canceladas) == 1
@@ -0,0 +1,101 @@
+"""Base de conhecimento: ranqueamento BM25, sincronização incremental do índice e respostas diretas"""
+import pytest
+import conhecimento
+from app import db
+from conhecimento import IndiceBM25, RecuperadorConhecimento
+from models import BaseConhecimento
+from normalizacao import tokenizar
+
+def test_bm25_prefere_termos_raros():
+    indice = IndiceBM25()
+    indice.atualizar(1, tokenizar("plano mensal de nutrição"))
+    indice.atualizar(2, tokenizar("plano para hipertrofia"))
+    indice.atualizar(3, tokenizar("plano para maratona"))
+
+    resultados = indice.buscar(tokenizar("plano maratona"), k=3)
+
+    assert [item_id for _, item_id in resultados][0] == 3
+    assert indice.cobertura(tokenizar("plano maratona"), 3) == pytest.approx(1.0)
+    assert 0 < indice.cobertura(tokenizar("plano maratona"), 1) < 0.5
+
+def test_bm25_reindexa_e_remove_itens():
+    indice = IndiceBM25()
+    indice.atualizar(1, tokenizar("consulta online"))
+    indice.atualizar(1, tokenizar("consulta presencial"))
+
+    assert indice.buscar(tokenizar("online"), k=3) == []
+    assert [item_id for _, item_id in indice.buscar(tokenizar("presencial"), k=3)] == [1]
+
+    indice.remover(1)
+    assert len(indice) == 0
+    assert indice.buscar(tokenizar("presencial"), k=3) == []
+
+@pytest.fixture
+def recuperador(contexto):
+    """Recuperador novo sobre uma base com três itens"""
+    db.session.add_all([
+        BaseConhecimento(categoria='precos', pergunta="Quanto custa a consulta?",
+                         resposta="A consulta custa R$ 200.", palavras_chave="valor, preço"),
+        BaseConhecimento(categoria='servicos', pergunta="Vocês atendem online?",
+                         resposta="Sim, atendemos por videochamada."),
+        BaseConhecimento(categoria='servicos', pergunta="Como é o plano para maratona?",
+                         resposta="O plano inclui periodização da alimentação nos treinos longos."),
+    ])
+    db.session.commit()
+    conhecimento.invalidar_versao()
+    return RecuperadorConhecimento()
+
+def test_busca_os_itens_mais_relevantes(recuperador):
+    itens = recuperador.buscar("qual o preço da consulta", k=2)
+
+    assert itens[0]['categoria'] == 'precos'
+    assert itens[0]['confianca'] > 0
+    assert len(itens) <= 2
+
+def test_busca_sem_termos_relevantes(recuperador):
+    assert recuperador.buscar("oi tudo bem") == []
+    assert recuperador.buscar("consulta", k=0) == []
+
+def test_indice_acompanha_as_alteracoes_da_base(recuperador):
+    recuperador.buscar("consulta")
+    item = BaseConhecimento.query.filter_by(categoria='precos').one()
+    db.session.delete(item)
+    db.session.add(BaseConhecimento(categoria='pagamento', pergunta="Aceitam pix?",
+                                    resposta="Sim, aceitamos pix e cartão."))
+    db.session.commit()
+    conhecimento.invalidar_versao()
+
+    assert recuperador.buscar("quanto custa a consulta") == []
+    assert [item['categoria'] for item in recuperador.buscar("aceitam pix")] == ['pagamento']
+
+def _item(categoria='precos', confianca=0.9):
+    return {'id': 1, 'categoria': categoria, 'pergunta': "Quanto custa a consulta?",
+            'resposta': "[nome], a consulta custa R$ 200.", 'pontuacao': 3.0, 'confianca': confianca}
+
+def test_resposta_direta_exige_categoria_habilitada(contexto, monkeypatch):
+    assert conhecimento.resposta_direta([_item()], "Ana") is None
+
+    monkeypatch.setenv('KB_RESPOSTA_DIRETA_CATEGORIAS', 'Precos, horarios')
+
+    assert conhecimento.resposta_direta([_item()], "Ana")['resposta'] == "Ana, a consulta custa R$ 200."
+    assert conhecimento.resposta_direta([_item('servicos')], "Ana") is None
+
+def test_resposta_direta_exige_confianca(contexto, monkeypatch):
+    monkeypatch.setenv('KB_RESPOSTA_DIRETA_CATEGORIAS', 'precos')
+
+    assert conhecimento.resposta_direta([_item(confianca=0.79)], "Ana") is None
+    assert conhecimento.resposta_direta([], "Ana") is None
+
+def test_pergunta_de_rotina_e_respondida_sem_a_ia(recuperador, monkeypatch):
+    import ai_agent
+    from models import Lead
+    monkeypatch.setenv('KB_RESPOSTA_DIRETA_CATEGORIAS', 'precos')
+    monkeypatch.setenv('IA_CACHE_RESPOSTAS', 'false')
+    monkeypatch.setattr(ai_agent, 'recuperador_conhecimento', recuperador)
+    monkeypatch.setattr(ai_agent, 'buscar_conhecimento', recuperador.buscar)
+    monkeypatch.setattr(ai_agent, '_chamar_chat', lambda *args, **kwargs: pytest.fail("a IA foi chamada"))
+    lead = Lead(nome="Ana", telefone="5511999990000")
+    db.session.add(lead)
+    db.session.commit()
+
+    assert ai_agent.processar_mensagem(lead.id, "quanto custa a consulta?") == "A consulta custa R$ 200."
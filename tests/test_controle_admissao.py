@@ -0,0 +1,96 @@
+"""Controle de admissão: limite de chamadas simultâneas, respostas adiadas e fila de adiadas cheia"""
+import pytest
+import metricas
+import whatsapp_integration
+from app import db
+from controle_admissao import ControleAdmissao
+from models import Interacao
+from whatsapp_flows import get_mensagem_espera
+from whatsapp_integration import MENSAGEM_PROBLEMA_TECNICO, gerar_resposta_whatsapp, registrar_mensagem_recebida
+
+NUMERO = 'whatsapp:+5511999990000'
+
+@pytest.fixture
+def controle(monkeypatch):
+    """Controle de admissão novo, com uma única vaga; as adiadas são respondidas pelo teste"""
+    monkeypatch.setenv('IA_MAX_EM_ANDAMENTO', '1')
+    novo = ControleAdmissao()
+    monkeypatch.setattr(novo, '_iniciar_thread', lambda: None)
+    monkeypatch.setattr(whatsapp_integration, 'controle_admissao', novo)
+    return novo
+
+@pytest.fixture
+def lead(contexto):
+    """Lead que já conversou com a IA"""
+    lead, _ = registrar_mensagem_recebida(NUMERO, "oi")
+    db.session.add(Interacao(lead_id=lead.id, mensagem="Olá! Como posso ajudar?", origem="ia"))
+    db.session.commit()
+    return lead
+
+def test_admite_ate_o_limite_de_chamadas_simultaneas(controle, contexto):
+    inicio = controle.admitir(1)
+
+    assert inicio is not None
+    assert controle.admitir(2) is None
+    controle.liberar(inicio)
+    assert controle.em_andamento == 0
+    assert controle.admitir(2) is not None
+
+def test_lead_com_resposta_adiada_nao_e_admitido(controle, contexto):
+    assert controle.adiar(1, "oi", lambda lead_id, texto: None)
+
+    assert controle.admitir(1) is None
+    assert controle.admitir(2) is not None
+
+def test_adiadas_do_mesmo_lead_sao_unidas(controle, contexto):
+    assert controle.adiar(1, "oi", lambda lead_id, texto: None)
+    assert controle.adiar(1, "tudo bem?", lambda lead_id, texto: None)
+
+    assert list(controle._adiadas) == [1]
+    assert controle._adiadas[1][0] == ["oi", "tudo bem?"]
+
+def test_rejeitada_recebe_a_mensagem_de_espera(controle, lead):
+    controle.em_andamento = 1
+
+    resposta = gerar_resposta_whatsapp(lead, "quanto custa o plano")
+
+    assert resposta == get_mensagem_espera(lead.nome)
+    assert lead.id in controle._adiadas
+    ultima = Interacao.query.order_by(Interacao.id.desc()).first()
+    assert (ultima.mensagem, ultima.origem) == (resposta, "sistema")
+
+def test_fila_de_adiadas_cheia_responde_problema_tecnico(controle, lead, monkeypatch):
+    monkeypatch.setenv('IA_MAX_FILA_ADIADA', '0')
+    controle.em_andamento = 1
+    descartadas = metricas.obter_contador('ia_mensagens_adiadas_descartadas')
+
+    resposta = gerar_resposta_whatsapp(lead, "quanto custa o plano")
+
+    # Sem lugar na fila, nenhuma resposta virá depois: o lead não recebe a mensagem de espera
+    assert resposta == MENSAGEM_PROBLEMA_TECNICO
+    assert not controle._adiadas
+    assert metricas.obter_contador('ia_mensagens_adiadas_descartadas') == descartadas + 1
+    assert controle.estatisticas()['adiadas_descartadas'] == descartadas + 1
+    ultima = Interacao.query.order_by(Interacao.id.desc()).first()
+    assert (ultima.mensagem, ultima.origem) == (MENSAGEM_PROBLEMA_TECNICO, "sistema")
+
+def test_resposta_adiada_analisa_todas_as_mensagens_do_turno(controle, lead, whatsapp, monkeypatch):
+    enviadas = []
+    monkeypatch.setattr(whatsapp_integration, 'enviar_mensagem_whatsapp',
+                        lambda numero, mensagem: enviadas.append((numero, mensagem)) or True)
+    controle.em_andamento = 1
+    for texto in ("quanto custa o plano", "e como funciona"):
+        registrar_mensagem_recebida(NUMERO, texto)
+        assert gerar_resposta_whatsapp(lead, texto) == get_mensagem_espera(lead.nome)
+
+    # A thread das adiadas responde as duas mensagens juntas
+    lead_id, (textos, funcao) = controle._adiadas.popitem(last=False)
+    assert funcao(lead_id, whatsapp_integration.unir_mensagens(textos))
+
+    assert [numero for numero, _ in enviadas] == [lead.telefone]
+    turno = Interacao.query.filter(Interacao.mensagem.in_(textos)).all()
+    # As mensagens de espera (origem "sistema") não encerram o turno analisado
+    assert len(turno) == 2
+    assert all(interacao.sentimento is not None for interacao in turno)
+    # A mensagem "oi", já respondida pela IA, não faz parte do turno
+    assert Interacao.query.filter_by(mensagem="oi").one().sentimento is None
@@ -0,0 +1,98 @@
+"""Disjuntor do cliente de IA: abertura, chamada de teste (meio aberto) e liberação do teste"""
+import asyncio
+import pytest
+import cliente_ia
+from cliente_ia import DisjuntorCircuito, ErroCircuitoAberto
+from concorrencia_ia import ErroConcorrenciaEsgotada
+from provedores_ia import ProvedorSimulado, ErroProvedorSimulado
+
+PARAMETROS = {'model': 'gpt-4o-mini', 'messages': [{'role': 'user', 'content': 'oi'}]}
+
+@pytest.fixture
+def disjuntor(monkeypatch):
+    """Disjuntor novo, que abre na primeira falha e libera o teste sem espera"""
+    novo = DisjuntorCircuito()
+    monkeypatch.setattr(cliente_ia, 'disjuntor', novo)
+    monkeypatch.setenv('IA_DISJUNTOR_FALHAS', '1')
+    monkeypatch.setenv('IA_DISJUNTOR_ESPERA', '0')
+    monkeypatch.setenv('IA_TENTATIVAS', '1')
+    return novo
+
+@pytest.fixture
+def provedor(monkeypatch):
+    monkeypatch.setenv('IA_SIMULADO_LATENCIA', 'fixa')
+    return ProvedorSimulado()
+
+def _abrir(disjuntor, provedor, monkeypatch):
+    monkeypatch.setenv('IA_SIMULADO_TAXA_ERRO', '1')
+    with pytest.raises(ErroProvedorSimulado):
+        cliente_ia.chamar(provedor.criar_chat, 'teste', PARAMETROS)
+    monkeypatch.setenv('IA_SIMULADO_TAXA_ERRO', '0')
+    assert disjuntor.estado == DisjuntorCircuito.ABERTO
+
+def test_aberto_rejeita_sem_chamar_o_provedor(disjuntor, provedor, monkeypatch):
+    _abrir(disjuntor, provedor, monkeypatch)
+    monkeypatch.setenv('IA_DISJUNTOR_ESPERA', '60')
+
+    def nao_chamar(**parametros):
+        raise AssertionError("o provedor não deveria ser chamado")
+
+    with pytest.raises(ErroCircuitoAberto):
+        cliente_ia.chamar(nao_chamar, 'teste', PARAMETROS)
+
+def test_meio_aberto_admite_uma_unica_chamada_de_teste(disjuntor, provedor, monkeypatch):
+    _abrir(disjuntor, provedor, monkeypatch)
+
+    assert disjuntor.admitir() is True
+    assert disjuntor.estado == DisjuntorCircuito.MEIO_ABERTO
+    assert disjuntor.admitir() is None
+
+def test_teste_bem_sucedido_fecha(disjuntor, provedor, monkeypatch):
+    _abrir(disjuntor, provedor, monkeypatch)
+
+    resposta = cliente_ia.chamar(provedor.criar_chat, 'teste', PARAMETROS)
+
+    assert resposta.choices[0].message.content
+    assert disjuntor.estado == DisjuntorCircuito.FECHADO
+    assert disjuntor.admitir() is False
+
+def test_teste_com_falha_reabre(disjuntor, provedor, monkeypatch):
+    _abrir(disjuntor, provedor, monkeypatch)
+    aberturas = disjuntor.aberturas
+
+    monkeypatch.setenv('IA_SIMULADO_TAXA_ERRO', '1')
+    with pytest.raises(ErroProvedorSimulado):
+        cliente_ia.chamar(provedor.criar_chat, 'teste', PARAMETROS)
+
+    assert disjuntor.estado == DisjuntorCircuito.ABERTO
+    assert disjuntor.aberturas == aberturas + 1
+
+def test_teste_sem_vaga_de_concorrencia_e_liberado(disjuntor, provedor, monkeypatch):
+    _abrir(disjuntor, provedor, monkeypatch)
+
+    def sem_vaga(prazo_final):
+        raise ErroConcorrenciaEsgotada("sem vaga")
+
+    monkeypatch.setattr(cliente_ia.limite_concorrencia, 'adquirir', sem_vaga)
+    with pytest.raises(ErroConcorrenciaEsgotada):
+        cliente_ia.chamar(provedor.criar_chat, 'teste', PARAMETROS)
+
+    # O provedor não respondeu: o estado não muda e outra chamada pode testá-lo
+    assert disjuntor.estado == DisjuntorCircuito.MEIO_ABERTO
+    assert disjuntor.admitir() is True
+
+def test_teste_cancelado_e_liberado(disjuntor, provedor, monkeypatch):
+    _abrir(disjuntor, provedor, monkeypatch)
+    monkeypatch.setenv('IA_SIMULADO_LATENCIA_MS', '5000')
+
+    async def cancelar_chamada():
+        tarefa = asyncio.ensure_future(cliente_ia.chamar_async(provedor.criar_chat_async, 'teste', PARAMETROS))
+        await asyncio.sleep(0.05)
+        tarefa.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await tarefa
+
+    asyncio.run(cancelar_chamada())
+
+    assert disjuntor.estado == DisjuntorCircuito.MEIO_ABERTO
+    assert disjuntor.admitir() is True
@@ -0,0 +1,72 @@
+"""Idempotência do webhook pelo MessageSid: reenvios da Twilio não processam a mensagem de novo"""
+import pytest
+import idempotencia
+import whatsapp_routes
+from app import app
+from cache_lru import CacheLRU
+from idempotencia import liberar_mensagem, registrar_resposta, reservar_mensagem
+from models import MensagemProcessada
+
+@pytest.fixture
+def cache(contexto, monkeypatch):
+    """Cache de MessageSids vazio, restaurado ao fim do teste"""
+    novo = CacheLRU(tamanho_maximo=100, ttl=None)
+    monkeypatch.setattr(idempotencia, '_cache', novo)
+    return novo
+
+@pytest.fixture
+def processadas(cache, monkeypatch):
+    """Substitui o processamento do webhook; retorna as mensagens processadas"""
+    mensagens = []
+    monkeypatch.setattr(whatsapp_routes, 'processar_mensagem_whatsapp',
+                        lambda numero, texto: mensagens.append(texto) or f"Resposta para {texto}")
+    return mensagens
+
+def _webhook(message_sid, texto="oi"):
+    with app.test_client() as cliente:
+        resposta = cliente.post('/webhook/whatsapp', data={
+            'From': 'whatsapp:+5511999990000', 'Body': texto, 'MessageSid': message_sid})
+    assert resposta.status_code == 200
+    return resposta.get_data(as_text=True)
+
+def test_reenvio_recebe_a_resposta_armazenada(processadas):
+    primeira = _webhook('SM1')
+    reenvio = _webhook('SM1')
+
+    assert processadas == ["oi"]
+    assert "Resposta para oi" in primeira
+    assert reenvio == primeira
+
+def test_mensagens_diferentes_sao_processadas(processadas):
+    _webhook('SM1', "oi")
+    _webhook('SM2', "oi")
+
+    assert processadas == ["oi", "oi"]
+
+def test_reenvio_durante_o_processamento(cache):
+    assert reservar_mensagem('SM1') == (False, None)
+
+    # Sem resposta pronta, o reenvio só é confirmado e a resposta segue pela API REST
+    assert reservar_mensagem('SM1') == (True, None)
+    assert MensagemProcessada.query.get('SM1').reentregue
+    assert registrar_resposta('SM1', "Olá!") is True
+    assert reservar_mensagem('SM1') == (True, '')
+
+def test_duplicada_e_detectada_pelo_banco_sem_o_cache(cache):
+    reservar_mensagem('SM1')
+    registrar_resposta('SM1', "Olá!")
+    cache.limpar()
+
+    assert reservar_mensagem('SM1') == (True, "Olá!")
+
+def test_mensagem_liberada_pode_ser_processada_de_novo(cache):
+    reservar_mensagem('SM1')
+
+    liberar_mensagem('SM1')
+
+    assert MensagemProcessada.query.get('SM1') is None
+    assert reservar_mensagem('SM1') == (False, None)
+
+def test_sem_message_sid_nao_ha_deduplicacao(cache):
+    assert reservar_mensagem(None) == (False, None)
+    assert reservar_mensagem(None) == (False, None)
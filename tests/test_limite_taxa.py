@@ -0,0 +1,128 @@
+"""Limite de requisições e tokens por minuto: baldes, prioridades e cobrança das requisições extras"""
+import time
+import pytest
+import cliente_ia
+import metricas
+from app import db
+from cliente_ia import DisjuntorCircuito, OrcamentoHedge
+from limite_taxa import ErroLimiteTaxa, adquirir, cobranca, tentar_adquirir
+from models import LimiteTaxa
+from provedores_ia import ErroProvedorSimulado
+
+PARAMETROS = {'model': 'gpt-4o-mini', 'messages': [{'role': 'user', 'content': 'oi'}]}
+
+@pytest.fixture
+def limite(contexto, monkeypatch):
+    """Dez requisições por minuto, sem espera: quem não tem fichas é rejeitado na hora"""
+    monkeypatch.setenv('IA_LIMITE_RPM', '10')
+    monkeypatch.setenv('IA_LIMITE_ESPERA_MAXIMA_ALTA', '0')
+    monkeypatch.setenv('IA_LIMITE_ESPERA_MAXIMA_BAIXA', '0')
+
+def _requisicoes_disponiveis():
+    db.session.expire_all()
+    return LimiteTaxa.query.get('openai').requisicoes
+
+def test_rejeita_quando_o_balde_esvazia(limite):
+    for _ in range(10):
+        adquirir('resposta', 100)
+
+    with pytest.raises(ErroLimiteTaxa):
+        adquirir('resposta', 100)
+    assert tentar_adquirir('resposta', 100) is False
+
+def test_segundo_plano_nao_usa_a_reserva(limite):
+    # Com a reserva padrão de 20%, lembretes e resumos param com 2 fichas restantes
+    for _ in range(8):
+        adquirir('resumo', 100)
+    with pytest.raises(ErroLimiteTaxa):
+        adquirir('resumo', 100)
+
+    adquirir('resposta', 100)
+    adquirir('resposta', 100)
+    assert _requisicoes_disponiveis() < 1
+
+def test_limite_de_tokens_por_minuto(limite, monkeypatch):
+    monkeypatch.setenv('IA_LIMITE_RPM', '0')
+    monkeypatch.setenv('IA_LIMITE_TPM', '1000')
+
+    adquirir('resposta', 600)
+
+    with pytest.raises(ErroLimiteTaxa):
+        adquirir('resposta', 600)
+    adquirir('resposta', 300)
+
+@pytest.fixture
+def cliente(monkeypatch):
+    """Disjuntor e orçamento de hedging novos, repetições sem espera"""
+    monkeypatch.setattr(cliente_ia, 'disjuntor', DisjuntorCircuito())
+    monkeypatch.setattr(cliente_ia, 'orcamento_hedge', OrcamentoHedge())
+    monkeypatch.setenv('IA_TENTATIVAS', '3')
+    monkeypatch.setenv('IA_ESPERA_BASE', '0')
+
+def test_repeticoes_sao_cobradas(limite, cliente):
+    falhas = [ErroProvedorSimulado("falha"), ErroProvedorSimulado("falha")]
+
+    def criar_chat(**parametros):
+        if falhas:
+            raise falhas.pop()
+        return 'ok'
+
+    cobrar = cobranca('resposta', 100)
+    cobrar()
+    assert cliente_ia.chamar(criar_chat, 'resposta', PARAMETROS, cobrar=cobrar) == 'ok'
+
+    # A primeira tentativa e as duas repetições saíram do balde
+    assert _requisicoes_disponiveis() == pytest.approx(7, abs=0.1)
+
+def test_repeticao_sem_fichas_nao_chega_ao_provedor(limite, cliente):
+    chamadas = []
+
+    def criar_chat(**parametros):
+        chamadas.append(parametros)
+        raise ErroProvedorSimulado("falha")
+
+    for _ in range(9):
+        adquirir('resposta', 100)
+    cobrar = cobranca('resposta', 100)
+    cobrar()
+
+    with pytest.raises(ErroLimiteTaxa):
+        cliente_ia.chamar(criar_chat, 'resposta', PARAMETROS, cobrar=cobrar)
+    assert len(chamadas) == 1
+
+@pytest.fixture
+def hedge(cliente, monkeypatch):
+    """Duplica as respostas que passarem de 50 ms, com orçamento para todas"""
+    monkeypatch.setenv('IA_HEDGE', 'true')
+    monkeypatch.setenv('IA_HEDGE_ATRASO_PADRAO', '0.05')
+    monkeypatch.setenv('IA_HEDGE_TAXA_MAXIMA', '1')
+
+def _criar_chat_lento(chamadas):
+    def criar_chat(**parametros):
+        chamadas.append(parametros)
+        time.sleep(0.3 if len(chamadas) == 1 else 0.0)
+        return 'ok'
+    return criar_chat
+
+def test_duplicada_e_cobrada(limite, hedge):
+    chamadas = []
+    cobrar = cobranca('resposta', 100)
+    cobrar()
+
+    assert cliente_ia.chamar(_criar_chat_lento(chamadas), 'resposta', PARAMETROS, cobrar=cobrar) == 'ok'
+
+    assert len(chamadas) == 2
+    assert _requisicoes_disponiveis() == pytest.approx(8, abs=0.1)
+
+def test_sem_fichas_a_chamada_nao_e_duplicada(limite, hedge):
+    chamadas = []
+    sem_fichas = metricas.obter_contador('ia_hedge_sem_limite_taxa')
+    for _ in range(9):
+        adquirir('resposta', 100)
+    cobrar = cobranca('resposta', 100)
+    cobrar()
+
+    assert cliente_ia.chamar(_criar_chat_lento(chamadas), 'resposta', PARAMETROS, cobrar=cobrar) == 'ok'
+
+    assert len(chamadas) == 1
+    assert metricas.obter_contador('ia_hedge_sem_limite_taxa') == sem_fichas + 1
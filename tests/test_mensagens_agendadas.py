@@ -0,0 +1,192 @@
+"""Entrega dos lotes de mensagens agendadas: itens que deixaram de ser devidos são descartados"""
+from datetime import datetime, timedelta
+import pytest
+import mensagens_agendadas
+from ai_agent import lembrete_formulario_padrao, reativacao_padrao
+from app import db
+from models import Lead, Formulario, Interacao, LoteIA, ItemLoteIA
+
+@pytest.fixture(autouse=True)
+def configuracao(monkeypatch):
+    # Lembretes e reativações gerados pela Batch API do provedor simulado, prontos na hora
+    monkeypatch.setenv('IA_LEMBRETE_PERSONALIZADO', 'true')
+    monkeypatch.setenv('IA_LEMBRETE_VARIANTES', 'false')
+    monkeypatch.setenv('IA_SIMULADO_LOTE_SEGUNDOS', '0')
+    monkeypatch.setenv('IA_REGISTRO_CHAMADAS', 'false')
+
+@pytest.fixture
+def leads(contexto):
+    """Um lead com formulário pendente e outro inativo, ambos devidos há dias"""
+    antigo = datetime.utcnow() - timedelta(days=10)
+    com_formulario = Lead(nome="Ana", telefone="5511999990001", status='em_contato')
+    inativo = Lead(nome="Bia", telefone="5511999990002", status='em_contato')
+    db.session.add_all([com_formulario, inativo])
+    db.session.commit()
+    db.session.add(Formulario(lead_id=com_formulario.id, tipo='anamnese_nutricional',
+                              link='https://exemplo.com/f/1', data_envio=antigo))
+    db.session.add_all([Interacao(lead_id=lead.id, mensagem="oi", origem="usuario", data_hora=antigo)
+                        for lead in (com_formulario, inativo)])
+    db.session.commit()
+    return com_formulario, inativo
+
+def _coletar_e_entregar(alterar=None):
+    """Coleta os itens, aplica as alterações enquanto o lote é processado e entrega o lote"""
+    assert mensagens_agendadas.coletar_mensagens_agendadas() == 2
+    assert LoteIA.query.one().status == mensagens_agendadas.STATUS_EM_ANDAMENTO
+    if alterar is not None:
+        alterar()
+        db.session.commit()
+    assert mensagens_agendadas.processar_lotes_pendentes() == 1
+    return {item.tipo: item for item in ItemLoteIA.query.all()}
+
+def test_entrega_os_itens_ainda_devidos(leads, whatsapp):
+    com_formulario, inativo = leads
+
+    itens = _coletar_e_entregar()
+
+    assert {tipo: item.status for tipo, item in itens.items()} == {'lembrete': 'enviado', 'reativacao': 'enviado'}
+    assert all(item.texto.startswith("Olá! Esta é uma resposta simulada") for item in itens.values())
+    assert sorted(numero for numero, _ in whatsapp) == sorted([com_formulario.telefone, inativo.telefone])
+    lote = LoteIA.query.one()
+    assert lote.status == mensagens_agendadas.STATUS_CONCLUIDO
+    assert lote.concluido_em is not None
+
+def test_descarta_lembrete_de_formulario_respondido(leads, whatsapp):
+    com_formulario, _ = leads
+
+    def responder():
+        Formulario.query.filter_by(lead_id=com_formulario.id).one().status = 'respondido'
+
+    itens = _coletar_e_entregar(responder)
+
+    assert itens['lembrete'].status == 'descartado'
+    assert itens['reativacao'].status == 'enviado'
+    assert com_formulario.telefone not in [numero for numero, _ in whatsapp]
+
+def test_descarta_lembrete_ja_enviado(leads, whatsapp):
+    com_formulario, _ = leads
+
+    def lembrar():
+        Formulario.query.filter_by(lead_id=com_formulario.id).one().lembrete_enviado = True
+
+    itens = _coletar_e_entregar(lembrar)
+
+    assert itens['lembrete'].status == 'descartado'
+    assert len(whatsapp) == 1
+
+def test_descarta_reativacao_de_lead_que_respondeu(leads, whatsapp):
+    _, inativo = leads
+
+    def responder():
+        db.session.add(Interacao(lead_id=inativo.id, mensagem="voltei", origem="usuario"))
+
+    itens = _coletar_e_entregar(responder)
+
+    assert itens['reativacao'].status == 'descartado'
+    assert itens['lembrete'].status == 'enviado'
+    assert inativo.telefone not in [numero for numero, _ in whatsapp]
+
+def test_descarta_reativacao_apos_mensagem_do_sistema(leads, whatsapp):
+    _, inativo = leads
+
+    def notificar():
+        db.session.add(Interacao(lead_id=inativo.id, mensagem="Lembrete", origem="sistema",
+                                 data_hora=datetime.utcnow() - timedelta(days=9)))
+
+    itens = _coletar_e_entregar(notificar)
+
+    assert itens['reativacao'].status == 'descartado'
+
+def test_descarta_reativacao_de_lead_convertido(leads, whatsapp):
+    _, inativo = leads
+
+    def converter():
+        Lead.query.get(inativo.id).status = 'convertido'
+
+    itens = _coletar_e_entregar(converter)
+
+    assert itens['reativacao'].status == 'descartado'
+
+def test_descarta_itens_de_lead_removido(leads, whatsapp):
+    com_formulario, inativo = leads
+
+    def remover():
+        Lead.query.filter(Lead.id.in_([com_formulario.id, inativo.id])).delete(synchronize_session=False)
+
+    itens = _coletar_e_entregar(remover)
+
+    assert {item.status for item in itens.values()} == {'descartado'}
+    assert whatsapp == []
+
+def test_lote_com_falhas_usa_os_textos_padrao(leads, whatsapp, monkeypatch):
+    com_formulario, inativo = leads
+
+    itens = _coletar_e_entregar(lambda: monkeypatch.setenv('IA_SIMULADO_TAXA_ERRO', '1'))
+
+    assert itens['lembrete'].status == 'enviado'
+    assert itens['lembrete'].texto == lembrete_formulario_padrao(com_formulario.nome, 'anamnese_nutricional')
+    assert itens['reativacao'].status == 'enviado'
+    assert itens['reativacao'].texto == reativacao_padrao(inativo.nome)
+
+def test_falha_no_envio_marca_o_item(leads, monkeypatch):
+    import notification
+    monkeypatch.setattr(notification, 'enviar_notificacao_whatsapp', lambda numero, mensagem: False)
+
+    itens = _coletar_e_entregar()
+
+    assert {item.status for item in itens.values()} == {'falhou'}
+
+def test_lembrete_usa_o_link_do_proprio_formulario(leads, whatsapp):
+    com_formulario, _ = leads
+    db.session.add(Formulario(lead_id=com_formulario.id, tipo='anamnese_nutricional',
+                              link='https://exemplo.com/f/2', data_envio=datetime.utcnow() - timedelta(days=5)))
+    db.session.commit()
+
+    assert mensagens_agendadas.coletar_mensagens_agendadas() == 3
+    mensagens_agendadas.processar_lotes_pendentes()
+
+    lembretes = sorted(mensagem for numero, mensagem in whatsapp if numero == com_formulario.telefone)
+    assert len(lembretes) == 2
+    assert lembretes[0].endswith('https://exemplo.com/f/1')
+    assert lembretes[1].endswith('https://exemplo.com/f/2')
+    assert {formulario.numero_lembretes for formulario in Formulario.query.all()} == {1}
+
+def test_lembrete_sem_personalizacao_usa_o_texto_fixo(leads, whatsapp, monkeypatch):
+    com_formulario, _ = leads
+    monkeypatch.setenv('IA_LEMBRETE_PERSONALIZADO', 'false')
+
+    itens = _coletar_e_entregar()
+
+    assert itens['lembrete'].status == 'enviado'
+    lembrete = next(mensagem for numero, mensagem in whatsapp if numero == com_formulario.telefone)
+    assert lembrete.startswith(f"Olá {com_formulario.nome}, \n\nNotamos que você ainda não preencheu")
+    assert 'https://exemplo.com/f/1' in lembrete
+
+def test_coleta_nao_gera_variantes(leads, whatsapp, monkeypatch):
+    import ai_agent
+    import variantes_lembrete
+    from cache_lru import CacheLRU
+    com_formulario, _ = leads
+    monkeypatch.setenv('IA_LEMBRETE_VARIANTES', 'true')
+    monkeypatch.setattr(variantes_lembrete, '_cache', CacheLRU(tamanho_maximo=200, ttl=60))
+    geradas = []
+    gerar_original = ai_agent.gerar_variantes_lembrete
+    monkeypatch.setattr(ai_agent, 'gerar_variantes_lembrete',
+                        lambda tipo, quantidade: geradas.append(tipo) or gerar_original(tipo, quantidade))
+
+    # Sem variantes, o lembrete do dia é gerado no lote, sem chamada síncrona à IA
+    itens = _coletar_e_entregar()
+    assert geradas == []
+    assert itens['lembrete'].texto.startswith("Olá! Esta é uma resposta simulada")
+
+    # A tarefa das variantes as gera fora da coleta; as próximas coletas as usam
+    assert mensagens_agendadas.atualizar_variantes_pendentes() == 1
+    assert geradas == ['anamnese_nutricional']
+    formulario = Formulario(lead_id=com_formulario.id, tipo='anamnese_nutricional',
+                            link='https://exemplo.com/f/2', data_envio=datetime.utcnow() - timedelta(days=5))
+    db.session.add(formulario)
+    db.session.commit()
+
+    assert mensagens_agendadas.coletar_mensagens_agendadas() == 1
+    variante = ItemLoteIA.query.filter(ItemLoteIA.custom_id.startswith(f"lembrete-{formulario.id}-")).one()
+    assert variante.texto.startswith(f"Olá {com_formulario.nome}, este é o lembrete simulado")
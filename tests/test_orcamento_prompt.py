@@ -0,0 +1,85 @@
+"""Orçamento de tokens do prompt: truncamento, itens da base, histórico e ordem das seções"""
+from orcamento_prompt import (MARCADOR_TRUNCADO, TOKENS_POR_MENSAGEM, ORCAMENTOS_PADRAO, ajustar_historico,
+                              ajustar_itens, contar_tokens, montar_prompt, truncar_texto)
+
+TEXTO = " ".join(f"palavra{numero}" for numero in range(200))
+
+def _turno(papel, conteudo):
+    return {'role': papel, 'content': conteudo}
+
+def test_truncar_texto_respeita_o_limite():
+    assert truncar_texto("texto curto", 50) == "texto curto"
+    assert truncar_texto(TEXTO, 0) == ''
+
+    inicio = truncar_texto(TEXTO, 40)
+    final = truncar_texto(TEXTO, 40, manter_final=True)
+
+    assert inicio.startswith("palavra0 ") and inicio.endswith(MARCADOR_TRUNCADO)
+    assert final.startswith(MARCADOR_TRUNCADO) and final.endswith("palavra199")
+    assert contar_tokens(inicio) <= 41 and contar_tokens(final) <= 41
+
+def test_itens_menos_relevantes_saem_primeiro():
+    itens = ["a" * 400, "b" * 400, "c" * 400]
+
+    def formatar(selecionados):
+        return "\n".join(selecionados)
+
+    texto, incluidos = ajustar_itens(itens, formatar, contar_tokens(formatar(itens[:2])))
+
+    assert incluidos == 2
+    assert texto == formatar(itens[:2])
+    assert ajustar_itens(itens, formatar, 1) == ('', 0)
+
+def test_historico_mantem_os_turnos_mais_recentes():
+    historico = [_turno('user', TEXTO), _turno('assistant', "resposta antiga"),
+                 _turno('user', "pergunta recente"), _turno('assistant', "resposta recente")]
+    recentes = sum(contar_tokens(turno['content']) + TOKENS_POR_MENSAGEM for turno in historico[1:])
+
+    # Sem espaço para o turno longo, ele sai inteiro
+    assert ajustar_historico(historico, recentes + 10) == historico[1:]
+
+    # Com espaço suficiente, o turno mais antigo que não cabe é truncado pelo início
+    turnos = ajustar_historico(historico, recentes + 60)
+    assert turnos[1:] == historico[1:]
+    assert turnos[0]['content'].startswith(MARCADOR_TRUNCADO)
+    assert turnos[0]['content'].endswith("palavra199")
+
+def test_historico_consolida_mensagens_repetidas():
+    historico = [_turno('user', "oi"), _turno('user', "oi"), _turno('user', ""), _turno('assistant', "olá")]
+
+    assert ajustar_historico(historico, 1000) == [_turno('user', "oi"), _turno('assistant', "olá")]
+
+def test_secoes_vao_da_mais_estavel_para_a_mais_variavel():
+    mensagens, relatorio = montar_prompt("Instruções", "Trechos da base", [_turno('assistant', "Olá!")],
+                                         "quanto custa?", dict(ORCAMENTOS_PADRAO),
+                                         resumo="Resumo", contexto="Você está conversando com Ana.")
+
+    assert mensagens == [
+        _turno('system', "Instruções"),
+        _turno('system', "Você está conversando com Ana.\n\nResumo"),
+        _turno('assistant', "Olá!"),
+        _turno('system', "Trechos da base"),
+        _turno('user', "quanto custa?"),
+    ]
+    assert relatorio['turnos'] == 1
+    assert relatorio['prefixo'] == contar_tokens("Instruções") + TOKENS_POR_MENSAGEM
+
+def test_secoes_acima_do_orcamento_sao_reduzidas():
+    orcamentos = dict(ORCAMENTOS_PADRAO, conhecimento=20, mensagem=20, historico=0)
+
+    mensagens, relatorio = montar_prompt("Instruções", TEXTO, [_turno('assistant', "Olá!")],
+                                         TEXTO, orcamentos, conhecimento_no_prefixo=False)
+
+    assert relatorio['conhecimento'] <= 21
+    assert relatorio['mensagem'] <= 21
+    assert relatorio['turnos_descartados'] == 1
+    # A mensagem atual mantém o final, onde costuma estar a pergunta
+    assert mensagens[-1]['content'].endswith("palavra199")
+
+def test_base_completa_vai_no_prefixo_sem_truncamento():
+    orcamentos = dict(ORCAMENTOS_PADRAO, conhecimento=5)
+
+    mensagens, _ = montar_prompt("Instruções", TEXTO, [], "oi", orcamentos, conhecimento_no_prefixo=True)
+
+    assert mensagens[0]['content'] == f"Instruções\n\n{TEXTO}"
+    assert [mensagem['role'] for mensagem in mensagens] == ['system', 'user']
@@ -0,0 +1,66 @@
+"""Prefixo fixo do prompt: idêntico para todos os leads e turnos até a base de conhecimento mudar"""
+import pytest
+import ai_agent
+import conhecimento
+from app import db
+from conhecimento import RecuperadorConhecimento
+from models import BaseConhecimento, Interacao, Lead, ResumoConversa
+
+@pytest.fixture
+def leads(contexto, monkeypatch):
+    """Dois leads com históricos, resumos e base de conhecimento diferentes entre as mensagens"""
+    monkeypatch.setattr(ai_agent, 'recuperador_conhecimento', RecuperadorConhecimento())
+    monkeypatch.setattr(ai_agent, '_base_prefixo', (None, '', 0))
+    db.session.add_all([
+        BaseConhecimento(categoria='precos', pergunta="Quanto custa a consulta?", resposta="R$ 200."),
+        BaseConhecimento(categoria='servicos', pergunta="Atendem online?", resposta="Sim."),
+    ])
+    ana = Lead(nome="Ana", telefone="5511999990001")
+    bruno = Lead(nome="Bruno", telefone="5511999990002")
+    db.session.add_all([ana, bruno])
+    db.session.commit()
+    db.session.add_all([Interacao(lead_id=ana.id, mensagem="oi", origem="usuario"),
+                        Interacao(lead_id=ana.id, mensagem="Olá, Ana!", origem="ia")])
+    db.session.add(ResumoConversa(lead_id=bruno.id, resumo="Bruno treina para maratona.",
+                                  ultima_interacao_id=0, interacoes_resumidas=4))
+    db.session.commit()
+    conhecimento.invalidar_versao()
+    return ana, bruno
+
+def _montar(lead, mensagem):
+    return ai_agent.montar_mensagens_conversa(lead, mensagem, conhecimento.buscar_conhecimento(mensagem))
+
+def test_prefixo_nao_depende_do_lead_nem_da_mensagem(leads):
+    ana, bruno = leads
+
+    prompts = [_montar(ana, "quanto custa a consulta?"), _montar(bruno, "vocês atendem online?"),
+               _montar(ana, "e para maratona?")]
+
+    prefixos = {mensagens[0]['content'] for mensagens, _ in prompts}
+    assert prefixos == {ai_agent.INSTRUCOES_SISTEMA}
+    assert len({relatorio['versao_prefixo'] for _, relatorio in prompts}) == 1
+    # Os dados do lead vêm depois do prefixo
+    mensagens, _ = prompts[1]
+    assert "Bruno" in mensagens[1]['content'] and "maratona" in mensagens[1]['content']
+
+def test_base_completa_no_prefixo_muda_apenas_com_a_base(leads, monkeypatch):
+    ana, bruno = leads
+    monkeypatch.setenv('KB_PREFIXO_BASE_COMPLETA', 'true')
+
+    mensagens_ana, relatorio_ana = _montar(ana, "quanto custa a consulta?")
+    mensagens_bruno, relatorio_bruno = _montar(bruno, "oi")
+
+    assert mensagens_ana[0] == mensagens_bruno[0]
+    assert relatorio_ana['versao_prefixo'] == relatorio_bruno['versao_prefixo']
+    prefixo = mensagens_ana[0]['content']
+    assert prefixo.startswith(ai_agent.INSTRUCOES_SISTEMA)
+    assert prefixo.index("Quanto custa a consulta?") < prefixo.index("Atendem online?")
+    assert "Ana" not in prefixo and "Bruno" not in prefixo
+
+    db.session.add(BaseConhecimento(categoria='pagamento', pergunta="Aceitam pix?", resposta="Sim."))
+    db.session.commit()
+    conhecimento.invalidar_versao()
+
+    mensagens, relatorio = _montar(ana, "quanto custa a consulta?")
+    assert "Aceitam pix?" in mensagens[0]['content']
+    assert relatorio['versao_prefixo'] != relatorio_ana['versao_prefixo']
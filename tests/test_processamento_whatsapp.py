@@ -0,0 +1,60 @@
+"""Webhook síncrono do WhatsApp: grupos respondidos pela API REST e tempo máximo de resposta"""
+import threading
+import time
+import pytest
+import whatsapp_integration
+from whatsapp_integration import MENSAGEM_PROBLEMA_TECNICO, processar_mensagem_whatsapp, registrar_mensagem_recebida
+
+NUMERO = 'whatsapp:+5511999990000'
+
+@pytest.fixture
+def enviadas(contexto, monkeypatch):
+    """Lead já conhecido; retorna a lista de (número, mensagem) enviados pela API REST"""
+    monkeypatch.setenv('IA_REGISTRO_CHAMADAS', 'false')
+    registrar_mensagem_recebida(NUMERO, "oi")
+    lista = []
+    monkeypatch.setattr(whatsapp_integration, 'enviar_mensagem_whatsapp',
+                        lambda numero, mensagem: lista.append((numero, mensagem)) or True)
+    return lista
+
+def _aguardar(condicao, limite=5.0):
+    fim = time.monotonic() + limite
+    while not condicao() and time.monotonic() < fim:
+        time.sleep(0.02)
+    return condicao()
+
+def test_grupo_e_respondido_pela_api_rest(enviadas, monkeypatch):
+    monkeypatch.setenv('WHATSAPP_JANELA_AGRUPAMENTO', '0.3')
+
+    inicio = time.monotonic()
+    respostas = [processar_mensagem_whatsapp(NUMERO, texto) for texto in ("quero", "emagrecer")]
+
+    # A requisição não espera a janela: o webhook é confirmado sem resposta
+    assert respostas == [None, None]
+    assert time.monotonic() - inicio < 0.3
+    assert _aguardar(lambda: enviadas)
+    time.sleep(0.4)
+    assert len(enviadas) == 1
+    numero, resposta = enviadas[0]
+    assert numero.endswith('5511999990000')
+    assert "quero\nemagrecer" in resposta
+
+def test_resposta_demorada_responde_problema_tecnico(enviadas, monkeypatch):
+    monkeypatch.setenv('WHATSAPP_TEMPO_MAXIMO_RESPOSTA', '0.1')
+    liberar = threading.Event()
+    executadas = []
+
+    def gerar_resposta(lead_id, mensagem_texto, novo_lead):
+        executadas.append(mensagem_texto)
+        liberar.wait(5)
+        return "resposta"
+
+    monkeypatch.setattr(whatsapp_integration, '_gerar_resposta_por_id', gerar_resposta)
+
+    assert processar_mensagem_whatsapp(NUMERO, "primeira") == MENSAGEM_PROBLEMA_TECNICO
+    # A segunda fica na fila atrás da primeira e é cancelada ao expirar
+    assert processar_mensagem_whatsapp(NUMERO, "segunda") == MENSAGEM_PROBLEMA_TECNICO
+    liberar.set()
+
+    time.sleep(0.2)
+    assert executadas == ["primeira"]
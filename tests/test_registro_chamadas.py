@@ -0,0 +1,84 @@
+"""Ledger das chamadas à IA: gravação em lote fora do caminho da resposta e agregados do dashboard"""
+import queue
+from datetime import datetime, timedelta
+import pytest
+import metricas
+import registro_chamadas
+from app import db
+from models import ChamadaIA, Lead
+from registro_chamadas import RESULTADO_ERRO, RESULTADO_SUCESSO, agregados, descarregar, registrar
+
+@pytest.fixture
+def fila(contexto, monkeypatch):
+    """Fila nova de dois registros, sem a thread de gravação: o teste descarrega a fila"""
+    nova = queue.Queue(maxsize=2)
+    monkeypatch.setattr(registro_chamadas, '_fila', nova)
+    monkeypatch.setattr(registro_chamadas, '_thread', object())
+    monkeypatch.setenv('IA_REGISTRO_CHAMADAS', 'true')
+    return nova
+
+def test_registros_sao_gravados_ao_descarregar(fila):
+    registrar('resposta', 'gpt-4o-mini', tokens_entrada=1000, tokens_saida=500, segundos=1.2346)
+
+    assert ChamadaIA.query.count() == 0
+    descarregar()
+
+    chamada = ChamadaIA.query.one()
+    assert (chamada.proposito, chamada.modelo, chamada.latencia_ms) == ('resposta', 'gpt-4o-mini', 1235)
+    assert chamada.custo_usd == pytest.approx((1000 * 0.15 + 500 * 0.60) / 1_000_000)
+
+def test_fila_cheia_descarta_sem_bloquear(fila):
+    descartados = metricas.obter_contador('ia_registro_descartados')
+
+    for _ in range(3):
+        registrar('resposta', 'gpt-4o-mini')
+
+    assert fila.qsize() == 2
+    assert metricas.obter_contador('ia_registro_descartados') == descartados + 1
+
+def test_registro_desativado(fila, monkeypatch):
+    monkeypatch.setenv('IA_REGISTRO_CHAMADAS', 'false')
+
+    registrar('resposta', 'gpt-4o-mini')
+
+    assert fila.qsize() == 0
+
+def _chamada(proposito, latencia_ms, resultado=RESULTADO_SUCESSO, lead_id=None, custo=0.01, dias_atras=0):
+    return ChamadaIA(proposito=proposito, modelo='gpt-4o-mini', lead_id=lead_id, tokens_entrada=100,
+                     tokens_saida=10, custo_usd=custo, latencia_ms=latencia_ms, resultado=resultado,
+                     criado_em=datetime.utcnow() - timedelta(days=dias_atras))
+
+def test_agregados_por_proposito_e_por_dia(contexto):
+    db.session.add_all([_chamada('resposta', latencia) for latencia in range(100, 1100, 100)]
+                       + [_chamada('resposta', 30000, RESULTADO_ERRO),
+                          _chamada('resumo', 50),
+                          _chamada('resumo', 50, dias_atras=10)])
+    db.session.commit()
+
+    resultado = agregados(dias=7)
+
+    resposta, resumo = resultado['por_proposito']
+    assert (resposta['proposito'], resposta['chamadas'], resposta['falhas']) == ('resposta', 11, 1)
+    # A latência das falhas não entra nos percentis
+    assert 500 <= resposta['p50_ms'] <= 600
+    assert 900 <= resposta['p95_ms'] <= 1000
+    assert (resposta['tokens_entrada'], resposta['tokens_saida']) == (1100, 110)
+    assert (resumo['chamadas'], resumo['p50_ms']) == (1, 50)
+    assert resultado['custo_total_usd'] == pytest.approx(0.12)
+    assert [dia['tokens'] for dia in resultado['por_dia']] == [1320]
+
+def test_custo_por_lead_convertido(contexto):
+    convertido = Lead(nome="Ana", telefone="5511999990001", status='convertido')
+    em_contato = Lead(nome="Bia", telefone="5511999990002", status='em_contato')
+    db.session.add_all([convertido, em_contato])
+    db.session.commit()
+    db.session.add_all([_chamada('resposta', 100, lead_id=convertido.id, custo=0.02),
+                        _chamada('resposta', 100, lead_id=convertido.id, custo=0.03, dias_atras=30),
+                        _chamada('resposta', 100, lead_id=em_contato.id, custo=1.0)])
+    db.session.commit()
+
+    # Considera toda a conversa do lead, inclusive as chamadas fora do período
+    assert agregados(dias=7)['custo_por_lead_convertido_usd'] == pytest.approx(0.05)
+
+def test_sem_leads_convertidos(contexto):
+    assert agregados()['custo_por_lead_convertido_usd'] is None
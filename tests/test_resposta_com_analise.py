@@ -0,0 +1,116 @@
+"""Resposta e análise de sentimento na mesma chamada: interpretação do JSON e contingências"""
+import json
+import asyncio
+import pytest
+import ai_agent
+from ai_agent import _interpretar_resposta_com_analise
+from app import db
+from models import Lead
+from provedores_ia import ProvedorSimulado
+from sentimento_lote import analisar_por_lexico
+
+@pytest.fixture
+def lead(contexto):
+    lead = Lead(nome="Ana", telefone="5511999990000")
+    db.session.add(lead)
+    db.session.commit()
+    return lead
+
+@pytest.fixture
+def json_sem_resposta(monkeypatch):
+    """O provedor simulado devolve a análise sem o campo 'resposta' nas chamadas estruturadas"""
+    conteudo_original = ProvedorSimulado._conteudo
+    chamadas = []
+
+    def conteudo(self, parametros):
+        estruturada = (parametros.get('response_format') or {}).get('type') == 'json_object'
+        chamadas.append('json' if estruturada else 'texto')
+        gerado = conteudo_original(self, parametros)
+        if not estruturada:
+            return gerado
+        dados = json.loads(gerado)
+        dados.pop('resposta', None)
+        return json.dumps(dados)
+
+    monkeypatch.setattr(ProvedorSimulado, '_conteudo', conteudo)
+    return chamadas
+
+@pytest.fixture
+def sem_chamadas_ia(monkeypatch):
+    """Falha as chamadas à IA (resposta e análise separada) feitas depois de ativada"""
+    def ativar():
+        def falhar(*args, **kwargs):
+            raise AssertionError("a IA não deveria ser chamada")
+
+        for nome in ('_chamar_chat', '_chamar_chat_async',
+                     'analisar_sentimento_cliente', 'analisar_sentimento_cliente_async'):
+            monkeypatch.setattr(ai_agent, nome, falhar)
+    return ativar
+
+def test_interpretar_json_completo():
+    conteudo = json.dumps({'resposta': ' Olá! ', 'sentimento': 2, 'prob_conversao': 0.4,
+                           'interesse': 0.5, 'urgencia': -1})
+
+    resposta, analise = _interpretar_resposta_com_analise(conteudo)
+
+    assert resposta == "Olá!"
+    # Valores fora dos limites são ajustados
+    assert analise == {'sentimento': 1.0, 'prob_conversao': 0.4, 'interesse': 0.5, 'urgencia': 0.0}
+
+def test_interpretar_campos_invalidos_mantem_a_resposta():
+    resposta, analise = _interpretar_resposta_com_analise(json.dumps({'resposta': 'Olá!', 'sentimento': 'bom'}))
+
+    assert resposta == "Olá!"
+    assert analise is None
+
+@pytest.mark.parametrize('conteudo', [
+    json.dumps({'sentimento': 0.5, 'prob_conversao': 0.5, 'interesse': 0.5, 'urgencia': 0.5}),
+    json.dumps({'resposta': '   '}),
+    json.dumps(['Olá!']),
+    '{"resposta": "Olá! Nosso plano mensal inclui',
+    '',
+    None,
+])
+def test_interpretar_json_sem_resposta(conteudo):
+    assert _interpretar_resposta_com_analise(conteudo) == (None, None)
+
+def test_interpretar_texto_simples():
+    assert _interpretar_resposta_com_analise("Olá! Tudo bem?") == ("Olá! Tudo bem?", None)
+
+def test_json_sem_resposta_gera_a_resposta_em_texto(lead, json_sem_resposta):
+    resposta, analise = ai_agent.processar_mensagem_com_analise(
+        lead.id, "como funciona o acompanhamento para quem treina corrida")
+
+    assert resposta.startswith("Olá! Esta é uma resposta simulada")
+    assert not resposta.lstrip().startswith("{")
+    assert set(analise) == set(ai_agent.CAMPOS_ANALISE)
+    # Resposta estruturada, nova chamada em texto e análise separada
+    assert json_sem_resposta == ['json', 'texto', 'json']
+
+def test_json_sem_resposta_gera_a_resposta_em_texto_async(lead, json_sem_resposta):
+    resposta, analise = asyncio.run(ai_agent.processar_mensagem_com_analise_async(
+        lead.id, "como funciona o acompanhamento para quem treina ciclismo"))
+
+    assert resposta.startswith("Olá! Esta é uma resposta simulada")
+    assert set(analise) == set(ai_agent.CAMPOS_ANALISE)
+    assert json_sem_resposta == ['json', 'texto', 'json']
+
+def test_resposta_do_cache_usa_o_lexico(lead, sem_chamadas_ia):
+    mensagem = "quero contratar o plano de acompanhamento para natacao"
+    ai_agent.processar_mensagem_com_analise(lead.id, mensagem)
+    sem_chamadas_ia()
+
+    resposta, analise = ai_agent.processar_mensagem_com_analise(lead.id, mensagem)
+
+    assert resposta.startswith("Olá! Esta é uma resposta simulada")
+    assert analise == analisar_por_lexico(mensagem)
+
+def test_resposta_do_cache_usa_o_lexico_async(lead, sem_chamadas_ia):
+    mensagem = "quero contratar o plano de acompanhamento para triatlo"
+    asyncio.run(ai_agent.processar_mensagem_com_analise_async(lead.id, mensagem))
+    sem_chamadas_ia()
+
+    resposta, analise = asyncio.run(ai_agent.processar_mensagem_com_analise_async(lead.id, mensagem))
+
+    assert resposta.startswith("Olá! Esta é uma resposta simulada")
+    assert analise == analisar_por_lexico(mensagem)
@@ -0,0 +1,136 @@
+"""Resposta em streaming enviada em partes: divisão do texto, partes entregues e streaming interrompido"""
+import asyncio
+import pytest
+import ai_agent
+import cache_respostas
+import cache_semantico
+from app import db
+from cache_lru import CacheLRU
+from models import Lead
+from partes_resposta import DivisorPartes
+from provedores_ia import ProvedorSimulado
+
+PERGUNTA = "como funciona o acompanhamento nutricional para maratona"
+
+def _transmitir(divisor, texto, tamanho=3):
+    """Entrega o texto ao divisor em trechos pequenos, como no streaming"""
+    partes = []
+    for posicao in range(0, len(texto), tamanho):
+        partes.extend(divisor.adicionar(texto[posicao:posicao + tamanho]))
+    return partes
+
+def test_primeira_parte_sai_no_fim_do_paragrafo():
+    divisor = DivisorPartes(tamanho_primeira=20, tamanho_minimo=50)
+
+    partes = _transmitir(divisor, "Olá, Ana! Que bom falar com você.\n\nO plano inclui")
+
+    assert partes == ["Olá, Ana! Que bom falar com você."]
+    assert divisor.finalizar() == "O plano inclui"
+    assert divisor.finalizar() is None
+    assert divisor.texto_entregue() == "Olá, Ana! Que bom falar com você.\n\nO plano inclui"
+
+def test_primeira_parte_sem_paragrafo_sai_no_fim_da_frase():
+    divisor = DivisorPartes(tamanho_primeira=20, tamanho_minimo=50)
+
+    assert _transmitir(divisor, "Curto. Olá, Ana! Que bom falar com você. O plano inclui") == [
+        "Curto. Olá, Ana! Que bom falar com você."]
+
+def test_nada_e_liberado_antes_do_tamanho_minimo():
+    divisor = DivisorPartes(tamanho_primeira=100, tamanho_minimo=100)
+
+    assert _transmitir(divisor, "Olá!\n\nTudo bem?\n\nClaro.") == []
+    assert divisor.finalizar() == "Olá!\n\nTudo bem?\n\nClaro."
+
+def test_demais_partes_so_cortam_frases_em_paragrafos_longos():
+    divisor = DivisorPartes(tamanho_primeira=10, tamanho_minimo=30)
+    _transmitir(divisor, "Primeira parte.\n\n")
+    frases = "Uma frase qualquer aqui. " * 3
+
+    # Sem fim de parágrafo, a frase só é cortada com o dobro do tamanho mínimo
+    assert _transmitir(divisor, frases[:50]) == []
+    assert _transmitir(divisor, frases[50:]) == ["Uma frase qualquer aqui. Uma frase qualquer aqui."]
+
+@pytest.fixture
+def lead(contexto, monkeypatch, tmp_path):
+    monkeypatch.setenv('IA_RESPOSTA_EM_PARTES', 'true')
+    # A resposta simulada sai em duas partes: o primeiro parágrafo e o restante
+    monkeypatch.setenv('IA_PARTES_TAMANHO_PRIMEIRA', '60')
+    monkeypatch.setenv('IA_CACHE_SEMANTICO', 'true')
+    monkeypatch.setenv('IA_CACHE_SEMANTICO_ARQUIVO', str(tmp_path / 'cache_semantico.npz'))
+    monkeypatch.setenv('IA_REGISTRO_CHAMADAS', 'false')
+    # Caches vazios, restaurados ao fim do teste
+    monkeypatch.setattr(cache_respostas, '_cache', CacheLRU())
+    monkeypatch.setattr(cache_semantico, '_indice', None)
+    lead = Lead(nome="Ana", telefone="5511999990000")
+    db.session.add(lead)
+    db.session.commit()
+    return lead
+
+@pytest.fixture
+def resumos(monkeypatch):
+    agendados = []
+    monkeypatch.setattr(ai_agent, 'agendar_resumo', agendados.append)
+    return agendados
+
+@pytest.fixture
+def streaming_interrompido(monkeypatch):
+    """O streaming do provedor simulado cai logo depois do primeiro parágrafo"""
+    trechos_originais = ProvedorSimulado._trechos
+
+    def trechos(conteudo):
+        for evento in trechos_originais(conteudo):
+            yield evento
+            if '\n\n' in evento.choices[0].delta.content:
+                raise ConnectionError("conexão encerrada pelo provedor")
+
+    monkeypatch.setattr(ProvedorSimulado, '_trechos', staticmethod(trechos))
+
+def _nos_caches(lead):
+    return (cache_respostas.buscar_resposta(PERGUNTA, lead.nome),
+            cache_semantico.buscar_resposta(PERGUNTA, lead.nome))
+
+def test_resposta_completa_entra_nos_caches(lead, resumos):
+    partes = []
+
+    resposta = ai_agent.processar_mensagem(lead.id, PERGUNTA, partes.append)
+
+    assert len(partes) == 2
+    assert resposta == "\n\n".join(partes)
+    assert _nos_caches(lead) == (resposta, resposta)
+    assert resumos == [lead.id]
+
+def test_streaming_interrompido_fica_fora_dos_caches(lead, resumos, streaming_interrompido):
+    partes = []
+
+    resposta = ai_agent.processar_mensagem(lead.id, PERGUNTA, partes.append)
+
+    assert len(partes) == 1
+    assert resposta == partes[0]
+    assert _nos_caches(lead) == (None, None)
+    assert resumos == []
+
+def test_streaming_interrompido_fica_fora_dos_caches_async(lead, resumos, streaming_interrompido):
+    partes = []
+
+    async def enviar(parte):
+        partes.append(parte)
+
+    resposta = asyncio.run(ai_agent.processar_mensagem_async(lead.id, PERGUNTA, enviar))
+
+    assert resposta == partes[0]
+    assert _nos_caches(lead) == (None, None)
+    assert resumos == []
+
+def test_streaming_interrompido_antes_da_primeira_parte(lead, monkeypatch):
+    def trechos(conteudo):
+        raise ConnectionError("conexão encerrada pelo provedor")
+        yield
+
+    monkeypatch.setattr(ProvedorSimulado, '_trechos', staticmethod(trechos))
+    partes = []
+
+    resposta = ai_agent.processar_mensagem(lead.id, PERGUNTA, partes.append)
+
+    assert partes == []
+    assert resposta == ai_agent.MENSAGEM_ERRO_IA
+    assert _nos_caches(lead) == (None, None)
@@ -0,0 +1,75 @@
+"""Resumos de conversa em lote: leads pendentes, falhas contadas por lead e pausa após as tentativas"""
+from datetime import datetime, timedelta
+import pytest
+import ai_agent
+import resumo_conversa
+from app import db
+from models import Interacao, Lead, ResumoConversa, TentativaResumo
+
+@pytest.fixture
+def lead(contexto, monkeypatch):
+    """Lead com duas interações novas, o suficiente para um resumo"""
+    monkeypatch.setenv('IA_RESUMO_A_CADA', '2')
+    monkeypatch.setenv('IA_RESUMO_TENTATIVAS', '2')
+    monkeypatch.setattr(resumo_conversa, '_pendentes', set())
+    monkeypatch.setattr(resumo_conversa, '_thread', object())
+    lead = Lead(nome="Ana", telefone="5511999990000")
+    db.session.add(lead)
+    db.session.commit()
+    db.session.add_all([Interacao(lead_id=lead.id, mensagem="quero emagrecer", origem="usuario"),
+                        Interacao(lead_id=lead.id, mensagem="Posso ajudar!", origem="ia")])
+    db.session.commit()
+    return lead
+
+@pytest.fixture
+def chamadas(monkeypatch):
+    """A IA não devolve resumo para nenhum lead; registra os leads de cada chamada"""
+    enviados = []
+    monkeypatch.setattr(ai_agent, 'gerar_resumos_conversa',
+                        lambda conversas: enviados.append(sorted(conversas)) or {})
+    return enviados
+
+def _rodada(lead_id=None):
+    if lead_id is not None:
+        resumo_conversa.agendar_resumo(lead_id)
+    return resumo_conversa.atualizar_resumos_pendentes()
+
+def test_atualiza_o_resumo_e_limpa_as_falhas(lead, monkeypatch):
+    db.session.add(TentativaResumo(lead_id=lead.id, tentativas=1))
+    db.session.commit()
+    monkeypatch.setattr(ai_agent, 'gerar_resumos_conversa',
+                        lambda conversas: {lead_id: "Quer emagrecer." for lead_id in conversas})
+
+    assert _rodada(lead.id) == 1
+
+    resumo = ResumoConversa.query.get(lead.id)
+    assert resumo.resumo == "Quer emagrecer."
+    assert resumo.interacoes_resumidas == 2
+    assert TentativaResumo.query.get(lead.id) is None
+    assert resumo_conversa.estatisticas()['pendentes'] == 0
+
+def test_lead_sem_resumo_para_apos_as_tentativas(lead, chamadas):
+    assert _rodada(lead.id) == 0
+    assert resumo_conversa.estatisticas()['pendentes'] == 1
+    assert _rodada() == 0
+
+    # Na segunda falha o lead sai da fila e as rodadas seguintes não chamam a IA
+    assert resumo_conversa.estatisticas()['pendentes'] == 0
+    assert _rodada() == 0
+    assert chamadas == [[lead.id], [lead.id]]
+    assert TentativaResumo.query.get(lead.id).tentativas == 2
+
+    # Nem uma nova resposta da IA o devolve ao lote durante a pausa
+    _rodada(lead.id)
+    assert chamadas == [[lead.id], [lead.id]]
+
+def test_lead_volta_ao_lote_depois_da_pausa(lead, chamadas):
+    db.session.add(TentativaResumo(lead_id=lead.id, tentativas=2,
+                                   ultima_em=datetime.utcnow() - timedelta(hours=25)))
+    db.session.commit()
+
+    _rodada(lead.id)
+
+    assert chamadas == [[lead.id]]
+    assert TentativaResumo.query.get(lead.id).tentativas == 1
+    assert resumo_conversa.estatisticas()['pendentes'] == 1
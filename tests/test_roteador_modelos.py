@@ -0,0 +1,47 @@
+"""Roteamento de modelos: classificação dos turnos, configuração das rotas e custo estimado"""
+import pytest
+from roteador_modelos import ROTA_COMPLEXA, ROTA_SIMPLES, classificar_turno, escolher_modelo, estimar_custo
+
+@pytest.fixture(autouse=True)
+def configuracao(contexto):
+    """As configurações são lidas das variáveis de ambiente de cada teste"""
+
+@pytest.mark.parametrize('mensagem, turnos, rota', [
+    ("Ok, obrigada!", 10, ROTA_SIMPLES),
+    ("bom dia", 10, ROTA_SIMPLES),
+    ("quero saber a hora", 0, ROTA_SIMPLES),
+    ("quero saber a hora que vocês abrem amanhã", 10, ROTA_COMPLEXA),
+    ("posso tomar creatina?", 0, ROTA_COMPLEXA),
+    ("obrigada, e sobre a dieta?", 0, ROTA_COMPLEXA),
+    ("a " * 100, 0, ROTA_COMPLEXA),
+])
+def test_classificacao_dos_turnos(mensagem, turnos, rota):
+    assert classificar_turno(mensagem, turnos_anteriores=turnos)[0] == rota
+
+def test_pergunta_coberta_pela_base_vai_para_o_modelo_simples():
+    mensagem = "vocês atendem aos sábados pela manhã também?"
+
+    assert classificar_turno(mensagem, [{'confianca': 0.5}], turnos_anteriores=10)[0] == ROTA_COMPLEXA
+    assert classificar_turno(mensagem, [{'confianca': 0.9}], turnos_anteriores=10) == (
+        ROTA_SIMPLES, 'respondida pela base de conhecimento')
+
+def test_modelos_de_cada_rota(monkeypatch):
+    assert escolher_modelo("ok", modelo_padrao='gpt-4o') == (ROTA_SIMPLES, 'gpt-4o-mini')
+    assert escolher_modelo("e a dieta?", modelo_padrao='gpt-4o') == (ROTA_COMPLEXA, 'gpt-4o')
+
+    monkeypatch.setenv('IA_MODELO_SIMPLES', 'modelo-pequeno')
+    monkeypatch.setenv('IA_ROTEADOR_PALAVRAS_SIMPLES', 'ok,dieta')
+    monkeypatch.setenv('IA_ROTEADOR_PALAVRAS_COMPLEXAS', 'glicemia')
+    assert escolher_modelo("ok dieta", modelo_padrao='gpt-4o') == (ROTA_SIMPLES, 'modelo-pequeno')
+
+def test_roteador_desativado_usa_o_modelo_padrao(monkeypatch):
+    monkeypatch.setenv('IA_ROTEADOR', 'false')
+
+    assert escolher_modelo("ok", modelo_padrao='gpt-4o') == (ROTA_COMPLEXA, 'gpt-4o')
+
+def test_custo_estimado():
+    assert estimar_custo('gpt-4o-mini', 1_000_000, 1_000_000) == pytest.approx(0.75)
+    # Tokens de prompt em cache custam metade; a Batch API, metade do total
+    assert estimar_custo('gpt-4o', 1_000_000, 0, tokens_cacheados=1_000_000) == pytest.approx(1.25)
+    assert estimar_custo('gpt-4o', 1_000_000, 0, lote=True) == pytest.approx(1.25)
+    assert estimar_custo('modelo-desconhecido', 1000, 1000) == 0.0
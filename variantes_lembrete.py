@@ -0,0 +1,128 @@
+"""
+Variantes de lembrete por tipo de formulário
+
+Entre leads, o lembrete de um formulário só muda no nome e no link. Por isso,
+em vez de uma chamada à IA por lead, cada tipo de formulário tem algumas
+variantes pré-geradas (tabela VarianteLembrete) com o marcador do nome. No
+envio, a variante é escolhida em rodízio e preenchida com o nome, e o link é
+acrescentado. Com as variantes em cache, o envio dos lembretes não faz
+nenhuma chamada à IA.
+
+As variantes são regeneradas fora do envio, por uma tarefa do agendador que
+roda antes da coleta das mensagens agendadas, em dois casos: quando passam de
+'ia_lembrete_variantes_validade_horas' ou quando o prompt, o modelo ou a
+quantidade mudam. A versão de cada variante é um hash desses três.
+"""
+import json
+import zlib
+import logging
+from datetime import datetime, timedelta
+from app import db
+from models import VarianteLembrete
+from cache_lru import CacheLRU
+from cache_respostas import MARCADOR_NOME
+from config_sistema import obter_config, obter_config_bool, obter_config_int
+import metricas
+
+logger = logging.getLogger(__name__)
+
+# Tempo (em segundos) que as variantes lidas do banco ficam em memória
+INTERVALO_RECARGA = 300
+
+_cache = CacheLRU(tamanho_maximo=200, ttl=INTERVALO_RECARGA)  # tipo -> (versão, textos)
+
+def variantes_ativas():
+    """Indica se os lembretes personalizados usam as variantes por tipo de formulário"""
+    return obter_config_bool('ia_lembrete_variantes', True)
+
+def _quantidade():
+    return max(1, obter_config_int('ia_lembrete_variantes_quantidade', 5))
+
+def versao_variantes(formulario_tipo):
+    """Hash do prompt, do modelo e da quantidade usados para gerar as variantes do tipo"""
+    from ai_agent import MODELO_ECONOMICO, mensagens_variantes_lembrete
+    modelo = obter_config('ia_modelo_lembrete', MODELO_ECONOMICO)
+    conteudo = json.dumps([modelo, mensagens_variantes_lembrete(formulario_tipo, _quantidade())],
+                          ensure_ascii=False)
+    return f"{zlib.crc32(conteudo.encode('utf-8')):08x}"
+
+def obter_variantes(formulario_tipo):
+    """
+    Retorna as variantes da versão atual para o tipo de formulário
+
+    Returns:
+        list: Textos com o marcador do nome (vazia se ainda não foram geradas)
+    """
+    versao = versao_variantes(formulario_tipo)
+    em_cache = _cache.obter(formulario_tipo)
+    if em_cache is not None and em_cache[0] == versao:
+        return em_cache[1]
+
+    textos = [variante.texto for variante in
+              VarianteLembrete.query.filter_by(tipo=formulario_tipo, versao=versao)
+              .order_by(VarianteLembrete.id.asc()).all()]
+    _cache.definir(formulario_tipo, (versao, textos))
+    return textos
+
+def escolher_variante(formulario_tipo, nome, rodada):
+    """
+    Preenche uma variante de lembrete com o nome do lead
+
+    Args:
+        formulario_tipo (str): Tipo do formulário
+        nome (str): Nome do lead
+        rodada (int): Número usado no rodízio (ex.: ID do lead somado aos lembretes já enviados)
+
+    Returns:
+        str: Texto do lembrete, ou None se o tipo ainda não tem variantes
+    """
+    textos = obter_variantes(formulario_tipo)
+    if not textos:
+        metricas.incrementar('lembrete_variantes_ausentes')
+        return None
+    metricas.incrementar('lembrete_variantes_usadas')
+    return textos[rodada % len(textos)].replace(MARCADOR_NOME, nome)
+
+def atualizar_variantes(tipos):
+    """
+    Gera as variantes dos tipos sem variantes, vencidas ou de outra versão
+
+    Cada tipo usa uma única chamada à IA; se ela falhar, as variantes
+    anteriores continuam em uso.
+
+    Args:
+        tipos (iterable): Tipos de formulário
+
+    Returns:
+        int: Quantidade de tipos atualizados
+    """
+    from ai_agent import gerar_variantes_lembrete
+
+    validade = datetime.utcnow() - timedelta(hours=obter_config_int('ia_lembrete_variantes_validade_horas', 168))
+    atualizados = 0
+    for tipo in sorted(set(tipos)):
+        versao = versao_variantes(tipo)
+        atuais = VarianteLembrete.query.filter_by(tipo=tipo).all()
+        if atuais and all(variante.versao == versao and variante.criado_em >= validade for variante in atuais):
+            continue
+
+        textos = gerar_variantes_lembrete(tipo, _quantidade())
+        if not textos:
+            logger.warning(f"Não foi possível gerar variantes de lembrete para '{tipo}'")
+            continue
+
+        for variante in atuais:
+            db.session.delete(variante)
+        db.session.add_all([VarianteLembrete(tipo=tipo, texto=texto, versao=versao) for texto in textos])
+        db.session.commit()
+        _cache.remover(tipo)
+        atualizados += 1
+        metricas.incrementar('lembrete_variantes_geradas', len(textos))
+        logger.info(f"{len(textos)} variantes de lembrete geradas para '{tipo}'")
+    return atualizados
+
+def estatisticas():
+    """Retorna a quantidade de tipos de formulário com variantes em memória"""
+    return {'tipos_em_cache': len(_cache)}
+
+metricas.registrar_coletor('variantes_lembrete', estatisticas)
@@ -18,6 +18,10 @@ Acredite, essa foi uma das melhores decisões que você poderia ter tomado por v
 ⬇️  *Agora, vamos às informações importantes…*"""
 ]
 
+MENSAGEM_ESPERA = """Oi, [nome]! Recebemos sua mensagem 🙌
+
+Estamos com muitos atendimentos neste momento, mas já vamos te responder com todos os detalhes. Obrigado pela paciência!"""
+
 ETAPAS_FLUXO = {
     'PRIMEIRO_CONTATO': 'Primeiro Contato [Boas-vindas]',
     'FOLLOW_UP_1': 'Follow Up 1 [após 24h]',
@@ -29,3 +33,7 @@ ETAPAS_FLUXO = {
 def get_mensagem_boas_vindas(nome):
     """Retorna a mensagem de boas vindas formatada com o nome do cliente"""
     return MENSAGENS_BOASVINDAS[0].replace('[nome]', nome)
+
+def get_mensagem_espera(nome):
+    """Retorna a mensagem enviada enquanto a resposta completa é gerada"""
+    return MENSAGEM_ESPERA.replace('[nome]', nome)
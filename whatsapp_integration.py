@@ -1,16 +1,28 @@
 import os
 import logging
+import threading
+from concurrent.futures import TimeoutError as TempoEsgotado
 from twilio.rest import Client
 from database import db
 from models import Lead, Interacao
-from ai_agent import processar_mensagem, agente_boas_vindas, analisar_sentimento_cliente
+from sqlalchemy import func
+from ai_agent import processar_mensagem_com_analise, agente_boas_vindas, ANALISE_NEUTRA
 from notification import formatar_numero_internacional, notificar_potencial_conversao
+from fila_whatsapp import enfileirar_por_lead
+from agrupamento_mensagens import agrupador, obter_janela_agrupamento, unir_mensagens
+from controle_admissao import controle_admissao
+from whatsapp_flows import get_mensagem_espera
+from config_sistema import obter_config_float
+import metricas
 
 # Configurações do Twilio para WhatsApp
 TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN")
 TWILIO_PHONE_NUMBER = os.environ.get("TWILIO_PHONE_NUMBER")
 
+# Resposta enviada quando a mensagem não pôde ser processada
+MENSAGEM_PROBLEMA_TECNICO = "Desculpe, estamos com problemas técnicos. Por favor, tente novamente mais tarde."
+
 logger = logging.getLogger(__name__)
 
 def enviar_mensagem_whatsapp(numero_destino, mensagem):
@@ -53,97 +65,302 @@ def enviar_mensagem_whatsapp(numero_destino, mensagem):
         logger.error(f"Erro ao enviar mensagem WhatsApp: {str(e)}")
         return False
 
-def processar_mensagem_whatsapp(mensagem_de, mensagem_texto):
+def registrar_mensagem_recebida(mensagem_de, mensagem_texto):
     """
-    Processa uma mensagem recebida via WhatsApp
+    Identifica (ou cria) o lead remetente e registra a mensagem recebida
     
     Args:
         mensagem_de (str): Número do remetente
         mensagem_texto (str): Conteúdo da mensagem
     
+    Returns:
+        tuple: (lead, novo_lead) com o lead da conversa e se ele acabou de ser criado
+    """
+    # Remover o prefixo 'whatsapp:' se existir
+    if mensagem_de.startswith('whatsapp:'):
+        mensagem_de = mensagem_de[9:]
+    
+    # Normalizar o número para consulta no banco
+    telefone_normalizado = formatar_numero_internacional(mensagem_de)
+    
+    # Verificar se o lead já existe
+    lead = Lead.query.filter_by(telefone=telefone_normalizado).first()
+    novo_lead = lead is None
+    
+    if novo_lead:
+        # Extrair possível nome da mensagem
+        nome_extraido = extrair_nome_da_mensagem(mensagem_texto)
+        nome = nome_extraido if nome_extraido else "Cliente"
+        
+        # Criar novo lead
+        lead = Lead(
+            nome=nome,
+            telefone=telefone_normalizado,
+            fonte='whatsapp',
+            status='novo'
+        )
+        db.session.add(lead)
+        db.session.commit()
+    
+    # Registrar a interação do cliente
+    interacao_cliente = Interacao(
+        lead_id=lead.id,
+        mensagem=mensagem_texto,
+        origem="usuario"
+    )
+    db.session.add(interacao_cliente)
+    db.session.commit()
+    
+    return lead, novo_lead
+
+def gerar_resposta_whatsapp(lead, mensagem_texto, novo_lead=False, ao_receber_parte=None):
+    """
+    Gera e registra a resposta para uma mensagem já registrada
+    
+    Se o controle de admissão rejeitar a chamada à IA, o lead recebe uma
+    mensagem de espera e a resposta completa é enviada depois pela API REST.
+    Com a fila de respostas adiadas cheia, a mensagem não é respondida e o
+    lead recebe a mensagem de problema técnico.
+    
+    Args:
+        lead (Lead): Lead que enviou a mensagem
+        mensagem_texto (str): Conteúdo da mensagem
+        novo_lead (bool): Se o lead acabou de ser criado (recebe boas-vindas)
+        ao_receber_parte (callable): Envia as partes de uma resposta da IA gerada
+            em streaming (apenas quando a resposta sai pela API REST)
+    
     Returns:
         str: Resposta gerada pelo sistema
     """
+    if novo_lead:
+        # Gerar mensagem de boas-vindas
+        resposta = agente_boas_vindas(lead.nome)
+        _registrar_resposta(lead.id, resposta, "ia")
+        return resposta
+    
+    inicio = controle_admissao.admitir(lead.id)
+    if inicio is None:
+        # Sistema sobrecarregado: responder agora com a mensagem de espera
+        if controle_admissao.adiar(lead.id, mensagem_texto, responder_mensagem_adiada):
+            resposta = get_mensagem_espera(lead.nome)
+        else:
+            resposta = MENSAGEM_PROBLEMA_TECNICO
+        _registrar_resposta(lead.id, resposta, "sistema")
+        return resposta
+    
     try:
-        # Remover o prefixo 'whatsapp:' se existir
-        if mensagem_de.startswith('whatsapp:'):
-            mensagem_de = mensagem_de[9:]
-        
-        # Normalizar o número para consulta no banco
-        telefone_normalizado = formatar_numero_internacional(mensagem_de)
-        
-        # Verificar se o lead já existe
-        lead = Lead.query.filter_by(telefone=telefone_normalizado).first()
+        return _responder_com_ia(lead, mensagem_texto, ao_receber_parte)
+    finally:
+        controle_admissao.liberar(inicio)
+
+def _responder_com_ia(lead, mensagem_texto, ao_receber_parte=None):
+    """Gera a resposta com IA, registra a interação e a análise de sentimento"""
+    # Processar a mensagem com IA (resposta e análise de sentimento)
+    resposta, analise = processar_mensagem_com_analise(lead.id, mensagem_texto, ao_receber_parte)
+    
+    # Registrar a análise nas mensagens do cliente e no lead, antes da resposta
+    # (com a análise em lote ativa, ela é feita depois, em segundo plano)
+    try:
+        registrar_analise(lead.id, analise)
+        # Se a probabilidade de conversão for alta, notificar administrador
+        if analise and analise.get('prob_conversao', 0) > 0.8:
+            notificar_potencial_conversao(lead.nome, lead.telefone, analise['prob_conversao'])
+    except Exception as e:
+        logger.error(f"Erro ao registrar análise de sentimento: {str(e)}")
+    
+    # Registrar a resposta
+    interacao_resposta = Interacao(
+        lead_id=lead.id,
+        mensagem=resposta,
+        origem="ia"
+    )
+    db.session.add(interacao_resposta)
+    db.session.commit()
+    return resposta
+
+def registrar_analise(lead_id, analise):
+    """
+    Grava a análise de sentimento de um turno do cliente
+    
+    O sentimento é registrado nas mensagens do cliente ainda sem resposta da
+    IA (o turno atual, que pode ter várias mensagens agrupadas ou adiadas) e a
+    probabilidade de conversão vira a pontuação do lead. Mensagens do sistema,
+    como a de espera de uma resposta adiada, não encerram o turno. Análises
+    neutras de erro são ignoradas.
+    
+    Args:
+        lead_id (int): ID do lead
+        analise (dict): Resultado da análise de sentimento
+    """
+    if not analise or analise == ANALISE_NEUTRA:
+        return
+    
+    ultima_resposta = db.session.query(func.max(Interacao.id)).filter(
+        Interacao.lead_id == lead_id,
+        Interacao.origem == "ia"
+    ).scalar() or 0
+    
+    Interacao.query.filter(
+        Interacao.lead_id == lead_id,
+        Interacao.origem == "usuario",
+        Interacao.id > ultima_resposta
+    ).update({Interacao.sentimento: analise.get('sentimento')}, synchronize_session=False)
+    
+    lead = Lead.query.get(lead_id)
+    if lead is not None and analise.get('prob_conversao') is not None:
+        lead.score = analise['prob_conversao']
+    db.session.commit()
+
+def _registrar_resposta(lead_id, resposta, origem):
+    """Registra uma resposta que não passou pela IA"""
+    interacao_resposta = Interacao(
+        lead_id=lead_id,
+        mensagem=resposta,
+        origem=origem
+    )
+    db.session.add(interacao_resposta)
+    db.session.commit()
+
+def responder_mensagem_adiada(lead_id, mensagem_texto):
+    """
+    Gera a resposta completa de uma mensagem rejeitada pelo controle de admissão
+    
+    Args:
+        lead_id (int): ID do lead
+        mensagem_texto (str): Mensagens adiadas do lead, já unidas
+    
+    Returns:
+        bool: True se a resposta foi enviada com sucesso, False caso contrário
+    """
+    lead = Lead.query.get(lead_id)
+    if not lead:
+        logger.error(f"Lead ID {lead_id} não encontrado para resposta adiada")
+        return False
+    
+    resposta = _responder_com_ia(lead, mensagem_texto)
+    return enviar_mensagem_whatsapp(lead.telefone, resposta)
+
+def processar_mensagem_whatsapp(mensagem_de, mensagem_texto):
+    """
+    Processa uma mensagem recebida via WhatsApp
+
+    Com a janela de agrupamento ativa, a requisição não espera o grupo fechar:
+    a mensagem é agrupada como em enfileirar_mensagem_whatsapp e a resposta do
+    grupo segue pela API REST. Sem agrupamento, a resposta é aguardada por até
+    'whatsapp_tempo_maximo_resposta' segundos antes de liberar a thread.
+
+    Args:
+        mensagem_de (str): Número do remetente
+        mensagem_texto (str): Conteúdo da mensagem
+    
+    Returns:
+        str: Resposta gerada pelo sistema, ou None se a resposta será enviada
+             depois pela API REST
+    """
+    try:
+        lead, novo_lead = registrar_mensagem_recebida(mensagem_de, mensagem_texto)
         
-        if not lead:
-            # Extrair possível nome da mensagem
-            nome_extraido = extrair_nome_da_mensagem(mensagem_texto)
-            nome = nome_extraido if nome_extraido else "Cliente"
-            
-            # Criar novo lead
-            lead = Lead(
-                nome=nome,
-                telefone=telefone_normalizado,
-                fonte='whatsapp',
-                status='novo'
-            )
-            db.session.add(lead)
-            db.session.commit()
-            
-            # Gerar mensagem de boas-vindas
-            resposta = agente_boas_vindas(nome)
-            
-            # Registrar a interação
-            interacao_cliente = Interacao(
-                lead_id=lead.id,
-                mensagem=mensagem_texto,
-                origem="usuario"
-            )
-            db.session.add(interacao_cliente)
-            
-            interacao_resposta = Interacao(
-                lead_id=lead.id,
-                mensagem=resposta,
-                origem="ia"
-            )
-            db.session.add(interacao_resposta)
-            
-        else:
-            # Registrar a interação do cliente
-            interacao_cliente = Interacao(
-                lead_id=lead.id,
-                mensagem=mensagem_texto,
-                origem="usuario"
-            )
-            db.session.add(interacao_cliente)
-            db.session.commit()
-            
-            # Processar a mensagem com IA
-            resposta = processar_mensagem(lead.id, mensagem_texto)
-            
-            # Registrar a resposta
-            interacao_resposta = Interacao(
-                lead_id=lead.id,
-                mensagem=resposta,
-                origem="ia"
-            )
-            db.session.add(interacao_resposta)
-            
-            # Analisar sentimento para possível conversão
-            try:
-                analise = analisar_sentimento_cliente(mensagem_texto)
-                # Se a probabilidade de conversão for alta, notificar administrador
-                if analise.get('prob_conversao', 0) > 0.8:
-                    notificar_potencial_conversao(lead.nome, lead.telefone, analise['prob_conversao'])
-            except Exception as e:
-                logger.error(f"Erro ao analisar sentimento: {str(e)}")
+        janela, espera_maxima = obter_janela_agrupamento()
+        if janela > 0:
+            if agrupador.adicionar(lead.id, mensagem_texto, novo_lead):
+                _agendar_grupo(lead.id, janela, espera_maxima)
+            return None
         
-        db.session.commit()
-        return resposta
+        # A resposta é gerada na faixa do lead, que executa as mensagens de uma
+        # mesma conversa em série e na ordem de chegada
+        futuro = enfileirar_por_lead(lead.id, _gerar_resposta_por_id,
+                                     lead.id, mensagem_texto, novo_lead)
+        # A Twilio desiste do webhook após 15 segundos
+        try:
+            return futuro.result(timeout=obter_config_float('whatsapp_tempo_maximo_resposta', 12.0))
+        except TempoEsgotado:
+            # Se a faixa ainda não começou a tarefa, ela não é mais executada
+            futuro.cancel()
+            metricas.incrementar('whatsapp_respostas_expiradas')
+            logger.warning(f"Resposta para o lead {lead.id} não ficou pronta a tempo")
+            return MENSAGEM_PROBLEMA_TECNICO
         
     except Exception as e:
         logger.error(f"Erro ao processar mensagem WhatsApp: {str(e)}")
-        return "Desculpe, estamos com problemas técnicos. Por favor, tente novamente mais tarde."
+        return MENSAGEM_PROBLEMA_TECNICO
+
+def _gerar_resposta_por_id(lead_id, mensagem_texto, novo_lead):
+    """Carrega o lead na sessão da faixa de processamento e gera a resposta"""
+    lead = Lead.query.get(lead_id)
+    if not lead:
+        raise ValueError(f"Lead ID {lead_id} não encontrado")
+    return gerar_resposta_whatsapp(lead, mensagem_texto, novo_lead)
+
+def enfileirar_mensagem_whatsapp(mensagem_de, mensagem_texto):
+    """
+    Registra a mensagem recebida e agenda a resposta em segundo plano
+    
+    A resposta é gerada por uma thread do pool de processamento e enviada
+    pela API REST da Twilio. Mensagens de um mesmo lead são respondidas
+    na ordem em que chegaram; com a janela de agrupamento ativa, mensagens
+    consecutivas recebem uma única resposta.
+    
+    Args:
+        mensagem_de (str): Número do remetente
+        mensagem_texto (str): Conteúdo da mensagem
+    """
+    lead, novo_lead = registrar_mensagem_recebida(mensagem_de, mensagem_texto)
+    
+    janela, espera_maxima = obter_janela_agrupamento()
+    if janela <= 0:
+        enfileirar_por_lead(lead.id, responder_mensagem_em_segundo_plano,
+                            lead.id, mensagem_texto, novo_lead)
+    elif agrupador.adicionar(lead.id, mensagem_texto, novo_lead):
+        _agendar_grupo(lead.id, janela, espera_maxima)
+
+def _agendar_grupo(lead_id, janela, espera_maxima):
+    """Enfileira a resposta do grupo de mensagens do lead quando a janela expirar"""
+    restante = agrupador.tempo_restante(lead_id, janela, espera_maxima)
+    if restante > 0:
+        timer = threading.Timer(restante, _agendar_grupo, (lead_id, janela, espera_maxima))
+        timer.daemon = True
+        timer.start()
+        return
+    
+    textos, novo_lead = agrupador.coletar(lead_id)
+    if textos:
+        enfileirar_por_lead(lead_id, responder_mensagem_em_segundo_plano,
+                            lead_id, unir_mensagens(textos), novo_lead)
+
+def responder_mensagem_em_segundo_plano(lead_id, mensagem_texto, novo_lead):
+    """
+    Gera a resposta de uma mensagem enfileirada e a envia ao lead
+    
+    Args:
+        lead_id (int): ID do lead
+        mensagem_texto (str): Conteúdo da mensagem
+        novo_lead (bool): Se o lead acabou de ser criado
+    
+    Returns:
+        bool: True se a resposta foi enviada com sucesso, False caso contrário
+    """
+    lead = Lead.query.get(lead_id)
+    if not lead:
+        logger.error(f"Lead ID {lead_id} não encontrado para resposta em segundo plano")
+        return False
+    
+    # Respostas da IA geradas em streaming são enviadas em partes, à medida que ficam prontas
+    partes_enviadas = []
+    def enviar_parte(parte):
+        partes_enviadas.append(enviar_mensagem_whatsapp(lead.telefone, parte))
+    
+    try:
+        resposta = gerar_resposta_whatsapp(lead, mensagem_texto, novo_lead, enviar_parte)
+    except Exception as e:
+        logger.error(f"Erro ao gerar resposta em segundo plano: {str(e)}")
+        db.session.rollback()
+        if partes_enviadas:
+            return False
+        resposta = "Desculpe, estamos com problemas técnicos. Por favor, tente novamente mais tarde."
+    
+    if partes_enviadas:
+        return all(partes_enviadas)
+    return enviar_mensagem_whatsapp(lead.telefone, resposta)
 
 def extrair_nome_da_mensagem(mensagem):
     """
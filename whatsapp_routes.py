@@ -4,7 +4,9 @@ from twilio.twiml.messaging_response import MessagingResponse
 from app import app
 from database import db
 from models import Lead, Interacao
-from whatsapp_integration import processar_mensagem_whatsapp, enviar_mensagem_whatsapp
+from whatsapp_integration import processar_mensagem_whatsapp, enfileirar_mensagem_whatsapp, enviar_mensagem_whatsapp
+from config_sistema import obter_config_bool
+from idempotencia import reservar_mensagem, registrar_resposta, liberar_mensagem
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,25 +18,54 @@ def whatsapp_webhook():
 
     Essa rota recebe as notificações da Twilio quando uma nova mensagem é enviada
     para o número do WhatsApp. A mensagem é processada e uma resposta é enviada.
+
+    Com a configuração 'whatsapp_resposta_assincrona' ativa, a mensagem é apenas
+    registrada e o webhook devolve um TwiML vazio; a resposta é gerada em segundo
+    plano e enviada pela API REST da Twilio.
+
+    Reenvios da Twilio (mesmo MessageSid) são respondidos com o resultado
+    já armazenado, sem processar a mensagem novamente.
     """
+    message_sid = None
     try:
         # Extrair informações da requisição
         mensagem_de = request.values.get('From', '')
         mensagem_texto = request.values.get('Body', '')
+        message_sid = request.values.get('MessageSid')
 
         logger.info(f"Mensagem recebida via WhatsApp de {mensagem_de}: {mensagem_texto}")
 
+        duplicada, resposta_anterior = reservar_mensagem(message_sid)
+        if duplicada:
+            resp = MessagingResponse()
+            if resposta_anterior:
+                resp.message(resposta_anterior)
+            return str(resp)
+
+        if obter_config_bool('whatsapp_resposta_assincrona', False):
+            # Confirmar o recebimento imediatamente; a resposta segue pela API REST
+            enfileirar_mensagem_whatsapp(mensagem_de, mensagem_texto)
+            registrar_resposta(message_sid, '')
+            return str(MessagingResponse())
+
         # Processar a mensagem e gerar resposta
         resposta = processar_mensagem_whatsapp(mensagem_de, mensagem_texto)
 
-        # Preparar resposta para o Twilio
+        if registrar_resposta(message_sid, resposta) and resposta:
+            # A Twilio reenviou a mensagem enquanto ela era processada, então este
+            # TwiML não será entregue; enviar a resposta pela API REST
+            enviar_mensagem_whatsapp(mensagem_de, resposta)
+
+        # Preparar resposta para o Twilio (mensagens agrupadas não geram resposta própria)
         resp = MessagingResponse()
-        resp.message(resposta)
+        if resposta:
+            resp.message(resposta)
 
         return str(resp)
 
     except Exception as e:
         logger.error(f"Erro no webhook do WhatsApp: {str(e)}")
+        liberar_mensagem(message_sid)
         # Mesmo em caso de erro, precisamos retornar uma resposta válida para o Twilio
         resp = MessagingResponse()
         resp.message("Estamos com dificuldades técnicas. Por favor, tente novamente mais tarde.")